@@ -0,0 +1,257 @@
+"""Throughput and latency benchmark for the acquisition path.
+
+Runs the real pipeline headlessly (offscreen Qt): SerialThread -> batched
+reader -> SpectrophotometerUI.handle_serial_batch -> parsing, absorbance,
+session store and the display-rate label refresh. Stream lines come from an
+in-memory byte source or from the virtual device on a pty, at increasing
+rates. For every rate the sustained throughput, byte-to-handler and
+byte-to-label latency percentiles, dropped samples, CPU and memory are
+reported as one JSON document, so runs can be compared between releases.
+
+    python benchmarks/bench_acquisition.py --rates 100 1000 10000 50000 --output bench.json
+    python benchmarks/bench_acquisition.py --source pty --rates 100 500 1000
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from PySide6.QtCore import QTimer  # noqa: E402
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+import intellispec_ui  # noqa: E402
+from intellispec.simulator import VirtualSpectrophotometer  # noqa: E402
+
+DRAIN_TIME = 1.0  # seconds allowed for the pipeline to catch up after the source stops
+
+
+class MemorySerial:
+    # Stand-in for serial.Serial that produces 'S:<seq>,<voltage>' stream
+    # lines at a fixed rate once it receives a 'stream' command. Line `seq`
+    # becomes readable at start + seq / rate, which is its arrival time.
+
+    def __init__(self, port, baudrate=9600, timeout=None, rate=1000, duration=1.0):
+        self.timeout = timeout or 0.05
+        self.rate = rate
+        self.total = int(rate * duration)
+        self.start = None
+        self.emitted = 0
+        self.is_open = True
+
+    def arrival_time(self, seq):
+        return self.start + seq / self.rate
+
+    def _due(self):
+        if self.start is None:
+            return 0
+        return min(self.total, int((time.monotonic() - self.start) * self.rate))
+
+    @property
+    def in_waiting(self):
+        return max(0, self._due() - self.emitted) * 16
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            due = self._due()
+            if due > self.emitted or not self.is_open:
+                break
+            now = time.monotonic()
+            if now >= deadline:
+                return b''
+            wait = deadline - now
+            if self.start is not None and self.emitted < self.total:
+                wait = min(wait, max(0.0, self.arrival_time(self.emitted + 1) - now))
+            time.sleep(wait)
+        data = b''.join(b'S:%d,%.3f\r\n' % (seq, 1.5 + (seq % 100) * 0.001)
+                        for seq in range(self.emitted, due))
+        self.emitted = due
+        return data
+
+    def write(self, data):
+        if data.startswith(b'stream') and self.start is None:
+            self.start = time.monotonic()
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+
+
+def run_simulator(conn):
+    # Runs in a separate process so the device keeps its timing while the
+    # UI process is busy; time.monotonic() is system-wide, so arrival times
+    # computed from `started` are comparable across the two processes.
+    device = VirtualSpectrophotometer(noise=0.002)
+    conn.send((device.start(), device.started))
+    conn.recv()
+    conn.send(device.samples_streamed)
+    device.stop()
+
+
+def percentile_ms(values, q):
+    if not len(values):
+        return None
+    return round(float(np.percentile(values, q)) * 1000, 3)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return None
+
+
+def run_rate(app, source, rate, duration):
+    sources = []
+    simulator = None
+    if source == 'memory':
+        def factory(port, baudrate, timeout=None):
+            sources.append(MemorySerial(port, baudrate, timeout, rate=rate, duration=duration))
+            return sources[-1]
+        window = intellispec_ui.SpectrophotometerUI(['bench'], serial_factory=factory)
+        port = 'bench'
+    else:
+        conn, child_conn = multiprocessing.Pipe()
+        simulator = multiprocessing.get_context('spawn').Process(target=run_simulator, args=(child_conn,))
+        simulator.start()
+        port, device_started = conn.recv()
+        window = intellispec_ui.SpectrophotometerUI([port])
+
+    handled_latency = []
+    display_latency = []
+    last_seq = [None]
+    last_handled = [None]
+
+    def arrival(seqs):
+        if simulator is not None:
+            return device_started + np.asarray(seqs) / 1000.0  # seq is device millis
+        return sources[0].start + np.asarray(seqs) / rate
+
+    record_stream = window.record_stream
+    refresh_stream_display = window.refresh_stream_display
+
+    def timed_record_stream(samples):
+        now = time.monotonic()
+        seqs = np.array([sample[0] for sample in samples])
+        handled_latency.append(now - arrival(seqs))
+        last_seq[0] = seqs[-1]
+        record_stream(samples)
+        last_handled[0] = time.monotonic()
+
+    def timed_refresh():
+        pending = window.stream_display._count
+        refresh_stream_display()
+        if pending and last_seq[0] is not None:
+            display_latency.append(time.monotonic() - float(arrival([last_seq[0]])[0]))
+
+    window.record_stream = timed_record_stream
+    window.display_timer.timeout.disconnect()
+    window.display_timer.timeout.connect(timed_refresh)
+    window.initial_voltage = 4.2
+    window.rate_spin.setMaximum(max(rate, window.rate_spin.maximum()))
+    window.rate_spin.setValue(rate)
+    window.connect_to_port(port)
+
+    def spin(seconds):
+        QTimer.singleShot(int(seconds * 1000), app.quit)
+        app.exec()
+
+    spin(0.2)
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    window.toggle_stream(True)
+    spin(duration)
+    wall_stream = time.monotonic() - wall_start
+    cpu_stream = time.process_time() - cpu_start
+    if simulator is not None:
+        window.toggle_stream(False)
+    spin(DRAIN_TIME)
+    if simulator is None:
+        window.toggle_stream(False)
+
+    reader = window.serial_thread.reader
+    dropped = reader.dropped_lines if reader else 0
+    handled = window.stream_count
+    window.close()
+    if simulator is not None:
+        conn.send('stop')
+        generated = conn.recv()
+        simulator.join()
+    else:
+        generated = sources[0].emitted
+
+    handled_latency = np.concatenate(handled_latency) if handled_latency else np.empty(0)
+    # Sustained rate: samples handled over the time from stream start to the
+    # last handled batch, which includes any catch-up after the source stopped
+    elapsed = (last_handled[0] - wall_start) if last_handled[0] else wall_stream
+    return {
+        'source': source,
+        'target_rate': rate,
+        'duration_s': round(wall_stream, 3),
+        'generated': int(generated),
+        'handled': int(handled),
+        'dropped': int(dropped),
+        'backlog': int(generated - handled - dropped),
+        'throughput_lines_per_s': round(handled / elapsed, 1),
+        'handler_latency_ms': {'p50': percentile_ms(handled_latency, 50),
+                               'p99': percentile_ms(handled_latency, 99),
+                               'max': percentile_ms(handled_latency, 100)},
+        'display_latency_ms': {'p50': percentile_ms(display_latency, 50),
+                               'p99': percentile_ms(display_latency, 99)},
+        'cpu_percent': round(100 * cpu_stream / wall_stream, 1),
+        'rss_mb': rss_mb(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the IntelliSpec acquisition path.")
+    parser.add_argument('--source', choices=('memory', 'pty'), default='memory')
+    parser.add_argument('--rates', type=int, nargs='+', default=[100, 1000, 5000, 20000, 50000],
+                        help="stream lines per second to test")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per rate")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ['INTELLISPEC_DATA_DIR'] = data_dir
+        for rate in args.rates:
+            # The UI prints diagnostics per line; keep them out of the report
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                results.append(run_rate(app, args.source, rate, args.duration))
+            print(f"{rate:>7} lines/s: {results[-1]['throughput_lines_per_s']:>9} handled/s, "
+                  f"p99 {results[-1]['handler_latency_ms']['p99']} ms, "
+                  f"dropped {results[-1]['dropped']}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'acquisition',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 1024), 1),
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
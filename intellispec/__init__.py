@@ -0,0 +1 @@
+"""Acquisition, protocol and analysis code shared by the IntelliSpec UI and tools."""
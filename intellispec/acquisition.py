@@ -0,0 +1,252 @@
+"""Acquisition state machine driven by the device's replies.
+
+Each command moves the machine into a busy state and is finished by the
+parsed record that the firmware prints when it is done: `calibrate` by the
+`Initial Voltage (Blank):` line, `read` by the `Voltage:` line. Commands
+submitted while the device is busy are queued and sent as soon as the
+previous one completes. The per-command timeout is only a fallback; when it
+fires, a reply that still arrives for the abandoned command is discarded
+instead of being credited to the next one (see LateReplies).
+"""
+
+import time
+from collections import deque, namedtuple
+
+from .protocol import (BaudRate, BinaryMode, BlankVoltage, DarkVoltage, Message, RawDone, SampleVoltage,
+                       ScanDone)
+
+IDLE = 'idle'
+CALIBRATING = 'calibrating'
+MEASURING = 'measuring'
+STREAMING = 'streaming'
+RUNNING = 'running'     # a RunScheduler owns the link
+CONFIGURING = 'configuring'  # changing the link's baud rate or framing
+
+# payload: bytes to send; state: state while it runs; completes_on: record
+# type that finishes it (None = runs until stopped); timeout: seconds
+Command = namedtuple('Command', 'name payload state completes_on timeout')
+
+# The sketch waits 10 s (calibrate) and 5 s (read) before replying
+CALIBRATE = Command('calibrate', b'calibrate\n', CALIBRATING, BlankVoltage, 15.0)
+READ = Command('read', b'read\n', MEASURING, SampleVoltage, 8.0)
+# Dark signal only, with the LED switched off briefly; no blank needed
+DARK = Command('dark', b'dark\n', CALIBRATING, DarkVoltage, 3.0)
+# Spectral scans over every LED; no placement delay, a few hundred ms per scan
+SCAN_BLANK = Command('scan blank', b'scan blank\n', CALIBRATING, ScanDone, 5.0)
+SCAN = Command('scan', b'scan\n', MEASURING, ScanDone, 5.0)
+# Placeholder held while a queued run sends its own commands
+RUN = Command('run', b'', RUNNING, None, None)
+
+MAX_OVERSAMPLE = 1000  # raw samples per 'oversample <k>', the sketch clamps to the same value
+
+DEFAULT_BAUDRATE = 9600
+# Rates the sketch accepts for 'baud <rate>'
+BAUD_RATES = (9600, 19200, 38400, 57600, 115200, 230400, 250000, 500000, 1000000)
+
+# Messages the sketch prints as it starts calibrate, read and oversample
+START_BANNERS = ('Calibrating dark signal', 'Place the sample.')
+# Seconds after its timeout that a reply is still taken as late, for
+# commands the sketch doesn't announce
+LATE_REPLY_GRACE = 5.0
+
+
+def oversample_command(count):
+    # The sketch waits 5 s, then prints `count` raw lines, about 10 ms each
+    # at 9600 baud
+    return Command('oversample', f'oversample {count}\n'.encode(), MEASURING, RawDone,
+                   READ.timeout + count * 0.015)
+
+
+def baud_command(rate):
+    # Firmware without the command answers 'Invalid command' and the link
+    # stays at its current speed once this times out
+    return Command('baud', f'baud {rate}\n'.encode(), CONFIGURING, BaudRate, 2.0)
+
+
+def binary_command(enabled):
+    return Command('binary', f'binary {int(enabled)}\n'.encode(), CONFIGURING, BinaryMode, 2.0)
+
+
+def stream_command(rate):
+    return Command('stream', f'stream {rate}\n'.encode(), STREAMING, None, None)
+
+
+def is_start_banner(record):
+    return isinstance(record, Message) and record.text.startswith(START_BANNERS)
+
+
+class LateReplies:
+    # Replies still owed to abandoned (timed-out or cancelled) commands, so a
+    # late one isn't credited to the command after it. The firmware works
+    # through commands in order, so once a command sent after an abandoned
+    # one announces itself the abandoned one is done, and a reply that hasn't
+    # come by then never will: its credit is dropped. Credits also lapse at
+    # a deadline, for commands that aren't announced. Either way a lost reply
+    # costs at most one discarded record, not an offset on every later one.
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._credits = []  # [record type, banners due up to its own command, deadline], oldest first
+
+    def __len__(self):
+        return len(self._credits)
+
+    def add(self, record_type, banners_due=0, wait=LATE_REPLY_GRACE):
+        # banners_due: start banners still to come from the abandoned command
+        # and the ones sent before it (0 once it has started)
+        self._credits.append([record_type, banners_due, self.clock() + wait])
+
+    def extend(self, other):
+        # Takes over the credits of another tracker on the same link
+        self._credits += other._credits
+        other._credits = []
+
+    def clear(self):
+        self._credits = []
+
+    def started(self):
+        # A start banner arrived. Returns True when it belongs to an abandoned
+        # command; the credits of commands before that one are settled.
+        claimed = any(credit[1] > 0 for credit in self._credits)
+        for credit in self._credits:
+            credit[1] -= 1
+        self._credits = [credit for credit in self._credits if credit[1] >= 0]
+        return claimed
+
+    def take(self, record):
+        # True when the record is the late reply of an abandoned command
+        now = self.clock()
+        self._credits = [credit for credit in self._credits if credit[2] > now]
+        for index, credit in enumerate(self._credits):
+            if credit[0] is type(record):
+                del self._credits[index]
+                return True
+        return False
+
+
+class AcquisitionStateMachine:
+
+    def __init__(self, send, on_state_changed=None, on_timeout=None, clock=time.monotonic):
+        self.send = send
+        self.on_state_changed = on_state_changed
+        self.on_timeout = on_timeout
+        self.clock = clock
+        self.state = IDLE
+        self.current = None
+        self.deadline = None
+        self.queue = deque()
+        self.late = LateReplies(clock)
+
+    @property
+    def busy(self):
+        return self.current is not None
+
+    def submit(self, command):
+        self.queue.append(command)
+        self._start_next()
+
+    def calibrate(self):
+        self.submit(CALIBRATE)
+
+    def read(self):
+        self.submit(READ)
+
+    def measure_dark(self):
+        self.submit(DARK)
+
+    def scan_blank(self):
+        self.submit(SCAN_BLANK)
+
+    def scan(self):
+        self.submit(SCAN)
+
+    def oversample(self, count):
+        self.submit(oversample_command(count))
+
+    def configure_link(self, baudrate, binary):
+        self.submit(baud_command(baudrate))
+        self.submit(binary_command(binary))
+
+    def start_stream(self, rate):
+        self.submit(stream_command(rate))
+
+    def stop_stream(self):
+        if self.current is not None and self.current.state == STREAMING:
+            self.send(b'stop\n')
+            self._finish()
+
+    def begin_run(self, late=None):
+        # late: the run scheduler's LateReplies, which takes over the replies
+        # still owed to commands abandoned before the run
+        if late is not None:
+            late.extend(self.late)
+        self.submit(RUN)
+
+    def end_run(self, late=None):
+        # Replies still owed to the run's cancelled or timed-out reads come
+        # back here, so they aren't taken for the next command
+        if late is not None:
+            self.late.extend(late)
+        if self.current is RUN:
+            self._finish()
+
+    def reset(self):
+        # Connection lost or replaced: nothing that was pending will complete
+        self.queue.clear()
+        self.late.clear()
+        self.current = None
+        self.deadline = None
+        self._set_state(IDLE)
+
+    def time_remaining(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.clock())
+
+    def handle_record(self, record):
+        # Returns False when the record is a late reply to a timed-out command
+        # and should be ignored.
+        if is_start_banner(record):
+            self.late.started()
+            return True
+        if self.late.take(record):
+            return False
+        if self.current is not None and self.current.completes_on is type(record):
+            self._finish()
+        return True
+
+    def check_timeout(self):
+        command = self.current
+        if command is None or self.deadline is None or self.clock() < self.deadline:
+            return False
+        # Without its reply by now, an announced command has started and the
+        # next banner settles it; one that never reached the device lapses
+        self.late.add(command.completes_on)
+        if self.on_timeout:
+            self.on_timeout(command)
+        self._finish()
+        return True
+
+    def _finish(self):
+        self.current = None
+        self.deadline = None
+        if not self.queue:
+            self._set_state(IDLE)
+        self._start_next()
+
+    def _start_next(self):
+        if self.current is not None or not self.queue:
+            return
+        command = self.queue.popleft()
+        self.current = command
+        self.deadline = None if command.timeout is None else self.clock() + command.timeout
+        if command.payload:
+            self.send(command.payload)
+        self._set_state(command.state, force=True)
+
+    def _set_state(self, state, force=False):
+        if state == self.state and not force:
+            return
+        self.state = state
+        if self.on_state_changed:
+            self.on_state_changed(state)
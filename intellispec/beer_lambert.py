@@ -0,0 +1,65 @@
+"""Absorbance and transmittance from photodiode voltages.
+
+A = log10((V0 - Vd) / (V - Vd) - 0.5), clamped to 2.00 A when either
+difference is not positive, when the ratio exceeds 100 or when the log is
+not finite. Transmittance is 100 * 10^-A, and 0 % at the ceiling.
+
+`absorbance`/`transmittance` handle a single reading; the `_batch` variants
+take whole arrays of voltages and give identical results. NumPy is only
+imported by the `_batch` variants, so scalar use stays cheap to import.
+
+The 0.5 offset is what the UI has always recorded. `absorbance_batch` takes
+another `ratio_offset` (0 is the plain ratio the sketch uses) so recorded
+sessions can be recomputed with a corrected formula; see reprocess.py.
+"""
+
+import math
+
+DEFAULT_DARK_VOLTAGE = 0.110
+ABSORBANCE_CEILING = 2.00
+MAX_RATIO = 100
+RATIO_OFFSET = 0.5
+
+
+def absorbance(voltage, initial_voltage, dark_voltage=DEFAULT_DARK_VOLTAGE):
+    numerator = initial_voltage - dark_voltage
+    denominator = voltage - dark_voltage
+    if denominator <= 0 or numerator <= 0:
+        return ABSORBANCE_CEILING
+    ratio = numerator / denominator - RATIO_OFFSET
+    if ratio > MAX_RATIO or ratio <= 0:
+        return ABSORBANCE_CEILING
+    value = math.log10(ratio)
+    if math.isnan(value) or math.isinf(value):
+        return ABSORBANCE_CEILING
+    return value
+
+
+def transmittance(absorbance_value):
+    if absorbance_value >= ABSORBANCE_CEILING:
+        return 0.0
+    return 100 * (10 ** -absorbance_value)
+
+
+def absorbance_batch(voltages, initial_voltage, dark_voltage=DEFAULT_DARK_VOLTAGE, ratio_offset=RATIO_OFFSET,
+                     initial_dark_voltage=None):
+    # initial_voltage and dark_voltage may be scalars or arrays that
+    # broadcast against voltages. initial_dark_voltage is the dark taken
+    # with the blank, when it differs from the sample's (default: the same).
+    import numpy as np
+    voltages = np.asarray(voltages, dtype=np.float64)
+    if initial_dark_voltage is None:
+        initial_dark_voltage = dark_voltage
+    numerator = np.asarray(initial_voltage, dtype=np.float64) - initial_dark_voltage
+    denominator = voltages - dark_voltage
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = numerator / denominator - ratio_offset
+        values = np.log10(ratio)
+    clamp = (denominator <= 0) | (numerator <= 0) | (ratio > MAX_RATIO) | ~np.isfinite(values)
+    return np.where(clamp, ABSORBANCE_CEILING, values)
+
+
+def transmittance_batch(absorbances):
+    import numpy as np
+    absorbances = np.asarray(absorbances, dtype=np.float64)
+    return np.where(absorbances >= ABSORBANCE_CEILING, 0.0, 100 * np.power(10.0, -absorbances))
@@ -0,0 +1,138 @@
+"""Calibrations remembered per device across reconnects.
+
+A blank calibration takes the sketch over ten seconds and is lost whenever
+the port is reopened. CalibrationStore keeps the last blank voltage (V0) and
+dark voltage (Vd) of every device in a small JSON file, keyed by the USB
+serial number or, for boards without one, VID:PID and the USB port they are
+plugged into. A stored calibration is reused until it is older than
+`max_age`; a fresh dark reading that moved by more than `drift_tolerance`
+from the stored one also means it is time to recalibrate.
+
+The headless engine and the device panel take their dark voltage from the
+same store (`stored_dark_voltage`), so every path computes absorbance with
+the dark the device actually measured.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .beer_lambert import DEFAULT_DARK_VOLTAGE
+from .paths import default_cache_dir
+
+DEFAULT_MAX_AGE = 8 * 3600       # seconds, about a working day
+DEFAULT_DRIFT_TOLERANCE = 0.02   # V, about four ADC counts
+FILE_VERSION = 1
+
+VALID = 'valid'
+EXPIRED = 'expired'
+DRIFTED = 'drifted'
+
+# timestamp is Unix time of the blank reading
+Calibration = namedtuple('Calibration', 'initial_voltage dark_voltage timestamp port')
+
+
+def device_key(port_info):
+    # Stable identity for a pyserial ListPortInfo; None for ports that
+    # aren't USB devices (virtual ports, built-in UARTs)
+    if port_info is None or port_info.vid is None:
+        return None
+    key = f"usb-{port_info.vid:04x}:{port_info.pid:04x}"
+    if port_info.serial_number:
+        return f"{key}-{port_info.serial_number}"
+    # Clone boards often have no serial number; tell identical ones apart by
+    # the USB port they're plugged into
+    if port_info.location:
+        return f"{key}@{port_info.location}"
+    return key
+
+
+def port_device_key(port, list_ports=None):
+    # device_key of a port given by name; None if it isn't listed (virtual
+    # ports such as the simulator's pty)
+    if list_ports is None:
+        from .ports import list_port_infos as list_ports
+    for info in list_ports():
+        if info.device == port:
+            return device_key(info)
+    return None
+
+
+class CalibrationStore:
+    # May be shared between threads (the device panel's channels)
+
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE, drift_tolerance=DEFAULT_DRIFT_TOLERANCE):
+        self.path = path or os.path.join(default_cache_dir(), 'calibrations.json')
+        self.max_age = max_age
+        self.drift_tolerance = drift_tolerance
+        self._lock = threading.Lock()
+        self._calibrations = self._load()
+
+    def __len__(self):
+        return len(self._calibrations)
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != FILE_VERSION:
+                return {}
+            return {key: Calibration(**value) for key, value in data['devices'].items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # A damaged file only costs a recalibration
+            print(f"Ignoring calibration file {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        data = {'version': FILE_VERSION,
+                'devices': {key: value._asdict() for key, value in self._calibrations.items()}}
+        # Write a new file and rename it over the old one, so a crash never
+        # leaves a half-written store behind
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(temp_path, self.path)
+
+    def get(self, key):
+        return self._calibrations.get(key) if key else None
+
+    def put(self, key, initial_voltage, dark_voltage, port=None, timestamp=None):
+        if not key:
+            return None
+        calibration = Calibration(float(initial_voltage), float(dark_voltage),
+                                  time.time() if timestamp is None else timestamp, port)
+        with self._lock:
+            self._calibrations[key] = calibration
+            self._save()
+        return calibration
+
+    def remove(self, key):
+        with self._lock:
+            if self._calibrations.pop(key, None) is not None:
+                self._save()
+
+    def stored_dark_voltage(self, key, default=DEFAULT_DARK_VOLTAGE):
+        # The device's remembered dark voltage while its calibration is
+        # valid, else `default`
+        calibration = self.get(key)
+        if calibration is None or self.status(calibration) == EXPIRED:
+            return default
+        return calibration.dark_voltage
+
+    def age(self, calibration, now=None):
+        return (time.time() if now is None else now) - calibration.timestamp
+
+    def status(self, calibration, dark_voltage=None, now=None):
+        # VALID, EXPIRED, or DRIFTED when a fresh dark reading is given and
+        # differs from the stored one by more than the tolerance
+        if self.age(calibration, now) > self.max_age:
+            return EXPIRED
+        if dark_voltage is not None and \
+                abs(dark_voltage - calibration.dark_voltage) > self.drift_tolerance:
+            return DRIFTED
+        return VALID
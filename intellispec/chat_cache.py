@@ -0,0 +1,96 @@
+"""On-disk LRU cache for chat responses.
+
+Responses are keyed by a hash of the model name and the exact prompt and
+kept in a small SQLite database. Entries expire after `ttl` seconds, and
+the least recently used ones are evicted once the stored text exceeds
+`max_bytes`. The cache may be used from any thread.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from .paths import default_cache_dir
+
+DEFAULT_MAX_BYTES = 20 * 2**20
+DEFAULT_TTL = 7 * 24 * 3600
+
+
+def cache_key(model, prompt):
+    return hashlib.sha256(f'{model}\0{prompt}'.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path or os.path.join(default_cache_dir(), 'chat_responses.sqlite3')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    def get(self, model, prompt):
+        key = cache_key(model, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, prompt, response):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (cache_key(model, prompt), response, size, now, now))
+            self._evict(now)
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
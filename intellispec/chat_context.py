@@ -0,0 +1,321 @@
+"""Session context for the chat assistant.
+
+SessionSummary is updated with every block of readings as it is recorded and
+keeps only running statistics: counts and Welford means, the last few
+readings, per-sample results of queued runs and a coarse absorbance trend
+in at most `max_bins` time bins (adjacent bins are merged when they run
+out). Its memory and the size of its text stay the same whether a session
+has ten readings or a million, so asking a question costs the same at any
+point of a session.
+
+Each section of the summary is rendered to text only when its data changed
+since the last prompt. ContextBuilder puts the sections most useful for
+answering first and leaves out (or cuts) the rest once the prompt would
+exceed its token budget.
+"""
+
+import math
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from .beer_lambert import ABSORBANCE_CEILING, RATIO_OFFSET
+from .metrics import registry
+from .stats import Welford
+
+DEFAULT_TOKEN_BUDGET = 2000
+CHARS_PER_TOKEN = 4          # rough average for English text and numbers
+DEFAULT_RECENT = 10          # latest readings listed verbatim
+DEFAULT_MAX_BINS = 24        # absorbance trend resolution
+DEFAULT_BIN_SECONDS = 10.0   # initial trend bin width; doubles as bins merge
+MAX_TURN_CHARS = 600         # of each earlier chat message
+QUESTION_HEADING = '## Question'
+
+# States the formula of beer_lambert.absorbance, which computed every value below
+PREAMBLE = (
+    "You are the assistant built into IntelliSpec, a single-wavelength spectrophotometer. "
+    "The sample's photodiode voltage V is converted to absorbance with "
+    f"A = log10((V0 - Vd) / (V - Vd) - {RATIO_OFFSET:g}), where V0 is the blank voltage and Vd the dark "
+    f"voltage; readings beyond the range of that formula are reported as {ABSORBANCE_CEILING:.2f} A. "
+    "The current session is summarised below; use it when the question is about the measurements "
+    "and say so when the summary doesn't contain what is needed.")
+
+PROMPT_TOKENS = registry.gauge('intellispec_chat_prompt_tokens', "Estimated tokens in the last chat prompt")
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def format_time(timestamp):
+    return time.strftime('%H:%M:%S', time.localtime(timestamp))
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    minutes = seconds / 60
+    if minutes < 60:
+        return f"{minutes:.1f} min"
+    return f"{int(minutes // 60)} h {int(minutes % 60):02d} min"
+
+
+class TrendBins:
+    # Count, sum, min and max of values in equal time bins from the first
+    # reading on. When a reading falls past the last bin, neighbouring bins
+    # are merged in pairs and the width doubles.
+
+    def __init__(self, max_bins=DEFAULT_MAX_BINS, bin_seconds=DEFAULT_BIN_SECONDS):
+        self.max_bins = max_bins - max_bins % 2
+        self.initial_width = bin_seconds
+        self.clear()
+
+    def clear(self):
+        self.start = None
+        self.width = self.initial_width
+        self.counts = np.zeros(self.max_bins, dtype=np.int64)
+        self.sums = np.zeros(self.max_bins)
+        self.mins = np.full(self.max_bins, np.inf)
+        self.maxs = np.full(self.max_bins, -np.inf)
+
+    def add(self, times, values):
+        keep = np.isfinite(values)
+        times, values = times[keep], values[keep]
+        if not len(values):
+            return
+        if self.start is None:
+            self.start = float(times[0])
+        # Clock steps backwards land in the first bin
+        index = np.maximum(((times - self.start) // self.width).astype(np.int64), 0)
+        while index.max() >= self.max_bins:
+            self._merge()
+            index //= 2
+        np.add.at(self.counts, index, 1)
+        np.add.at(self.sums, index, values)
+        np.minimum.at(self.mins, index, values)
+        np.maximum.at(self.maxs, index, values)
+
+    def _merge(self):
+        half = self.max_bins // 2
+        self.counts[:half] = self.counts[0::2] + self.counts[1::2]
+        self.sums[:half] = self.sums[0::2] + self.sums[1::2]
+        self.mins[:half] = np.minimum(self.mins[0::2], self.mins[1::2])
+        self.maxs[:half] = np.maximum(self.maxs[0::2], self.maxs[1::2])
+        self.counts[half:] = 0
+        self.sums[half:] = 0.0
+        self.mins[half:] = np.inf
+        self.maxs[half:] = -np.inf
+        self.width *= 2
+
+    def bins(self):
+        # [(start time, count, mean, min, max)] of the non-empty bins
+        return [(self.start + index * self.width, int(self.counts[index]),
+                 self.sums[index] / self.counts[index], self.mins[index], self.maxs[index])
+                for index in np.flatnonzero(self.counts)]
+
+
+class SessionSummary:
+
+    def __init__(self, recent=DEFAULT_RECENT, max_bins=DEFAULT_MAX_BINS):
+        self.recent_size = recent
+        self.max_bins = max_bins
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+        self.voltage = Welford()
+        self.absorbance = Welford()
+        self.absorbance_min = math.inf
+        self.absorbance_max = -math.inf
+        self.recent = deque(maxlen=self.recent_size)   # (time, voltage, absorbance)
+        self.trend = TrendBins(self.max_bins)
+        self.results = OrderedDict()    # sample label -> Welford of its absorbances
+        self.calibration = None         # (V0, Vd, timestamp) or None
+        self.curve = None
+        self.units = ''
+        # Bumped whenever a section's data changes; see section_lines()
+        self.versions = {'calibration': 0, 'curve': 0, 'readings': 0, 'results': 0}
+        self._rendered = {}
+
+    def add(self, times, voltages, absorbances):
+        # A block of recorded readings; absorbances are NaN before calibration
+        times = np.broadcast_to(np.asarray(times, dtype=np.float64), np.shape(voltages))
+        voltages = np.asarray(voltages, dtype=np.float64)
+        absorbances = np.asarray(absorbances, dtype=np.float64)
+        if not len(voltages):
+            return
+        self.count += len(voltages)
+        if self.first_time is None:
+            self.first_time = float(times[0])
+        self.last_time = float(times[-1])
+        self.voltage.add_array(voltages[np.isfinite(voltages)])
+        calibrated = absorbances[np.isfinite(absorbances)]
+        if len(calibrated):
+            self.absorbance.add_array(calibrated)
+            self.absorbance_min = min(self.absorbance_min, float(calibrated.min()))
+            self.absorbance_max = max(self.absorbance_max, float(calibrated.max()))
+        tail = slice(-self.recent_size, None)
+        self.recent.extend(zip(times[tail].tolist(), voltages[tail].tolist(), absorbances[tail].tolist()))
+        self.trend.add(times, absorbances)
+        self.versions['readings'] += 1
+
+    def add_result(self, label, absorbance):
+        if math.isnan(absorbance):
+            return
+        self.results.setdefault(label, Welford()).add(absorbance)
+        self.versions['results'] += 1
+
+    def set_calibration(self, initial_voltage, dark_voltage=None, timestamp=None):
+        # initial_voltage None: not (or no longer) calibrated
+        self.calibration = None if initial_voltage is None else \
+            (initial_voltage, dark_voltage, time.time() if timestamp is None else timestamp)
+        self.versions['calibration'] += 1
+
+    def set_curve(self, curve, units=''):
+        # Concentrations are only given once the curve can be fitted
+        self.curve = curve
+        self.units = units
+        self.versions['curve'] += 1
+        # Concentrations of the latest reading and of run results change too
+        self.versions['readings'] += 1
+        self.versions['results'] += 1
+
+    def section_lines(self, name):
+        # Rendered lines of a section, reused until its data changes
+        version = self.versions[name]
+        cached = self._rendered.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, getattr(self, f'_render_{name}')())
+            self._rendered[name] = cached
+        return cached[1]
+
+    def _render_calibration(self):
+        if self.calibration is None:
+            return ["Not calibrated: no blank voltage, so absorbances aren't available."]
+        initial_voltage, dark_voltage, timestamp = self.calibration
+        return [f"Blank voltage V0 = {initial_voltage:.3f} V, dark voltage Vd = {dark_voltage:.3f} V, "
+                f"calibrated {time.strftime('%b %d %H:%M', time.localtime(timestamp))}"]
+
+    def _render_curve(self):
+        curve = self.curve
+        if curve is None or not len(curve):
+            return []
+        if not curve.ready:
+            return [f"{len(curve)} standards so far, not enough to fit the curve"]
+        lines = [f"{curve.equation()}, c in {self.units or 'units'}, R^2 = {curve.r_squared:.5f}, "
+                 f"{len(curve)} standards"]
+        lines += [f"- c = {standard.concentration:g}: A = {standard.absorbance:.4f}"
+                  for standard in curve.standards]
+        return lines
+
+    def _render_readings(self):
+        if not self.count:
+            return ["No readings yet."]
+        lines = [f"{self.count} readings from {format_time(self.first_time)} to {format_time(self.last_time)} "
+                 f"({format_duration(self.last_time - self.first_time)})",
+                 f"Voltage: mean {self.voltage.mean:.4f} V, sd {self.voltage.std:.4f} V"]
+        if self.absorbance.count:
+            lines.append(f"Absorbance: mean {self.absorbance.mean:.4f}, sd {self.absorbance.std:.4f}, "
+                         f"min {self.absorbance_min:.4f}, max {self.absorbance_max:.4f} "
+                         f"({self.absorbance.count} calibrated readings)")
+        latest_time, latest_voltage, latest_absorbance = self.recent[-1]
+        latest = f"Latest: {latest_voltage:.4f} V"
+        if not math.isnan(latest_absorbance):
+            latest += f", A = {latest_absorbance:.4f}"
+            concentration = self._concentration(latest_absorbance)
+            if concentration is not None:
+                latest += f", c = {concentration}"
+        lines.append(latest + f" at {format_time(latest_time)}")
+        return lines
+
+    def _concentration(self, absorbance):
+        if self.curve is None or not self.curve.ready:
+            return None
+        try:
+            value = float(self.curve.concentration([absorbance])[0])
+        except ValueError:
+            return None
+        return 'outside the standards' if math.isnan(value) else f"{value:.4g} {self.units}".rstrip()
+
+    def _render_results(self):
+        lines = []
+        for label, stats in self.results.items():
+            line = f"- {label}: A = {stats.mean:.4f}"
+            if stats.count > 1:
+                line += f" ± {stats.std:.4f} (n = {stats.count})"
+            concentration = self._concentration(stats.mean)
+            if concentration is not None:
+                line += f", c = {concentration}"
+            lines.append(line)
+        return lines
+
+    def recent_lines(self):
+        return [f"{format_time(t)}  {voltage:.4f} V" + ('' if math.isnan(absorbance) else f"  A = {absorbance:.4f}")
+                for t, voltage, absorbance in self.recent]
+
+    def trend_lines(self):
+        return [f"{format_time(start)}  mean {mean:.4f}  range {low:.4f}-{high:.4f}  n = {count}"
+                for start, count, mean, low, high in self.trend.bins()]
+
+
+class ContextBuilder:
+    # Sections in the order they are kept when the budget runs short:
+    # (heading, lines, keep the newest lines rather than the first ones)
+
+    def __init__(self, summary, budget=DEFAULT_TOKEN_BUDGET):
+        self.summary = summary
+        self.budget = budget
+        self.last_tokens = 0
+
+    def sections(self, history):
+        summary = self.summary
+        return [
+            ('## Calibration', summary.section_lines('calibration'), False),
+            ('## Standard curve', summary.section_lines('curve'), False),
+            ('## Session', summary.section_lines('readings'), False),
+            ('## Queued run results (mean absorbance per sample)', summary.section_lines('results'), False),
+            ('## Latest readings', summary.recent_lines(), True),
+            ('## Conversation so far', self.turn_lines(history), True),
+            ('## Absorbance trend (per time bin)', summary.trend_lines(), True),
+        ]
+
+    def turn_lines(self, history):
+        lines = []
+        for sender, text in history:
+            text = ' '.join(text.split())
+            if len(text) > MAX_TURN_CHARS:
+                text = text[:MAX_TURN_CHARS] + '...'
+            lines.append(f"{'User' if sender == 'You' else sender}: {text}")
+        return lines
+
+    def build(self, question, history=()):
+        # history: earlier (sender, text) chat messages, oldest first
+        ending = f"{QUESTION_HEADING}\n{question}"
+        remaining = self.budget - estimate_tokens(PREAMBLE) - estimate_tokens(ending)
+        chosen = {}
+        for position, (heading, lines, newest) in enumerate(self.sections(history)):
+            if not lines:
+                continue
+            kept = self._fit(heading, lines, newest, remaining)
+            if kept:
+                chosen[position] = (heading, kept)
+                remaining -= estimate_tokens('\n'.join([heading] + kept)) + 1
+        parts = [PREAMBLE] + ['\n'.join([heading] + lines) for _, (heading, lines) in sorted(chosen.items())]
+        prompt = '\n\n'.join(parts + [ending])
+        self.last_tokens = estimate_tokens(prompt)
+        PROMPT_TOKENS.set(self.last_tokens)
+        return prompt
+
+    def _fit(self, heading, lines, newest, remaining):
+        # As many lines as fit, from the end of the section if newest
+        available = (remaining - estimate_tokens(heading) - 1) * CHARS_PER_TOKEN
+        kept = []
+        for line in (reversed(lines) if newest else lines):
+            available -= len(line) + 1
+            if available < 0:
+                break
+            kept.append(line)
+        return kept[::-1] if newest else kept
@@ -0,0 +1,110 @@
+"""Chat history with paged-out storage and a per-message render cache.
+
+Every finished message is appended to an archive file (JSON lines, with an
+in-memory byte-offset index), so any message can be read back without
+keeping the whole conversation in memory. The chat view only keeps the
+most recent `max_rendered` messages in its document and pages older ones
+back in from the archive when the user scrolls up.
+
+Rendered HTML is cached per message, so a message's markdown is converted
+once. The message still being streamed is never cached and is the only one
+whose HTML changes.
+"""
+
+import json
+import tempfile
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_RENDERED = 200
+DEFAULT_PAGE_SIZE = 50
+
+
+class ChatHistory:
+
+    def __init__(self, max_rendered=DEFAULT_MAX_RENDERED, page_size=DEFAULT_PAGE_SIZE,
+                 cache_size=None, archive=None):
+        self.max_rendered = max_rendered
+        self.page_size = page_size
+        self.cache_size = cache_size or 2 * (max_rendered + page_size)
+        self._archive = archive or tempfile.TemporaryFile()
+        self._offsets = []          # archive offset of every finished message
+        self._open = None           # (sender, text, timestamp) of the streaming message
+        self._html = OrderedDict()  # index -> rendered HTML, least recently used first
+
+    def __len__(self):
+        return len(self._offsets) + (self._open is not None)
+
+    @property
+    def streaming_index(self):
+        return len(self._offsets) if self._open is not None else None
+
+    def add(self, sender, text, streaming=False):
+        # Messages are archived in order, so a streaming message is finished
+        # before anything is added after it
+        self.finish()
+        index = len(self._offsets)
+        if streaming:
+            self._open = (sender, text, time.time())
+        else:
+            self._write(sender, text, time.time())
+        return index
+
+    def set_text(self, text):
+        sender, _, timestamp = self._open
+        self._open = (sender, text, timestamp)
+
+    def finish(self):
+        if self._open is not None:
+            self._write(*self._open)
+            self._open = None
+
+    def message(self, index):
+        if index == self.streaming_index:
+            return self._open[:2]
+        return self.messages(index, index + 1)[0]
+
+    def messages(self, start, stop):
+        # Finished messages [start, stop) as (sender, text), read in one go
+        stop = min(stop, len(self._offsets))
+        if start >= stop:
+            return []
+        end = self._offsets[stop] if stop < len(self._offsets) else None
+        self._archive.seek(self._offsets[start])
+        data = self._archive.read() if end is None else self._archive.read(end - self._offsets[start])
+        self._archive.seek(0, 2)
+        result = []
+        for line in data.splitlines():
+            entry = json.loads(line)
+            result.append((entry['sender'], entry['text']))
+        return result
+
+    def render(self, index, formatter, message=None):
+        # formatter(sender, text) -> HTML; finished messages are cached
+        if index == self.streaming_index:
+            return formatter(*self._open[:2])
+        html = self._html.get(index)
+        if html is not None:
+            self._html.move_to_end(index)
+            return html
+        html = formatter(*(message or self.message(index)))
+        self._html[index] = html
+        if len(self._html) > self.cache_size:
+            self._html.popitem(last=False)
+        return html
+
+    def render_range(self, start, stop, formatter):
+        # Uncached messages are read from the archive together
+        missing = [index for index in range(start, stop) if index not in self._html]
+        loaded = dict(zip(range(missing[0], missing[-1] + 1),
+                          self.messages(missing[0], missing[-1] + 1))) if missing else {}
+        return [self.render(index, formatter, loaded.get(index)) for index in range(start, stop)]
+
+    def close(self):
+        self._archive.close()
+
+    def _write(self, sender, text, timestamp):
+        self._archive.seek(0, 2)
+        self._offsets.append(self._archive.tell())
+        line = json.dumps({'sender': sender, 'text': text, 'timestamp': timestamp})
+        self._archive.write(line.encode('utf-8') + b'\n')
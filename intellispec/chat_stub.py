@@ -0,0 +1,66 @@
+"""Offline stand-in for google.generativeai.GenerativeModel.
+
+Set INTELLISPEC_CHAT_STUB=1 to use it instead of Gemini. It answers every
+prompt with a deterministic reply and, with stream=True, yields it a few
+words at a time with a short delay, so streaming, cancellation and caching
+can be exercised without network access or an API key. For prompts built
+by chat_context it quotes the context lines that share a word with the
+question, which is enough to check what the assistant would have been told.
+"""
+
+import re
+import time
+
+from .chat_context import QUESTION_HEADING, estimate_tokens
+
+STUB_MODEL_NAME = 'offline-stub'
+
+
+class StubChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubResponse:
+    def __init__(self, text, chunk_words, delay):
+        self.text = text
+        self._chunk_words = chunk_words
+        self._delay = delay
+
+    def __iter__(self):
+        words = self.text.split(' ')
+        for start in range(0, len(words), self._chunk_words):
+            time.sleep(self._delay)
+            chunk = ' '.join(words[start:start + self._chunk_words])
+            yield StubChunk(chunk if start == 0 else ' ' + chunk)
+
+
+class StubModel:
+    model_name = STUB_MODEL_NAME
+
+    def __init__(self, chunk_words=3, delay=0.05):
+        self.chunk_words = chunk_words
+        self.delay = delay
+        self.calls = 0
+
+    def reply(self, prompt):
+        context, heading, question = prompt.rpartition(QUESTION_HEADING)
+        if not heading:
+            return (f"**Offline assistant** received {len(prompt)} characters. "
+                    f"You asked: _{prompt.strip()}_. "
+                    "Connect a Gemini API key for real answers.")
+        words = {word for word in re.findall(r'[a-z]+', question.lower()) if len(word) > 3}
+        relevant = [line.lstrip('- ') for line in context.splitlines()[1:]
+                    if line and not line.startswith('#') and words & set(re.findall(r'[a-z]+', line.lower()))]
+        text = (f"**Offline assistant** received a prompt of about {estimate_tokens(prompt)} tokens. "
+                f"You asked: _{question.strip()}_.")
+        if relevant:
+            text += " From the session:\n\n" + '\n'.join(f"- {line}" for line in relevant[:6])
+        return text + "\n\nConnect a Gemini API key for real answers."
+
+    def generate_content(self, prompt, stream=False):
+        self.calls += 1
+        response = StubResponse(self.reply(prompt), self.chunk_words, self.delay)
+        if not stream:
+            time.sleep(self.delay)
+        return response
@@ -0,0 +1,192 @@
+"""Command line for scripted measurements, without the GUI.
+
+    python -m intellispec ports
+    python -m intellispec measure --port /dev/ttyACM0 --samples 5
+    python -m intellispec measure --simulate --sim-time-scale 0.05 --labels A,B --samples 3
+    python -m intellispec export session-20250101-120000.isrec history.csv
+    python -m intellispec export session-20250101-120000.isrec history.csv --curve nitrate.json
+    python -m intellispec reprocess ~/IntelliSpec/sessions --dark 0.095 --workers 8
+
+Readings are written to stdout as CSV, progress to stderr. Nothing here
+imports Qt or the chat SDK, and heavier modules are only imported by the
+command that needs them, so the CLI starts quickly on small field machines.
+"""
+
+import argparse
+import csv
+import math
+import sys
+
+from .beer_lambert import DEFAULT_DARK_VOLTAGE
+from .engine import DEFAULT_BAUDRATE, READY_TIMEOUT, MeasurementEngine
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def list_ports(args):
+    import serial.tools.list_ports
+    for port in serial.tools.list_ports.comports():
+        print(f"{port.device}\t{port.description}")
+    return 0
+
+
+def measure(args):
+    simulator = None
+    port = args.port
+    if args.simulate:
+        from .simulator import VirtualSpectrophotometer
+        simulator = VirtualSpectrophotometer(time_scale=args.sim_time_scale)
+        port = simulator.start()
+        log(f"Virtual spectrophotometer on {port}")
+    elif not port:
+        log("intellispec measure: --port is required (or use --simulate)")
+        return 2
+
+    store = None
+    if args.record is not None:
+        from .store import MeasurementStore, new_session_path
+        store = MeasurementStore(args.record or new_session_path())
+        log(f"Recording measurements to {store.path}")
+
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow(['timestamp', 'label', 'replicate', 'voltage', 'absorbance', 'transmittance'])
+
+    def write_reading(reading):
+        writer.writerow([f"{reading.timestamp:.3f}", reading.label, reading.replicate,
+                         f"{reading.voltage:.3f}", f"{reading.absorbance:.4f}",
+                         f"{reading.transmittance:.2f}"])
+        sys.stdout.flush()
+
+    labels = [label.strip() for label in args.labels.split(',') if label.strip()] or ['Sample']
+    # The virtual device doesn't reset when the port is opened, so there is
+    # no banner to wait for
+    engine = MeasurementEngine(port, args.baud, args.dark, store=store,
+                               ready_timeout=0 if simulator else READY_TIMEOUT)
+    try:
+        with engine:
+            if args.blank is not None:
+                engine.initial_voltage = args.blank
+            else:
+                log("Calibrating: insert the blank...")
+                log(f"Blank voltage: {engine.calibrate():.3f} V")
+            log(f"Measuring {len(labels) * args.samples} samples...")
+            readings = engine.measure(labels, args.samples, on_reading=write_reading)
+    except (OSError, TimeoutError) as e:
+        log(f"intellispec measure: {e}")
+        return 1
+    finally:
+        if store is not None:
+            store.close()
+        if simulator is not None:
+            simulator.stop()
+    missed = sum(math.isnan(reading.voltage) for reading in readings)
+    if missed:
+        log(f"Warning: {missed} readings timed out")
+    return 0
+
+
+def export(args):
+    from .store import export_csv, export_parquet, open_history
+    try:
+        records = open_history(args.session)
+        extra = []
+        if args.curve:
+            from .standard_curve import load_curve, quantify_history
+            extra.append(('concentration', quantify_history(records, load_curve(args.curve)), '%.6g'))
+        if args.output.endswith('.parquet'):
+            export_parquet(records, args.output, extra_columns=extra)
+        else:
+            export_csv(records, args.output, extra_columns=extra)
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        log(f"intellispec export: {e}")
+        return 1
+    log(f"Exported {len(records)} records to {args.output}")
+    return 0
+
+
+def reprocess(args):
+    import os
+    import time
+    from .reprocess import DEFAULT_FORMULA, Reprocessing, find_sessions, reprocess as run
+    sources = []
+    for path in args.paths:
+        sources += find_sessions(path, args.recursive) if os.path.isdir(path) else [path]
+    if not sources:
+        log("intellispec reprocess: no session files found")
+        return 1
+    settings = Reprocessing(args.dark, args.blank, DEFAULT_FORMULA if args.formula is None else args.formula)
+    last = 0.0
+
+    def progress(done, total):
+        nonlocal last
+        if time.monotonic() - last >= 1.0 or done == total:
+            last = time.monotonic()
+            log(f"{done}/{total} records ({100 * done / max(total, 1):.0f}%)")
+
+    start = time.perf_counter()
+    try:
+        results = run(sources, settings, workers=args.workers, chunk_records=args.chunk, on_progress=progress)
+    except (OSError, ValueError) as e:
+        log(f"intellispec reprocess: {e}")
+        return 1
+    elapsed = time.perf_counter() - start
+    for result in results:
+        print(f"{result.source}\t{result.output}\t{result.records}")
+    records = sum(result.records for result in results)
+    log(f"Reprocessed {records} records in {len(results)} sessions in {elapsed:.1f} s "
+        f"({records / max(elapsed, 1e-9) / 1e6:.1f} M records/s)")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='intellispec', description="IntelliSpec spectrophotometer tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ports = commands.add_parser('ports', help="list serial ports")
+    ports.set_defaults(func=list_ports)
+
+    run = commands.add_parser('measure', help="calibrate and read samples, printing CSV")
+    run.add_argument('--port', help="serial port of the device")
+    run.add_argument('--baud', type=int, default=DEFAULT_BAUDRATE)
+    run.add_argument('--samples', type=int, default=1, help="readings per label (default 1)")
+    run.add_argument('--labels', default='Sample', help="comma-separated sample labels")
+    run.add_argument('--blank', type=float, default=None,
+                     help="use this blank voltage V0 instead of calibrating")
+    run.add_argument('--dark', type=float, default=None,
+                     help="dark voltage Vd (default: as measured or stored for the device, "
+                          f"else {DEFAULT_DARK_VOLTAGE})")
+    run.add_argument('--record', nargs='?', const='', default=None, metavar='PATH',
+                     help="also append readings to a session file (default: a new one)")
+    run.add_argument('--simulate', action='store_true', help="measure from a virtual device")
+    run.add_argument('--sim-time-scale', type=float, default=1.0,
+                     help="speed up the virtual device's delays (e.g. 0.1)")
+    run.set_defaults(func=measure)
+
+    history = commands.add_parser('export', help="export a session file to CSV or Parquet")
+    history.add_argument('session', help="session file (.isrec)")
+    history.add_argument('output', help="output path; .parquet for Parquet, otherwise CSV")
+    history.add_argument('--curve', metavar='JSON',
+                         help="standard curve saved from the GUI; adds a concentration column")
+    history.set_defaults(func=export)
+
+    redo = commands.add_parser('reprocess',
+                               help="recompute absorbance of recorded sessions with a new calibration or formula")
+    redo.add_argument('paths', nargs='+', help="session files or directories of them")
+    redo.add_argument('--dark', type=float, default=None,
+                      help="dark voltage Vd to use instead of the recorded one")
+    redo.add_argument('--blank', type=float, default=None,
+                      help="blank voltage V0 to use instead of the recorded one")
+    redo.add_argument('--formula', type=int, choices=(1, 2), default=None,
+                      help="1: log10(ratio - 0.5) as recorded, the default; 2: log10(ratio) as the sketch computes it")
+    redo.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    redo.add_argument('--chunk', type=int, default=1 << 24, help="records per task (default 16M)")
+    redo.add_argument('--recursive', action='store_true', help="also search subdirectories")
+    redo.set_defaults(func=reprocess)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,323 @@
+"""Concurrent acquisition from several devices.
+
+Every device gets a DeviceChannel: its own thread, batched reader,
+acquisition state machine (and so its own command queue) and blank
+calibration. The channel parses its lines, computes absorbance and writes
+its session file on that thread. Finished readings go to a shared
+ResultAggregator as NumPy blocks. The GUI drains the aggregator on a timer
+and gets one array of results from all devices, merged by timestamp.
+The GUI thread therefore does a fixed amount of work per refresh, however
+many devices are attached and however fast they stream.
+
+Commands may be issued from any thread; they are handed to the channel's
+thread and applied there.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .acquisition import IDLE, STREAMING, AcquisitionStateMachine
+from .beer_lambert import DEFAULT_DARK_VOLTAGE
+from .calibration import port_device_key
+from .engine import DEFAULT_BAUDRATE, compute_samples
+from .metrics import registry
+from .protocol import BlankVoltage, DarkVoltage, SampleVoltage, StreamSample, parse_lines
+from .serial_reader import DEFAULT_MAX_LATENCY, BatchReader
+from .store import MeasurementStore, new_session_path
+
+KIND_BLANK = 1
+KIND_SAMPLE = 2
+KIND_STREAM = 3
+
+RESULT_DTYPE = np.dtype([
+    ('timestamp', '<f8'),   # Unix time, seconds
+    ('device', '<i2'),      # DeviceChannel.device_id
+    ('kind', 'u1'),         # KIND_*
+    ('voltage', '<f4'),
+    ('absorbance', '<f4'),  # NaN before calibration
+    ('transmittance', '<f4'),
+])
+
+DEFAULT_MAX_QUEUED = 1 << 20  # results held for the consumer before the oldest are dropped
+
+RESULTS_DROPPED = registry.counter('intellispec_device_results_dropped_total',
+                                   "Device panel results dropped because they weren't drained in time")
+
+
+class ResultAggregator:
+    # Thread-safe collection point for result blocks from every channel.
+    # `drain()` returns everything received since the previous call as one
+    # RESULT_DTYPE array sorted by timestamp.
+
+    def __init__(self, max_queued=DEFAULT_MAX_QUEUED):
+        self.max_queued = max_queued
+        self.dropped = 0
+        self._blocks = []
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def put(self, block):
+        with self._lock:
+            self._blocks.append(block)
+            self._queued += len(block)
+            # A consumer that stops draining must not grow memory without bound
+            while self._queued > self.max_queued and len(self._blocks) > 1:
+                oldest = self._blocks.pop(0)
+                self._queued -= len(oldest)
+                self.dropped += len(oldest)
+                RESULTS_DROPPED.inc(len(oldest))
+
+    def drain(self):
+        with self._lock:
+            blocks, self._blocks = self._blocks, []
+            self._queued = 0
+        if not blocks:
+            return np.empty(0, dtype=RESULT_DTYPE)
+        merged = np.concatenate(blocks)
+        # Each channel's blocks are already in time order; a stable sort
+        # interleaves the channels without reordering any one of them
+        return merged[np.argsort(merged['timestamp'], kind='stable')]
+
+
+class DeviceChannel:
+
+    def __init__(self, device_id, port, aggregator, baudrate=DEFAULT_BAUDRATE,
+                 dark_voltage=None, serial_factory=None, record=True, calibrations=None):
+        self.device_id = device_id
+        self.port = port
+        self.aggregator = aggregator
+        self.baudrate = baudrate
+        # As in MeasurementEngine: a fixed dark voltage, or the device's
+        # stored one until it measures a new one
+        self.fixed_dark = dark_voltage is not None
+        self.dark_voltage = DEFAULT_DARK_VOLTAGE if dark_voltage is None else dark_voltage
+        self.calibrations = calibrations   # shared CalibrationStore, or None
+        self.device_key = None
+        self.serial_factory = serial_factory
+        self.record = record
+        # Written by the channel thread, read by anyone
+        self.state = IDLE
+        self.queued = 0
+        self.initial_voltage = None
+        self.device_dark_voltage = None
+        self.connected = False
+        self.error = None
+        self.store = None
+        self.reader = None
+        self._commands = queue.SimpleQueue()
+        self._acquisition = None
+        self._stream_clock_offset = None
+        self._running = False
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f'device-{self.device_id}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # Commands, applied on the channel thread in the order they were given
+
+    def calibrate(self):
+        self._commands.put(('calibrate',))
+
+    def read(self):
+        self._commands.put(('read',))
+
+    def start_stream(self, rate):
+        self._commands.put(('start_stream', rate))
+
+    def stop_stream(self):
+        self._commands.put(('stop_stream',))
+
+    # Channel thread
+
+    def _run(self):
+        serial_port = None
+        try:
+            factory = self.serial_factory
+            if factory is None:
+                import serial
+                factory = serial.Serial
+            if self.calibrations is not None:
+                # Enumerating ports can be slow; this is the channel's thread
+                self.device_key = port_device_key(self.port)
+                if not self.fixed_dark:
+                    self.dark_voltage = self.calibrations.stored_dark_voltage(self.device_key)
+            serial_port = factory(self.port, self.baudrate, timeout=DEFAULT_MAX_LATENCY)
+            self._acquisition = AcquisitionStateMachine(serial_port.write,
+                                                        on_state_changed=self._on_state)
+            self.reader = BatchReader(serial_port, self._handle_batch)
+            self.connected = True
+            self.reader.run(self._poll)
+            # Stopped on purpose: leave the device idle for whoever opens it next
+            self._acquisition.stop_stream()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.connected = False
+            if serial_port is not None:
+                serial_port.close()
+            if self.store is not None:
+                self.store.close()
+
+    def _poll(self):
+        # Runs between reads, at least every DEFAULT_MAX_LATENCY seconds
+        while True:
+            try:
+                name, *args = self._commands.get_nowait()
+            except queue.Empty:
+                break
+            if name == 'calibrate':
+                self.initial_voltage = None
+            getattr(self._acquisition, name)(*args)
+        self._acquisition.check_timeout()
+        self.queued = len(self._acquisition.queue)
+        if self.store is not None:
+            self.store.sync_if_due()
+        return self._running
+
+    def _on_state(self, state):
+        self.state = state
+        if state != STREAMING:
+            self._stream_clock_offset = None
+
+    def _handle_batch(self, lines):
+        try:
+            now = time.time()
+            blanks = []
+            samples = []
+            stream = []
+            for record in parse_lines(lines):
+                if not self._acquisition.handle_record(record):
+                    continue
+                if isinstance(record, StreamSample):
+                    stream.append(record)
+                elif isinstance(record, SampleVoltage):
+                    samples.append(record.voltage)
+                elif isinstance(record, BlankVoltage):
+                    # Samples before the blank in this batch were measured
+                    # against the previous calibration
+                    self._emit(now, KIND_SAMPLE, samples)
+                    samples = []
+                    self.initial_voltage = record.voltage
+                    blanks.append(record.voltage)
+                    if self.calibrations is not None:
+                        self.calibrations.put(self.device_key, record.voltage, self.dark_voltage, self.port)
+                elif isinstance(record, DarkVoltage):
+                    # Samples before it in this batch used the previous dark
+                    self._emit(now, KIND_SAMPLE, samples)
+                    samples = []
+                    self.device_dark_voltage = record.voltage
+                    if not self.fixed_dark:
+                        self.dark_voltage = record.voltage
+            self._emit(now, KIND_BLANK, blanks)
+            self._emit(now, KIND_SAMPLE, samples)
+            if stream:
+                block = np.array(stream, dtype=np.float64)
+                times = block[:, 0] / 1000.0  # device millis -> seconds
+                if self._stream_clock_offset is None:
+                    self._stream_clock_offset = now - times[-1]
+                self._emit(times + self._stream_clock_offset, KIND_STREAM, block[:, 1])
+        finally:
+            self.reader.ack()
+
+    def _emit(self, timestamps, kind, voltages):
+        if not len(voltages):
+            return
+        voltages = np.asarray(voltages, dtype=np.float64)
+        if kind == KIND_BLANK:
+            absorbances = np.zeros(len(voltages))
+            transmittances = np.full(len(voltages), 100.0)
+        else:
+            absorbances, transmittances = compute_samples(voltages, self.initial_voltage,
+                                                          self.dark_voltage)
+        block = np.empty(len(voltages), dtype=RESULT_DTYPE)
+        block['timestamp'] = timestamps
+        block['device'] = self.device_id
+        block['kind'] = kind
+        block['voltage'] = voltages
+        block['absorbance'] = absorbances
+        block['transmittance'] = transmittances
+        self.aggregator.put(block)
+        if self.record and kind != KIND_BLANK:
+            if self.store is None:
+                self.store = MeasurementStore(new_session_path(tag=f'dev{self.device_id}'))
+            self.store.append(block['timestamp'], voltages, self.initial_voltage, self.dark_voltage,
+                              absorbances, transmittances)
+
+
+class DeviceManager:
+    # Owns the channels and the aggregator they share. Device ids are never
+    # reused, so results drained after a device was removed still map back
+    # to it through `ports`.
+
+    def __init__(self, dark_voltage=None, serial_factory=None, record=True, calibrations=None):
+        self.dark_voltage = dark_voltage   # None: each device's stored or measured dark
+        self.serial_factory = serial_factory
+        self.record = record
+        self.calibrations = calibrations
+        self.aggregator = ResultAggregator()
+        self.channels = {}   # device id -> DeviceChannel
+        self.ports = {}      # device id -> port, including removed devices
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self.channels)
+
+    def add(self, port, baudrate=DEFAULT_BAUDRATE):
+        if any(channel.port == port for channel in self.channels.values()):
+            raise ValueError(f"{port} is already connected")
+        channel = DeviceChannel(self._next_id, port, self.aggregator, baudrate, self.dark_voltage,
+                                self.serial_factory, self.record, self.calibrations)
+        self._next_id += 1
+        self.channels[channel.device_id] = channel
+        self.ports[channel.device_id] = port
+        channel.start()
+        return channel
+
+    def remove(self, device_id):
+        channel = self.channels.pop(device_id)
+        channel.stop_stream()
+        channel.stop()
+        channel.join()
+
+    def calibrate_all(self):
+        for channel in self.channels.values():
+            channel.calibrate()
+
+    def read_all(self):
+        for channel in self.channels.values():
+            channel.read()
+
+    def start_stream_all(self, rate):
+        for channel in self.channels.values():
+            channel.start_stream(rate)
+
+    def stop_stream_all(self):
+        for channel in self.channels.values():
+            channel.stop_stream()
+
+    def drain(self):
+        return self.aggregator.drain()
+
+    def close(self):
+        for channel in self.channels.values():
+            channel.stop_stream()
+            channel.stop()
+        for channel in self.channels.values():
+            channel.join()
+        self.channels.clear()
@@ -0,0 +1,211 @@
+"""Headless measurement engine.
+
+Drives a spectrophotometer over a serial port without Qt. A reader thread
+batches incoming lines; the calling thread parses them, runs the
+acquisition state machine and the run scheduler, and applies Beer-Lambert
+to every reading. `calibrate()` and `measure()` block until the device has
+answered, which is what scripts and the command line want.
+
+Only the standard library and pyserial are needed to take readings; NumPy
+is loaded when readings are recorded to a session file.
+"""
+
+import math
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from .acquisition import CALIBRATE, DEFAULT_BAUDRATE, AcquisitionStateMachine
+from .beer_lambert import (DEFAULT_DARK_VOLTAGE, absorbance, absorbance_batch, transmittance,
+                           transmittance_batch)
+from .protocol import BlankVoltage, DarkVoltage, Message, parse_lines
+from .scheduler import RunScheduler, build_run
+from .serial_reader import DEFAULT_MAX_LATENCY, BatchReader
+
+READY_TIMEOUT = 3.0    # seconds to wait for the banner after an Arduino resets on open
+READY_BANNER = 'Spectrophotometer Ready'
+POLL_INTERVAL = 0.25   # seconds between timeout checks while waiting on the device
+
+# voltage, absorbance and transmittance are NaN when the device didn't answer;
+# absorbance and transmittance are NaN before calibration
+Reading = namedtuple('Reading', 'timestamp label replicate voltage absorbance transmittance')
+
+
+def compute_samples(voltages, initial_voltage, dark_voltage=DEFAULT_DARK_VOLTAGE):
+    # Absorbance and transmittance arrays for a block of voltages, NaN before calibration
+    import numpy as np
+    if initial_voltage is None:
+        return np.full(len(voltages), np.nan), np.full(len(voltages), np.nan)
+    absorbances = absorbance_batch(voltages, initial_voltage, dark_voltage)
+    return absorbances, transmittance_batch(absorbances)
+
+
+def compute_sample(voltage, initial_voltage, dark_voltage=DEFAULT_DARK_VOLTAGE):
+    # Scalar version of compute_samples
+    if initial_voltage is None or math.isnan(voltage):
+        return math.nan, math.nan
+    value = absorbance(voltage, initial_voltage, dark_voltage)
+    return value, transmittance(value)
+
+
+class MeasurementEngine:
+
+    def __init__(self, port, baudrate=DEFAULT_BAUDRATE, dark_voltage=None,
+                 serial_factory=None, store=None, ready_timeout=READY_TIMEOUT, calibrations=None):
+        self.port = port
+        self.baudrate = baudrate
+        # Without a fixed dark voltage, the device's stored one is used until
+        # it measures a new one, and DEFAULT_DARK_VOLTAGE for unknown devices
+        self.fixed_dark = dark_voltage is not None
+        self.dark_voltage = DEFAULT_DARK_VOLTAGE if dark_voltage is None else dark_voltage
+        self.initial_voltage = None
+        self.device_dark_voltage = None   # as printed by the sketch
+        self.calibrations = calibrations  # CalibrationStore; a default one is opened if None
+        self.device_key = None
+        # Anything with pyserial's Serial(port, baudrate, timeout=...) signature
+        self.serial_factory = serial_factory
+        self.store = store                # optional MeasurementStore; the caller closes it
+        self.ready_timeout = ready_timeout
+        self.acquisition = AcquisitionStateMachine(self.send)
+        self.scheduler = None
+        self.serial = None
+        self.reader = None
+        self.ready = False
+        self._batches = queue.Queue()
+        self._thread = None
+        self._running = False
+        self._error = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if self.serial_factory is None:
+            import serial
+            self.serial_factory = serial.Serial
+        self.load_calibration()
+        self.serial = self.serial_factory(self.port, self.baudrate, timeout=DEFAULT_MAX_LATENCY)
+        self.reader = BatchReader(self.serial, self._batches.put)
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, name='intellispec-reader', daemon=True)
+        self._thread.start()
+        # Opening the port resets most Arduinos, and commands sent before the
+        # sketch is up are lost. Boards that don't reset never print the
+        # banner, so only wait for it up to ready_timeout.
+        deadline = time.monotonic() + self.ready_timeout
+        while not self.ready and time.monotonic() < deadline:
+            self.pump(deadline - time.monotonic())
+        return self
+
+    def load_calibration(self):
+        from .calibration import CalibrationStore, port_device_key
+        if self.calibrations is None:
+            self.calibrations = CalibrationStore()
+        self.device_key = port_device_key(self.port)
+        if not self.fixed_dark:
+            self.dark_voltage = self.calibrations.stored_dark_voltage(self.device_key)
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.store is not None:
+            self.store.sync()
+
+    def send(self, payload):
+        self.serial.write(payload)
+
+    def pump(self, timeout):
+        # Handle the serial batches that arrive within `timeout` seconds
+        try:
+            lines = self._batches.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return []
+        if lines is None:
+            self._batches.put(None)
+            raise ConnectionError(f"{self.port}: {self._error or 'connection closed'}")
+        try:
+            records = parse_lines(lines)
+            for record in records:
+                self.handle_record(record)
+        finally:
+            self.reader.ack()
+        return records
+
+    def handle_record(self, record):
+        if not self.acquisition.handle_record(record):
+            return
+        if isinstance(record, BlankVoltage):
+            self.initial_voltage = record.voltage
+            if self.calibrations is not None:
+                self.calibrations.put(self.device_key, record.voltage, self.dark_voltage, self.port)
+        elif isinstance(record, DarkVoltage):
+            self.device_dark_voltage = record.voltage
+            if not self.fixed_dark:
+                self.dark_voltage = record.voltage
+        elif isinstance(record, Message) and record.text.startswith(READY_BANNER):
+            self.ready = True
+        if self.scheduler is not None:
+            self.scheduler.handle_record(record)
+
+    def calibrate(self):
+        # Blocks through the firmware's blank wait; returns V0
+        self.initial_voltage = None
+        self.acquisition.calibrate()
+        self._wait_idle()
+        if self.initial_voltage is None:
+            raise TimeoutError(f"No blank voltage from {self.port} within {CALIBRATE.timeout:.0f} s")
+        return self.initial_voltage
+
+    def measure(self, labels=('Sample',), replicates=1, on_reading=None):
+        # Reads every label `replicates` times with pipelined read commands
+        # and returns the Readings in order; on_reading gets each as it arrives.
+        scheduler = RunScheduler(build_run(labels, replicates), self.send)
+        readings = []
+        self.scheduler = scheduler
+        self.acquisition.begin_run(scheduler.late)
+        try:
+            scheduler.start()
+            while True:
+                for result in scheduler.results[len(readings):]:
+                    readings.append(self.reading(result))
+                    if on_reading is not None:
+                        on_reading(readings[-1])
+                if scheduler.done:
+                    break
+                scheduler.check_timeout()
+                self.pump(POLL_INTERVAL)
+        finally:
+            if not scheduler.done:
+                scheduler.cancel()
+            self.scheduler = None
+            self.acquisition.end_run(scheduler.late)
+        return readings
+
+    def reading(self, result):
+        value, percent = compute_sample(result.voltage, self.initial_voltage, self.dark_voltage)
+        if self.store is not None and not math.isnan(result.voltage):
+            self.store.append(result.timestamp, result.voltage, self.initial_voltage,
+                              self.dark_voltage, value, percent, sample_id=result.index + 1)
+        return Reading(result.timestamp, result.label, result.replicate, result.voltage, value, percent)
+
+    def _wait_idle(self):
+        while self.acquisition.busy:
+            self.acquisition.check_timeout()
+            self.pump(min(POLL_INTERVAL, self.acquisition.time_remaining() or POLL_INTERVAL))
+
+    def _read_loop(self):
+        try:
+            self.reader.run(lambda: self._running)
+        except Exception as e:
+            self._error = e
+        finally:
+            self.serial.close()
+            # Wakes a caller blocked in pump()
+            self._batches.put(None)
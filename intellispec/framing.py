@@ -0,0 +1,150 @@
+"""Binary stream frames, the optional compact form of stream mode.
+
+After `binary 1` the sketch sends streamed samples as frames instead of
+`S:` lines; everything else stays ASCII text on the same link:
+
+    A5 5A | type u8 | seq u8 | length u8 | payload | CRC-16 u16
+
+Multi-byte fields are little-endian. The CRC is CRC-CCITT (polynomial 0x1021,
+initial value 0xFFFF, as binascii.crc_hqx computes it) over type, seq,
+length and payload. `seq` increments per frame, so lost frames show up as
+gaps. A stream frame's payload is the micros() of its first and last
+sample (u32 each) followed by the raw 10-bit ADC counts (u16 each).
+
+`FrameDecoder` separates frames from the text around them. Frames are
+checked and decoded in place from the receive buffer with struct and
+np.frombuffer; only the resulting sample arrays are new.
+"""
+
+import binascii
+import struct
+
+import numpy as np
+
+from .metrics import registry
+from .protocol import StreamBlock
+
+SYNC = b'\xa5\x5a'
+HEADER = struct.Struct('<2sBBB')    # sync, type, seq, payload length
+CRC = struct.Struct('<H')
+STREAM_HEADER = struct.Struct('<II')  # micros() of the first and last sample
+CRC_INIT = 0xFFFF
+
+FRAME_STREAM = 0x01
+MAX_FRAME_SAMPLES = 16
+MAX_PAYLOAD = STREAM_HEADER.size + 2 * MAX_FRAME_SAMPLES
+
+ADC_MAX = 1023
+ADC_REFERENCE = 5.0
+MICROS_WRAP = 1 << 32
+
+FRAMES = registry.counter('intellispec_frames_total', "Binary stream frames decoded")
+FRAMES_LOST = registry.counter('intellispec_frames_lost_total', "Binary frames missing from the sequence")
+FRAME_ERRORS = registry.counter('intellispec_frame_errors_total',
+                                "Frame candidates rejected by header check or CRC")
+
+
+def crc16(data, crc=CRC_INIT):
+    return binascii.crc_hqx(data, crc)
+
+
+def encode_frame(kind, seq, payload):
+    body = struct.pack('<BBB', kind, seq & 0xFF, len(payload)) + bytes(payload)
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def encode_stream_frame(seq, first_us, last_us, counts):
+    # At most MAX_FRAME_SAMPLES counts per frame
+    payload = STREAM_HEADER.pack(first_us % MICROS_WRAP, last_us % MICROS_WRAP) + \
+        np.asarray(counts, dtype='<u2').tobytes()
+    return encode_frame(FRAME_STREAM, seq, payload)
+
+
+class FrameDecoder:
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._expected_seq = None
+        self._last_us = None
+        self._wraps = 0
+        self.frames = 0
+        self.lost_frames = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        # Returns the input in order as a list of text chunks (bytes) and
+        # decoded frame records. An incomplete frame at the end is kept for
+        # the next call.
+        self._buffer += data
+        items = []
+        view = memoryview(self._buffer)
+        try:
+            pos = self._scan(view, items)
+        finally:
+            view.release()
+        del self._buffer[:pos]
+        return items
+
+    def _scan(self, view, items):
+        buffer = self._buffer
+        pos = 0
+        while True:
+            start = buffer.find(SYNC, pos)
+            if start < 0:
+                # A trailing A5 may be the first half of the next sync
+                end = len(buffer) - 1 if buffer.endswith(SYNC[:1]) else len(buffer)
+                if end > pos:
+                    items.append(bytes(view[pos:end]))
+                return end
+            if start > pos:
+                items.append(bytes(view[pos:start]))
+            if len(buffer) - start < HEADER.size:
+                return start
+            _, kind, seq, length = HEADER.unpack_from(view, start)
+            if kind != FRAME_STREAM or length > MAX_PAYLOAD:
+                # Can't be a frame; don't wait for `length` bytes to find out
+                self.crc_errors += 1
+                FRAME_ERRORS.inc()
+                pos = start + 1
+                continue
+            end = start + HEADER.size + length + CRC.size
+            if len(buffer) < end:
+                return start
+            (crc,) = CRC.unpack_from(view, end - CRC.size)
+            if crc16(view[start + len(SYNC):end - CRC.size]) != crc:
+                # Not a frame after all (or a corrupted one): skip the sync
+                # byte and treat what follows as text again
+                self.crc_errors += 1
+                FRAME_ERRORS.inc()
+                pos = start + 1
+                continue
+            record = self._decode(seq, view, start + HEADER.size, length)
+            if record is not None:
+                items.append(record)
+            pos = end
+
+    def _decode(self, seq, view, offset, length):
+        if self._expected_seq is not None:
+            lost = (seq - self._expected_seq) & 0xFF
+            self.lost_frames += lost
+            FRAMES_LOST.inc(lost)
+        self._expected_seq = (seq + 1) & 0xFF
+        self.frames += 1
+        FRAMES.inc()
+        if length < STREAM_HEADER.size:
+            return None
+        first_us, last_us = STREAM_HEADER.unpack_from(view, offset)
+        count = (length - STREAM_HEADER.size) // 2
+        counts = np.frombuffer(view, dtype='<u2', count=count, offset=offset + STREAM_HEADER.size)
+        voltages = counts * (ADC_REFERENCE / ADC_MAX)
+        # micros() wraps every ~71 minutes; keep the timeline increasing
+        if self._last_us is not None and first_us < self._last_us:
+            self._wraps += 1
+        self._last_us = last_us
+        first = first_us + self._wraps * MICROS_WRAP
+        last = last_us + self._wraps * MICROS_WRAP
+        if last_us < first_us:
+            self._wraps += 1
+            last += MICROS_WRAP
+        t_ms = np.linspace(first, last, count) / 1000.0
+        return StreamBlock(t_ms, voltages)
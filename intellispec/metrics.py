@@ -0,0 +1,221 @@
+"""Counters, gauges and histograms for the acquisition pipeline.
+
+Modules register their metrics once, at import time, on the shared
+`registry` and update them where the work happens; an update is a lock and
+an addition, so metrics can stay on in the field. `registry.snapshot()` is
+what the diagnostics panel shows. `write_snapshot()` saves it as JSON or,
+for a .prom/.txt path, in the Prometheus text exposition format.
+
+Counters only ever grow; RateMeter turns them into per-second rates between
+two calls.
+"""
+
+import bisect
+import json
+import math
+import threading
+import time
+
+# Seconds; serial-to-GUI and handler times
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Seconds; chat requests
+REQUEST_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)   # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        # Estimated by linear interpolation inside the bucket; NaN when empty
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return math.nan
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]   # beyond the last bound
+                low = self.buckets[index - 1] if index else 0.0
+                return low + (self.buckets[index] - low) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, value_sum = self.count, self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        result = {'count': total, 'sum': value_sum,
+                  'buckets': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'], cumulative))}
+        for q in QUANTILES:
+            result[f'p{round(q * 100)}'] = self.quantile(q)
+        return result
+
+
+class Timer:
+    # Context manager that observes the elapsed time on a histogram
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return iter(list(self._metrics.values()))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def _register(self, cls, name, help, *args):
+        # Registering a name again returns the existing metric
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, *args)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help):
+        return self._register(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._register(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, help, buckets)
+
+    def snapshot(self):
+        return {'timestamp': time.time(),
+                'metrics': {metric.name: dict(type=metric.kind, help=metric.help, **metric.snapshot())
+                            for metric in self}}
+
+    def to_json(self):
+        # NaN quantiles of empty histograms become null
+        def clean(value):
+            if isinstance(value, dict):
+                return {key: clean(item) for key, item in value.items()}
+            if isinstance(value, float) and not math.isfinite(value):
+                return None
+            return value
+        return json.dumps(clean(self.snapshot()), indent=1)
+
+    def to_prometheus(self):
+        lines = []
+        for metric in self:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            snapshot = metric.snapshot()
+            if metric.kind == 'histogram':
+                for bound, count in snapshot['buckets'].items():
+                    lines.append(f'{metric.name}_bucket{{le="{bound}"}} {count}')
+                lines.append(f"{metric.name}_sum {snapshot['sum']}")
+                lines.append(f"{metric.name}_count {snapshot['count']}")
+            else:
+                lines.append(f"{metric.name} {snapshot['value']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_snapshot(self, path):
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+class RateMeter:
+    # Per-second rates of a registry's counters since the previous update()
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._last = {}
+        self._last_time = None
+
+    def update(self):
+        now = time.monotonic()
+        values = {metric.name: metric.value for metric in self.registry if metric.kind == 'counter'}
+        rates = {}
+        if self._last_time is not None and now > self._last_time:
+            elapsed = now - self._last_time
+            rates = {name: (value - self._last.get(name, 0)) / elapsed for name, value in values.items()}
+        self._last = values
+        self._last_time = now
+        return rates
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,16 @@
+"""Where IntelliSpec keeps its files.
+
+Both directories sit under ~/IntelliSpec unless overridden by environment
+variables: INTELLISPEC_CACHE_DIR for caches and remembered state (chat
+responses, calibrations), INTELLISPEC_DATA_DIR for recorded sessions.
+"""
+
+import os
+
+
+def default_cache_dir():
+    return os.getenv('INTELLISPEC_CACHE_DIR') or os.path.join(os.path.expanduser('~'), 'IntelliSpec', 'cache')
+
+
+def default_data_dir():
+    return os.getenv('INTELLISPEC_DATA_DIR') or os.path.join(os.path.expanduser('~'), 'IntelliSpec', 'sessions')
@@ -0,0 +1,106 @@
+"""Serial port discovery off the GUI thread.
+
+Enumerating ports with pyserial's comports() can take a long time on
+machines with many tty devices. PortWatcher enumerates them on its own
+thread every `interval` seconds and keeps the result. Readers get the
+cached list and never enumerate themselves. When a port appears or
+disappears, `on_change(ports, added, removed)` is called on the watcher
+thread. pyserial has no portable plug notification, so hot-plug events are
+found by comparing successive scans.
+
+Backoff produces the delays between reconnection attempts.
+"""
+
+import threading
+
+DEFAULT_SCAN_INTERVAL = 1.0   # seconds between scans
+INITIAL_RETRY_DELAY = 0.5     # seconds before the first reconnection attempt
+MAX_RETRY_DELAY = 30.0
+
+
+def list_port_infos():
+    import serial.tools.list_ports
+    return serial.tools.list_ports.comports()
+
+
+class PortWatcher:
+
+    def __init__(self, on_change=None, interval=DEFAULT_SCAN_INTERVAL, list_ports=list_port_infos):
+        self.on_change = on_change
+        self.interval = interval
+        self.list_ports = list_ports
+        self.scans = 0
+        self.error = None
+        # Replaced as a whole on every change, so readers never see a partial update
+        self._infos = {}    # device -> ListPortInfo
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    @property
+    def ports(self):
+        return sorted(self._infos)
+
+    def info(self, device):
+        # Cached ListPortInfo of a port, None for unknown (e.g. virtual) ports
+        return self._infos.get(device)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='port-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def rescan(self):
+        # Ask for a scan now instead of at the next interval; doesn't wait for it
+        self._wake.set()
+
+    def scan(self):
+        try:
+            infos = {info.device: info for info in self.list_ports()}
+            self.error = None
+        except Exception as e:
+            # Keep the last good list; enumeration failures are usually transient
+            self.error = e
+            return
+        self.scans += 1
+        old = self._infos
+        # Same path with a different device behind it counts as unplug + plug
+        added = [device for device, info in infos.items()
+                 if device not in old or old[device].hwid != info.hwid]
+        removed = [device for device, info in old.items()
+                   if device not in infos or infos[device].hwid != info.hwid]
+        if added or removed or self.scans == 1:
+            self._infos = infos
+            if self.on_change is not None:
+                self.on_change(self.ports, sorted(added), sorted(removed))
+
+    def _run(self):
+        while self._running:
+            self.scan()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+class Backoff:
+    # Exponentially growing delays: initial, 2 * initial, ... up to maximum
+
+    def __init__(self, initial=INITIAL_RETRY_DELAY, maximum=MAX_RETRY_DELAY, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,93 @@
+"""Opt-in sampling profiler for finding stalls in the field.
+
+While running, a background thread records the Python stack of every other
+thread each `interval` seconds (sys._current_frames), so a slow GUI handler
+or a blocked reader shows up without a debugger or an instrumented build.
+It costs nothing while stopped. Stacks are written in the collapsed format
+("thread;outer;...;inner count") that flamegraph.pl and speedscope read,
+and summarised as the functions most often seen on top of a stack.
+"""
+
+import os
+import sys
+import threading
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005   # seconds between samples
+MAX_DEPTH = 64             # innermost frames kept per stack
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=DEFAULT_INTERVAL, thread_names=None):
+        self.interval = interval
+        # Only sample threads with these names (e.g. {'MainThread'}); None for all
+        self.thread_names = set(thread_names) if thread_names else None
+        self.stacks = Counter()   # (thread name, outer frame, ..., inner frame) -> samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def clear(self):
+        self.stacks.clear()
+        self.samples = 0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == own or (self.thread_names is not None and name not in self.thread_names):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self, limit=20):
+        # [(frame, samples on top of the stack, samples anywhere in it)]
+        own = Counter()
+        total = Counter()
+        for stack, count in list(self.stacks.items()):
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(limit)]
+
+    def report(self, limit=20):
+        lines = [f"{self.samples} samples every {self.interval * 1000:.1f} ms",
+                 f"{'own':>7} {'total':>7}  function"]
+        for label, count, total in self.top_functions(limit):
+            lines.append(f"{count:>7} {total:>7}  {label}")
+        return '\n'.join(lines)
+
+    def write_collapsed(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(';'.join(stack) + f" {count}\n")
@@ -0,0 +1,89 @@
+"""Parser for the line protocol spoken by sketch_nov11a.ino.
+
+Every line the firmware prints starts with a fixed prefix up to the first
+colon. The prefix is looked up in a dispatch table, its value is checked with
+the table's regex and the regex groups become the fields of a typed record.
+Lines without a known prefix are kept as free-text messages. Records that
+were already decoded from binary frames (see framing.py) pass through.
+"""
+
+import re
+from collections import namedtuple
+
+from .metrics import registry
+
+PARSE_ERRORS = registry.counter('intellispec_parse_errors_total', "Lines with a known prefix and a bad value")
+
+BlankVoltage = namedtuple('BlankVoltage', 'voltage')      # V0, end of calibration
+DarkVoltage = namedtuple('DarkVoltage', 'voltage')        # Vd reported by the device
+SampleVoltage = namedtuple('SampleVoltage', 'voltage')    # V, end of a read
+DeviceAbsorbance = namedtuple('DeviceAbsorbance', 'absorbance')
+StreamSample = namedtuple('StreamSample', 't_ms voltage')  # one sample in stream mode
+RawSample = namedtuple('RawSample', 'counts')             # one ADC reading of 'oversample'
+RawDone = namedtuple('RawDone', 'count')                  # end of an 'oversample' burst
+BaudRate = namedtuple('BaudRate', 'rate')                 # link speed after 'baud <rate>'
+BinaryMode = namedtuple('BinaryMode', 'enabled')          # stream framing after 'binary <0|1>'
+StreamBlock = namedtuple('StreamBlock', 't_ms voltage')   # arrays from one binary stream frame
+# One channel of a spectral scan: its index, LED wavelength (nm), dark and lit voltages
+ScanBlankPoint = namedtuple('ScanBlankPoint', 'channel wavelength dark voltage')   # of 'scan blank'
+ScanPoint = namedtuple('ScanPoint', 'channel wavelength dark voltage')             # of 'scan'
+ScanDone = namedtuple('ScanDone', 'count')                # end of a scan, channel count
+Message = namedtuple('Message', 'text')                   # prompts, status, errors
+InvalidLine = namedtuple('InvalidLine', 'prefix text')    # known prefix, bad value
+
+FLOAT = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?(?:inf|nan|ovf)'
+FLOAT_RE = re.compile(f'({FLOAT})', re.IGNORECASE)
+STREAM_RE = re.compile(rf'(\d+),({FLOAT})', re.IGNORECASE)
+SCAN_RE = re.compile(rf'(\d+),(\d+),({FLOAT}),({FLOAT})', re.IGNORECASE)
+
+# prefix (including the colon) -> (value regex, record type)
+LINE_TYPES = {
+    'Initial Voltage (Blank):': (FLOAT_RE, BlankVoltage),
+    'Dark Voltage:': (FLOAT_RE, DarkVoltage),
+    'Voltage:': (FLOAT_RE, SampleVoltage),
+    'Absorbance:': (FLOAT_RE, DeviceAbsorbance),
+    'S:': (STREAM_RE, StreamSample),
+    'Raw:': (FLOAT_RE, RawSample),
+    'Raw Done:': (FLOAT_RE, RawDone),
+    'Baud:': (FLOAT_RE, BaudRate),
+    'Binary:': (FLOAT_RE, BinaryMode),
+    'Scan Blank:': (SCAN_RE, ScanBlankPoint),
+    'Scan:': (SCAN_RE, ScanPoint),
+    'Scan Done:': (FLOAT_RE, ScanDone),
+}
+
+
+def to_float(text):
+    # Arduino prints "ovf" for floats it can't format
+    return float('inf') if text.lower() == 'ovf' else float(text)
+
+
+def parse_line(line):
+    line = line.strip()
+    if not line:
+        return None
+    colon = line.find(':')
+    if colon < 0:
+        return Message(line)
+    prefix = line[:colon + 1]
+    entry = LINE_TYPES.get(prefix)
+    if entry is None:
+        return Message(line)
+    pattern, record_type = entry
+    match = pattern.fullmatch(line[colon + 1:].strip())
+    if match is None:
+        PARSE_ERRORS.inc()
+        return InvalidLine(prefix, line)
+    return record_type(*map(to_float, match.groups()))
+
+
+def parse_lines(lines):
+    records = []
+    for line in lines:
+        if not isinstance(line, str):
+            records.append(line)
+            continue
+        record = parse_line(line)
+        if record is not None:
+            records.append(record)
+    return records
@@ -0,0 +1,165 @@
+"""Recompute absorbance for recorded sessions with a new calibration or formula.
+
+Every record keeps its raw voltage and the V0 and Vd it was computed with, so
+absorbance and transmittance can be recomputed after the fact: with a
+corrected dark voltage, a different blank, or another formula version.
+
+Sessions are split into ranges of `chunk_records` records and the ranges
+run on a process pool. Each worker memory-maps its slice of the original
+and writes the same slice of a preallocated output file, so nothing is
+pickled between processes but the task description, and no process holds
+more than one block in memory. Originals are never modified: the result of
+`session-X.isrec` is written next to it as `session-X.r<N>.isrec`, N one
+past the newest existing version, together with `session-X.r<N>.json`
+describing how it was made. Outputs are written under a temporary name and
+renamed once every range of the session is done.
+"""
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from .beer_lambert import RATIO_OFFSET, absorbance_batch, transmittance_batch
+from .store import EXPORT_CHUNK, FILE_SUFFIX, allocate_session, open_history, open_records
+
+# Formula version -> ratio offset in A = log10((V0 - Vd) / (V - Vd) - offset)
+FORMULAS = {
+    1: RATIO_OFFSET,   # as recorded by the UI so far
+    2: 0.0,            # plain Beer-Lambert, as computed by the sketch
+}
+# The formula every recorded session was computed with; change only when asked
+DEFAULT_FORMULA = 1
+DEFAULT_CHUNK_RECORDS = 1 << 24   # per task, 512 MiB of records
+PARTIAL_SUFFIX = '.partial'
+VERSION_RE = re.compile(r'\.r(\d+)$')
+SIDECAR_VERSION = 1
+
+# dark_voltage/initial_voltage None: keep the values recorded with each reading
+Reprocessing = namedtuple('Reprocessing', 'dark_voltage initial_voltage formula')
+# source, output and records of one reprocessed session
+Result = namedtuple('Result', 'source output records')
+
+
+def is_output(path):
+    stem = os.path.basename(path)[:-len(FILE_SUFFIX)]
+    return VERSION_RE.search(stem) is not None
+
+
+def find_sessions(directory, recursive=False):
+    # Original session files under a directory; earlier outputs are skipped
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths += [os.path.join(root, name) for name in files
+                  if name.endswith(FILE_SUFFIX) and not is_output(name)]
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def output_path(source):
+    # Next free version next to the original: session.isrec -> session.r<N>.isrec
+    directory, name = os.path.split(source)
+    stem = name[:-len(FILE_SUFFIX)]
+    versions = [0]
+    for other in os.listdir(directory or '.'):
+        if other.startswith(stem + '.r') and other.endswith(FILE_SUFFIX):
+            match = VERSION_RE.search(other[:-len(FILE_SUFFIX)])
+            if match and other[:match.start()] == stem:
+                versions.append(int(match.group(1)))
+    return os.path.join(directory, f"{stem}.r{max(versions) + 1}{FILE_SUFFIX}")
+
+
+def recompute(records, out, settings):
+    # Copy records into out with absorbance and transmittance recomputed
+    out[:] = records
+    if settings.dark_voltage is not None:
+        out['dark_voltage'] = settings.dark_voltage
+    if settings.initial_voltage is not None:
+        out['initial_voltage'] = settings.initial_voltage
+    initial_voltages = out['initial_voltage'].astype(np.float64)
+    absorbances = absorbance_batch(out['voltage'], initial_voltages, out['dark_voltage'].astype(np.float64),
+                                   FORMULAS[settings.formula])
+    # Readings taken before calibration stay without absorbance
+    absorbances[np.isnan(initial_voltages)] = np.nan
+    out['absorbance'] = absorbances
+    out['transmittance'] = transmittance_batch(absorbances)
+
+
+def process_range(source, target, start, stop, settings):
+    # Worker: records [start, stop) of source into the same range of target
+    records = open_records(source, start, stop)
+    out = open_records(target, start, stop, mode='r+')
+    for block in range(0, stop - start, EXPORT_CHUNK):
+        recompute(records[block:block + EXPORT_CHUNK], out[block:block + EXPORT_CHUNK], settings)
+    out.flush()
+    del records, out
+    return stop - start
+
+
+def write_sidecar(source, output, records, settings):
+    info = {'version': SIDECAR_VERSION, 'source': os.path.basename(source), 'records': records,
+            'formula': settings.formula, 'ratio_offset': FORMULAS[settings.formula],
+            'dark_voltage': settings.dark_voltage, 'initial_voltage': settings.initial_voltage,
+            'created': time.time()}
+    with open(output[:-len(FILE_SUFFIX)] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=1)
+
+
+def reprocess(sources, settings, workers=None, chunk_records=DEFAULT_CHUNK_RECORDS, on_progress=None):
+    # Reprocesses every session file in sources; returns a Result per session.
+    # on_progress(records done, records in total) is called as ranges finish.
+    if settings.formula not in FORMULAS:
+        raise ValueError(f"unknown formula version {settings.formula}")
+    # Every file is checked before anything is written
+    counts = [len(open_history(source)) for source in sources]
+    sessions = []   # [source, output, records, ranges left]
+    tasks = []
+    for source, count in zip(sources, counts):
+        ranges = [(start, min(start + chunk_records, count)) for start in range(0, count, chunk_records)]
+        sessions.append([source, output_path(source), count, len(ranges)])
+        tasks += [(len(sessions) - 1, start, stop) for start, stop in ranges]
+    total = sum(session[2] for session in sessions)
+    done = 0
+
+    def complete(session):
+        os.replace(session[1] + PARTIAL_SUFFIX, session[1])
+        write_sidecar(session[0], session[1], session[2], settings)
+
+    def finished(index, records):
+        nonlocal done
+        done += records
+        session = sessions[index]
+        session[3] -= 1
+        if session[3] == 0:
+            complete(session)
+        if on_progress is not None:
+            on_progress(done, total)
+
+    try:
+        for session in sessions:
+            allocate_session(session[1] + PARTIAL_SUFFIX, session[2])
+        for session in sessions:
+            if session[3] == 0:   # no records
+                complete(session)
+        if workers == 1 or len(tasks) <= 1:
+            for index, start, stop in tasks:
+                source, output = sessions[index][:2]
+                finished(index, process_range(source, output + PARTIAL_SUFFIX, start, stop, settings))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(process_range, sessions[index][0], sessions[index][1] + PARTIAL_SUFFIX,
+                                       start, stop, settings): index
+                           for index, start, stop in tasks}
+                for future in as_completed(futures):
+                    finished(futures[future], future.result())
+    finally:
+        # Leave nothing half-written behind on errors
+        for source, output, _, _ in sessions:
+            if os.path.exists(output + PARTIAL_SUFFIX):
+                os.remove(output + PARTIAL_SUFFIX)
+    return [Result(source, output, count) for source, output, count, _ in sessions]
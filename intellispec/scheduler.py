@@ -0,0 +1,119 @@
+"""Queued multi-sample runs.
+
+A run is a list of entries (label x replicate). The scheduler keeps up to
+`depth` `read` commands outstanding so the device starts the next reading as
+soon as it has printed the previous one. The firmware answers commands in
+order, so each `Voltage:` reply belongs to the oldest outstanding entry, and
+each `Place the sample.` banner to the next entry that hasn't started. A
+banner for a later entry means the oldest one's reply was lost.
+"""
+
+import time
+from collections import deque, namedtuple
+
+from .acquisition import READ, LateReplies, is_start_banner
+from .protocol import SampleVoltage
+
+RunEntry = namedtuple('RunEntry', 'index label replicate')
+# voltage is NaN when the entry timed out; timestamp is wall-clock seconds
+RunResult = namedtuple('RunResult', 'index label replicate voltage timestamp')
+
+DEFAULT_PIPELINE_DEPTH = 2
+
+
+def build_run(labels, replicates=1):
+    entries = []
+    for label in labels:
+        for replicate in range(1, replicates + 1):
+            entries.append(RunEntry(len(entries), label, replicate))
+    return entries
+
+
+class RunScheduler:
+
+    def __init__(self, entries, send, depth=DEFAULT_PIPELINE_DEPTH,
+                 timeout=READ.timeout, clock=time.monotonic):
+        self.send = send
+        self.depth = depth
+        self.timeout = timeout
+        self.clock = clock
+        self.pending = deque(entries)
+        self.in_flight = deque()
+        self.results = []
+        self.cancelled = False
+        self.deadline = None
+        self.late = LateReplies(clock)   # replies owed to entries that timed out
+        self.sent = 0       # reads sent
+        self.started = 0    # of those, announced by the device
+
+    @property
+    def total(self):
+        return len(self.results) + len(self.in_flight) + len(self.pending)
+
+    @property
+    def done(self):
+        return not self.in_flight and (self.cancelled or not self.pending)
+
+    def start(self):
+        self._fill()
+
+    def cancel(self):
+        # Entries already sent will still be answered by the device. Their
+        # replies are no longer recorded but stay owed in `late`, which the
+        # acquisition machine takes over when the run ends.
+        self.cancelled = True
+        self.pending.clear()
+        first = self._oldest_number()
+        for position in range(len(self.in_flight)):
+            self.late.add(SampleVoltage, max(0, first + position - self.started),
+                          (position + 1) * self.timeout)
+        self.in_flight.clear()
+        self.deadline = None
+
+    def handle_record(self, record):
+        # Returns the RunResult completed by this record, if any.
+        if is_start_banner(record):
+            if not self.late.started():
+                self.started = min(self.started + 1, self.sent)
+                if self.in_flight and self._oldest_number() < self.started:
+                    # A later read has started: the oldest one's reply was lost
+                    return self._complete(float('nan'))
+            return None
+        if not isinstance(record, SampleVoltage):
+            return None
+        if self.late.take(record):
+            return None
+        if not self.in_flight:
+            return None
+        return self._complete(record.voltage)
+
+    def check_timeout(self):
+        # The device works through commands one at a time, so only the oldest
+        # outstanding entry has a running deadline.
+        if self.deadline is None or self.clock() < self.deadline:
+            return None
+        # Settled by the next read's banner if the reply was lost
+        self.late.add(SampleVoltage)
+        self.started = max(self.started, self._oldest_number())
+        return self._complete(float('nan'))
+
+    def _oldest_number(self):
+        # 1-based number, in sending order, of the oldest outstanding read
+        return self.sent - len(self.in_flight) + 1
+
+    def _complete(self, voltage):
+        entry = self.in_flight.popleft()
+        result = RunResult(entry.index, entry.label, entry.replicate, voltage, time.time())
+        self.results.append(result)
+        self.deadline = self.clock() + self.timeout if self.in_flight else None
+        self._fill()
+        return result
+
+    def _fill(self):
+        while not self.cancelled and self.pending and len(self.in_flight) < self.depth:
+            entry = self.pending.popleft()
+            if not self.in_flight:
+                self.deadline = self.clock() + self.timeout
+            self.in_flight.append(entry)
+            self.sent += 1
+            self.send(READ.payload)
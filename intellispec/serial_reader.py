@@ -0,0 +1,184 @@
+"""Blocking, batched serial reader.
+
+The reader blocks on the port instead of polling it, keeps raw bytes in a
+bounded buffer, splits complete lines in bulk and hands them on in batches
+bounded by size and age. With a frame decoder set, binary frames are
+separated from the text first and passed on as records among the lines.
+"""
+
+import threading
+import time
+from collections import deque
+
+from .metrics import registry
+
+# Stream sample lines, which may be shed when the consumer falls behind.
+# Everything else is always delivered: a READ's 'Voltage:'/'Absorbance:'
+# reply completes a command (or a queued run's read) that is waiting on it.
+DROPPABLE_PREFIXES = ('S:',)
+
+DEFAULT_MAX_BATCH = 256         # lines per batch
+DEFAULT_MAX_LATENCY = 0.05      # seconds a line may wait before its batch is flushed
+DEFAULT_MAX_PENDING = 4096      # lines held back while the consumer is busy
+DEFAULT_MAX_IN_FLIGHT = 2       # batches handed out but not yet acknowledged
+DEFAULT_BUFFER_SIZE = 64 * 1024  # raw bytes kept while waiting for a newline
+
+# Totals over every reader (the main port and the device panel's channels)
+BYTES_READ = registry.counter('intellispec_serial_bytes_total', "Bytes read from serial ports")
+LINES_READ = registry.counter('intellispec_serial_lines_total', "Text lines read from serial ports")
+LINES_DROPPED = registry.counter('intellispec_serial_dropped_lines_total',
+                                 "Stream lines shed because the consumer fell behind")
+IN_FLIGHT = registry.gauge('intellispec_batches_in_flight', "Batches handed on and not yet acknowledged")
+BATCH_LATENCY = registry.histogram('intellispec_serial_to_consumer_seconds',
+                                   "Time from a batch's first line arriving to the consumer finishing it")
+
+
+def is_droppable_line(line):
+    # Decoded binary frames only ever carry stream samples
+    return not isinstance(line, str) or line.startswith(DROPPABLE_PREFIXES)
+
+
+class ByteRingBuffer:
+    # Bounded FIFO of raw bytes. CPython's bytearray removes bytes from the
+    # front without moving the rest, so append + front delete behaves like a
+    # ring. When a writer outruns the reader the oldest bytes are discarded
+    # and the buffer resyncs on the next line boundary.
+
+    def __init__(self, capacity=DEFAULT_BUFFER_SIZE):
+        self.capacity = capacity
+        self.dropped_bytes = 0
+        self._buf = bytearray()
+
+    def __len__(self):
+        return len(self._buf)
+
+    def write(self, data):
+        self._buf += data
+        overflow = len(self._buf) - self.capacity
+        if overflow > 0:
+            cut = self._buf.find(b'\n', overflow)
+            cut = len(self._buf) if cut < 0 else cut + 1
+            del self._buf[:cut]
+            self.dropped_bytes += cut
+
+    def pop_lines(self):
+        # Decode everything up to the last newline in one go and split it,
+        # leaving any trailing partial line in the buffer.
+        end = self._buf.rfind(b'\n')
+        if end < 0:
+            return []
+        text = self._buf[:end].decode('utf-8', errors='replace')
+        del self._buf[:end + 1]
+        return [line for line in map(str.strip, text.split('\n')) if line]
+
+
+class BatchReader:
+    # Reads lines from an open serial port and passes them to `on_batch` as
+    # lists. A batch is flushed once it holds `max_batch` lines or its oldest
+    # line is `max_latency` seconds old. The consumer calls `ack()` for every
+    # batch it has finished; while `max_in_flight` batches are outstanding,
+    # lines are held back and, past `max_pending`, the oldest droppable ones
+    # are shed.
+
+    def __init__(self, port, on_batch, max_batch=DEFAULT_MAX_BATCH,
+                 max_latency=DEFAULT_MAX_LATENCY, max_pending=DEFAULT_MAX_PENDING,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, buffer_size=DEFAULT_BUFFER_SIZE,
+                 is_droppable=is_droppable_line):
+        self.port = port
+        self.on_batch = on_batch
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.is_droppable = is_droppable
+        self.ring = ByteRingBuffer(buffer_size)
+        # Set to a framing.FrameDecoder once the device sends binary frames
+        self.decoder = None
+        self.dropped_lines = 0
+        self._pending = []
+        self._pending_since = 0.0
+        self._in_flight = 0
+        self._in_flight_since = deque()  # arrival time of each unacknowledged batch
+        self._lock = threading.Lock()
+
+    def ack(self):
+        with self._lock:
+            if self._in_flight == 0:
+                return
+            self._in_flight -= 1
+            since = self._in_flight_since.popleft()
+        IN_FLIGHT.dec()
+        BATCH_LATENCY.observe(time.monotonic() - since)
+
+    def run(self, should_continue):
+        port = self.port
+        try:
+            while should_continue():
+                # Blocks until at least one byte arrives or the port times out,
+                # then picks up whatever else is already waiting.
+                data = port.read(port.in_waiting or 1)
+                if data:
+                    BYTES_READ.inc(len(data))
+                    self.feed(data)
+                self.flush()
+        finally:
+            # Batches still unacknowledged no longer count as queued
+            with self._lock:
+                outstanding, self._in_flight = self._in_flight, 0
+                self._in_flight_since.clear()
+            IN_FLIGHT.dec(outstanding)
+
+    def feed(self, data):
+        decoder = self.decoder
+        if decoder is None:
+            self._add_text(data)
+            return
+        for item in decoder.feed(data):
+            if isinstance(item, bytes):
+                self._add_text(item)
+            else:
+                self._add([item])
+
+    def _add_text(self, data):
+        self.ring.write(data)
+        lines = self.ring.pop_lines()
+        if lines:
+            LINES_READ.inc(len(lines))
+            self._add(lines)
+
+    def _add(self, items):
+        if not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.extend(items)
+
+    def flush(self, force=False):
+        if not self._pending:
+            return
+        if not force and len(self._pending) < self.max_batch and \
+                time.monotonic() - self._pending_since < self.max_latency:
+            return
+        with self._lock:
+            busy = self._in_flight >= self.max_in_flight
+            if not busy:
+                self._in_flight += 1
+                self._in_flight_since.append(self._pending_since)
+        if busy:
+            self._shed()
+            return
+        IN_FLIGHT.inc()
+        batch, self._pending = self._pending, []
+        self.on_batch(batch)
+
+    def _shed(self):
+        excess = len(self._pending) - self.max_pending
+        if excess <= 0:
+            return
+        kept = []
+        for line in self._pending:
+            if excess and self.is_droppable(line):
+                excess -= 1
+                self.dropped_lines += 1
+                LINES_DROPPED.inc()
+            else:
+                kept.append(line)
+        self._pending = kept
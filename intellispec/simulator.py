@@ -0,0 +1,432 @@
+"""Virtual spectrophotometer on a pseudo-terminal.
+
+Opens a pty and answers on it the way sketch_nov11a.ino answers on the
+Arduino's serial port: the same commands, the same lines and number
+formatting, and the same blocking delays. Anything that can open a serial
+port by path (pyserial, the UI, the CLI) can talk to it as if a real
+device were attached.
+
+Delays, noise, streaming rate and link speed are configurable, as is fault
+injection: garbage bytes, lines split across writes and a disconnect after
+a given time.
+
+For spectral scans it models a multi-LED build: one channel per entry of
+`wavelengths`, each LED a little dimmer than the main one, and a sample
+whose absorbance is a Gaussian band around `peak_wavelength` that reaches
+the single-LED sample's absorbance at its centre.
+
+    python -m intellispec.simulator --time-scale 0.1 --noise 0.005
+"""
+
+import argparse
+import math
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+# The sketch's ADC, clamps and link settings are the ones the host models
+from .acquisition import BAUD_RATES, MAX_OVERSAMPLE
+from .framing import ADC_MAX, ADC_REFERENCE, MAX_FRAME_SAMPLES, encode_stream_frame
+from .streaming import MAX_BINARY_STREAM_RATE, MAX_STREAM_RATE
+
+MAX_FRAME_AGE = 0.02    # seconds before a partial binary frame is sent
+DARK_SETTLE_TIME = 0.2  # seconds after switching the LED, as in the sketch
+DARK_READINGS = 16
+SCAN_SETTLE_TIME = 0.02  # seconds after switching an LED during a scan
+SCAN_READINGS = 8
+DEFAULT_WAVELENGTHS = (430, 470, 505, 525, 570, 590, 625, 660)   # nm
+
+
+def arduino_float(value, digits=2):
+    # Serial.print(float) formatting: fixed decimals, 'nan'/'inf'/'ovf'
+    if math.isnan(value):
+        return 'nan'
+    if math.isinf(value):
+        return 'inf'
+    if abs(value) > 4294967040.0:
+        return 'ovf'
+    return f'{value:.{digits}f}'
+
+
+class VirtualSpectrophotometer:
+
+    def __init__(self, blank_voltage=4.2, sample_voltage=1.8, dark_voltage=0.02,
+                 noise=0.005, signal=None, calibrate_delay=10.0, read_delay=5.0,
+                 time_scale=1.0, baudrate=None, garbage_rate=0.0, partial_rate=0.0,
+                 disconnect_after=None, seed=None, wavelengths=DEFAULT_WAVELENGTHS,
+                 peak_wavelength=525.0, band_width=40.0):
+        self.blank_voltage = blank_voltage
+        self.sample_voltage = sample_voltage
+        self.dark_voltage = dark_voltage      # photodiode output with the LED off
+        self.noise = noise                    # Gaussian noise sigma, volts
+        self.signal = signal                  # optional f(seconds) -> sample voltage
+        self.calibrate_delay = calibrate_delay
+        self.read_delay = read_delay
+        self.time_scale = time_scale          # multiplies every delay
+        self.baudrate = baudrate              # None = unthrottled
+        self.garbage_rate = garbage_rate      # probability per line of a garbage burst
+        self.partial_rate = partial_rate      # probability per line of a split write
+        self.disconnect_after = disconnect_after
+        self.random = random.Random(seed)
+        self.wavelengths = tuple(wavelengths)  # nm of each scan channel's LED
+        self.peak_wavelength = peak_wavelength
+        self.band_width = band_width          # Gaussian sigma of the absorption band, nm
+
+        self.port = None
+        self.started = 0.0                    # time.monotonic() when start() was called
+        self.lines_sent = 0
+        self.samples_streamed = 0
+        self.dropped_bytes = 0
+        self.disconnected = False
+        self.initial_voltage = 0.0
+        self.measured_dark_voltage = 0.02     # the sketch's value until it measures one
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._running = False
+        self._task = None
+        self._busy_until = 0.0
+        self._streaming = False
+        self._stream_interval = 0.0
+        self._next_sample = 0.0
+        self.binary = False
+        self.link_baudrate = 9600             # as negotiated with 'baud <rate>'
+        self._frame_seq = 0
+        self._frame = []                      # (micros, counts) of the unsent frame
+
+    # Lifecycle
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self.started = time.monotonic()
+        self._task = self._banner()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='virtual-spectrophotometer', daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _close(self):
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    # Device model
+
+    def millis(self):
+        return int((time.monotonic() - self.started) * 1000)
+
+    def micros(self):
+        return int((time.monotonic() - self.started) * 1000000)
+
+    def analog_read(self, voltage):
+        # 10-bit ADC with Gaussian noise, like analogRead(sensorPin) * 5.0 / 1023.0
+        voltage += self.random.gauss(0.0, self.noise) if self.noise else 0.0
+        counts = min(ADC_MAX, max(0, round(voltage * ADC_MAX / ADC_REFERENCE)))
+        return counts * ADC_REFERENCE / ADC_MAX
+
+    def current_sample_voltage(self):
+        if self.signal is not None:
+            return self.signal(time.monotonic() - self.started)
+        return self.sample_voltage
+
+    # Command handlers are generators: yielded strings are printed as lines,
+    # yielded numbers block the "device" for that many seconds.
+
+    def _banner(self):
+        yield "Spectrophotometer Ready"
+        yield "Type 'calibrate' to calibrate with a blank or 'read' to measure a sample."
+        yield "Type 'stream <hz>' to sample continuously and 'stop' to end streaming."
+        yield "Type 'oversample <k>' to take k raw readings of a sample."
+        yield "Type 'dark' to measure the dark signal with the LED off."
+        yield "Type 'baud <rate>' to change the link speed and 'binary 1' for binary stream frames."
+        yield "Type 'scan blank' and then 'scan' for a spectrum over every LED."
+
+    def _measure_dark(self):
+        # LED off, settle, average 16 readings, LED on and settle again
+        yield DARK_SETTLE_TIME
+        readings = [self.analog_read(self.dark_voltage) for _ in range(DARK_READINGS)]
+        self.measured_dark_voltage = sum(readings) / len(readings)
+        yield DARK_SETTLE_TIME
+        yield "Dark Voltage: " + arduino_float(self.measured_dark_voltage, 3)
+
+    def _calibrate(self):
+        yield "Calibrating dark signal..."
+        yield from self._measure_dark()
+        yield "Please calibrate with blank. Waiting for 10 seconds..."
+        yield self.calibrate_delay
+        self.initial_voltage = self.analog_read(self.blank_voltage)
+        yield "Initial Voltage (Blank): " + arduino_float(self.initial_voltage)
+        yield "Calibration complete. You can now type 'read' to measure samples."
+
+    def _read_sample(self):
+        yield "Place the sample. Reading in 5 seconds..."
+        yield self.read_delay
+        voltage = self.analog_read(self.current_sample_voltage())
+        yield "Voltage: " + arduino_float(voltage)
+        enters = self.initial_voltage - self.measured_dark_voltage
+        passes = voltage - self.measured_dark_voltage
+        ratio = enters / passes if passes else math.copysign(math.inf, enters)
+        if ratio > 100:
+            absorbance = 2.00
+        else:
+            absorbance = math.log10(ratio) if ratio > 0 else math.nan
+        yield "Absorbance: " + arduino_float(absorbance)
+
+    def channel_blank_voltage(self, channel):
+        # LED brightness falls off a little from channel to channel
+        return self.dark_voltage + (self.blank_voltage - self.dark_voltage) * (1.0 - 0.05 * channel)
+
+    def channel_sample_voltage(self, channel, wavelength):
+        blank = self.channel_blank_voltage(channel)
+        ratio = (self.current_sample_voltage() - self.dark_voltage) / (self.blank_voltage - self.dark_voltage)
+        peak = -math.log10(min(1.0, max(ratio, 1e-3)))
+        band = math.exp(-0.5 * ((wavelength - self.peak_wavelength) / self.band_width) ** 2)
+        return self.dark_voltage + (blank - self.dark_voltage) * 10 ** (-peak * band)
+
+    def _average_read(self, voltage, count):
+        return sum(self.analog_read(voltage) for _ in range(count)) / count
+
+    def _scan(self, blank):
+        for channel, wavelength in enumerate(self.wavelengths):
+            yield SCAN_SETTLE_TIME
+            dark = self._average_read(self.dark_voltage, SCAN_READINGS)
+            yield SCAN_SETTLE_TIME
+            lit = self.channel_blank_voltage(channel) if blank else \
+                self.channel_sample_voltage(channel, wavelength)
+            lit = self._average_read(lit, SCAN_READINGS)
+            yield (f"{'Scan Blank' if blank else 'Scan'}: {channel},{wavelength},"
+                   f"{arduino_float(dark, 3)},{arduino_float(lit, 3)}")
+        yield f"Scan Done: {len(self.wavelengths)}"
+
+    def _read_raw(self, count):
+        if count <= 0:
+            count = 1
+        elif count > MAX_OVERSAMPLE:
+            count = MAX_OVERSAMPLE
+        yield f"Place the sample. Reading {count} raw samples in 5 seconds..."
+        yield self.read_delay
+        for _ in range(count):
+            voltage = self.analog_read(self.current_sample_voltage())
+            yield f"Raw:{round(voltage * ADC_MAX / ADC_REFERENCE)}"
+        yield f"Raw Done: {count}"
+
+    def _start_stream(self, rate):
+        max_rate = MAX_BINARY_STREAM_RATE if self.binary else MAX_STREAM_RATE
+        if rate <= 0:
+            rate = 100
+        elif rate > max_rate:
+            rate = max_rate
+        self._stream_interval = 1.0 / rate
+        yield f"Streaming at {rate} Hz. Type 'stop' to end."
+        self._next_sample = time.monotonic()
+        self._streaming = True
+
+    def _stop_stream(self):
+        self._streaming = False
+        self._send_frame()
+        yield "Stream stopped."
+
+    def _set_baud(self, rate):
+        if rate in BAUD_RATES:
+            self.link_baudrate = rate
+            # Output throttling, when enabled, follows the new link speed
+            if self.baudrate:
+                self.baudrate = rate
+        yield f"Baud: {self.link_baudrate}"
+
+    def _set_binary(self, enabled):
+        self._send_frame()
+        self.binary = enabled
+        yield f"Binary: {int(enabled)}"
+
+    def _invalid(self):
+        yield "Invalid command. Type 'calibrate' to calibrate or 'read' to measure a sample."
+
+    @staticmethod
+    def _to_int(text):
+        try:
+            return int(text.strip() or 0)
+        except ValueError:
+            return 0  # String.toInt() returns 0 for garbage
+
+    def _dispatch(self, command):
+        if command == 'calibrate':
+            return self._calibrate()
+        if command == 'read':
+            return self._read_sample()
+        if command == 'dark':
+            return self._measure_dark()
+        if command == 'scan blank':
+            return self._scan(True)
+        if command == 'scan':
+            return self._scan(False)
+        if command.startswith('oversample'):
+            return self._read_raw(self._to_int(command[10:]))
+        if command.startswith('stream'):
+            return self._start_stream(self._to_int(command[6:]))
+        if command == 'stop':
+            return self._stop_stream()
+        if command.startswith('baud'):
+            return self._set_baud(self._to_int(command[4:]))
+        if command.startswith('binary'):
+            return self._set_binary(self._to_int(command[6:]) != 0)
+        return self._invalid()
+
+    # I/O loop
+
+    def _run(self):
+        rx = bytearray()
+        commands = []
+        while self._running:
+            now = time.monotonic()
+            if self.disconnect_after is not None and now - self.started >= self.disconnect_after:
+                # Simulated unplug: the host sees the port go away
+                self.disconnected = True
+                self._running = False
+                self._close()
+                return
+
+            wait = 0.05
+            if self._task is not None:
+                wait = max(0.0, min(wait, self._busy_until - now))
+            elif self._streaming:
+                wait = max(0.0, min(wait, self._next_sample - now))
+            readable, _, _ = select.select([self._master], [], [], wait)
+            if readable:
+                try:
+                    rx += os.read(self._master, 4096)
+                except OSError:
+                    pass
+                while b'\n' in rx:
+                    line, _, rest = rx.partition(b'\n')
+                    rx = bytearray(rest)
+                    commands.append(line.decode('ascii', errors='replace').strip())
+
+            if self._task is None and commands:
+                self._task = self._dispatch(commands.pop(0))
+            self._step_task()
+            if self._task is None and self._streaming:
+                self._stream_samples()
+            if self._frame and time.monotonic() - self.started - self._frame[0][0] / 1e6 >= MAX_FRAME_AGE:
+                self._send_frame()
+
+    def _step_task(self):
+        # Run the current command until it blocks or finishes
+        while self._task is not None and time.monotonic() >= self._busy_until:
+            try:
+                step = next(self._task)
+            except StopIteration:
+                self._task = None
+                return
+            if isinstance(step, str):
+                self._write_line(step)
+            else:
+                self._busy_until = time.monotonic() + step * self.time_scale
+
+    def _stream_samples(self):
+        now = time.monotonic()
+        if now < self._next_sample:
+            return
+        self._next_sample += self._stream_interval
+        if now - self._next_sample >= self._stream_interval:
+            self._next_sample = now
+        voltage = self.analog_read(self.current_sample_voltage())
+        self.samples_streamed += 1
+        if self.binary:
+            self._frame.append((self.micros(), round(voltage * ADC_MAX / ADC_REFERENCE)))
+            if len(self._frame) == MAX_FRAME_SAMPLES:
+                self._send_frame()
+            return
+        self._write_line(f"S:{self.millis()},{arduino_float(voltage, 3)}")
+
+    def _send_frame(self):
+        if not self._frame:
+            return
+        counts = [sample[1] for sample in self._frame]
+        self._write(encode_stream_frame(self._frame_seq, self._frame[0][0], self._frame[-1][0], counts))
+        self._frame_seq = (self._frame_seq + 1) & 0xFF
+        self._frame = []
+
+    def _write_line(self, text):
+        data = (text + '\r\n').encode('ascii')
+        if self.garbage_rate and self.random.random() < self.garbage_rate:
+            data = bytes(self.random.randrange(256) for _ in range(self.random.randint(1, 16))) + data
+        if self.partial_rate and self.random.random() < self.partial_rate:
+            cut = self.random.randint(1, len(data) - 1)
+            self._write(data[:cut])
+            time.sleep(0.02)
+            self._write(data[cut:])
+        else:
+            self._write(data)
+        self.lines_sent += 1
+
+    def _write(self, data):
+        try:
+            written = os.write(self._master, data)
+        except (BlockingIOError, OSError):
+            # Nobody is reading the port and the pty buffer is full
+            written = 0
+        self.dropped_bytes += len(data) - written
+        if self.baudrate:
+            time.sleep(len(data) * 10 / self.baudrate)  # 8N1: 10 bits per byte
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a virtual IntelliSpec device on a pseudo-terminal.")
+    parser.add_argument('--blank', type=float, default=4.2, help="blank voltage V0 (default 4.2)")
+    parser.add_argument('--sample', type=float, default=1.8, help="sample voltage V (default 1.8)")
+    parser.add_argument('--dark', type=float, default=0.02, help="reported dark voltage (default 0.02)")
+    parser.add_argument('--noise', type=float, default=0.005, help="noise sigma in volts (default 0.005)")
+    parser.add_argument('--time-scale', type=float, default=1.0, help="multiplier for the firmware delays")
+    parser.add_argument('--baud', type=int, default=None, help="throttle output to this baud rate")
+    parser.add_argument('--garbage-rate', type=float, default=0.0, help="probability of garbage before a line")
+    parser.add_argument('--partial-rate', type=float, default=0.0, help="probability of a line split across writes")
+    parser.add_argument('--disconnect-after', type=float, default=None, help="close the port after N seconds")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--wavelengths', default=','.join(map(str, DEFAULT_WAVELENGTHS)),
+                        help="comma-separated LED wavelengths in nm for spectral scans")
+    parser.add_argument('--peak', type=float, default=525.0, help="absorption peak of the sample in nm")
+    args = parser.parse_args(argv)
+
+    device = VirtualSpectrophotometer(
+        blank_voltage=args.blank, sample_voltage=args.sample, dark_voltage=args.dark,
+        noise=args.noise, time_scale=args.time_scale, baudrate=args.baud,
+        garbage_rate=args.garbage_rate, partial_rate=args.partial_rate,
+        disconnect_after=args.disconnect_after, seed=args.seed,
+        wavelengths=[int(value) for value in args.wavelengths.split(',')], peak_wavelength=args.peak)
+    print(f"Virtual spectrophotometer listening on {device.start()}")
+    try:
+        while not device.disconnected:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""Spectral scans over several LED wavelengths.
+
+For each of its K channels a scan reports the LED's wavelength, the dark
+voltage with every LED off and the voltage with only that LED on.
+ScanCollector gathers the lines of one scan into arrays. SpectrumSet keeps
+all the scans of a session in contiguous (scans x channels) arrays that
+grow by doubling, together with the per-channel blank (V0) each scan was
+taken against and the dark read with that blank. Thousands of scans are a handful of NumPy arrays, not a
+Python object per point.
+
+Absorbance spectra of any number of scans come from one broadcast
+absorbance_batch. Peaks of all scans are found at once by fitting a parabola
+through each maximum and its neighbours. Channels are kept in order of
+wavelength, so the spacing of the LEDs may be uneven.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from .beer_lambert import RATIO_OFFSET, absorbance_batch, transmittance_batch
+from .protocol import ScanBlankPoint
+
+INITIAL_CAPACITY = 256   # scans
+FILE_VERSION = 2   # 1 had no blank darks
+
+# Arrays of K channels, in order of wavelength
+Scan = namedtuple('Scan', 'wavelengths dark voltage')
+
+
+class ScanCollector:
+    # Channel lines of the scan in progress; finish() on its ScanDone
+
+    def __init__(self):
+        self.points = []
+        self.blank = False
+
+    def __len__(self):
+        return len(self.points)
+
+    def add(self, point):
+        self.points.append(point)
+        self.blank = isinstance(point, ScanBlankPoint)
+
+    def clear(self):
+        self.points = []
+
+    def finish(self):
+        # The collected scan, or None if no channel was received
+        points, self.points = self.points, []
+        if not points:
+            return None
+        points.sort(key=lambda point: (point.wavelength, point.channel))
+        values = np.array([(point.wavelength, point.dark, point.voltage) for point in points])
+        return Scan(values[:, 0], values[:, 1], values[:, 2])
+
+
+class SpectrumSet:
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.initial_capacity = capacity
+        self.clear()
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.wavelengths = None
+        self.blank = None     # Scan of the current blank
+        self.count = 0
+        self._times = None
+        self._voltages = None
+        self._darks = None
+        self._blanks = None
+        self._blank_darks = None
+
+    def _allocate(self, capacity):
+        channels = len(self.wavelengths)
+        self._times = np.empty(capacity)
+        self._voltages = np.empty((capacity, channels))
+        self._darks = np.empty((capacity, channels))
+        self._blanks = np.empty((capacity, channels))
+        self._blank_darks = np.empty((capacity, channels))
+
+    def _grow(self):
+        old = self._columns()
+        self._allocate(2 * len(self._times))
+        for new, values in zip(self._columns(), old):
+            new[:self.count] = values[:self.count]
+
+    def _columns(self):
+        return self._times, self._voltages, self._darks, self._blanks, self._blank_darks
+
+    def _check_wavelengths(self, scan):
+        if self.wavelengths is None:
+            self.wavelengths = scan.wavelengths.copy()
+            self._allocate(self.initial_capacity)
+        elif not np.array_equal(scan.wavelengths, self.wavelengths):
+            raise ValueError("scan channels differ from the earlier scans of this set")
+
+    def set_blank(self, scan):
+        self._check_wavelengths(scan)
+        self.blank = scan
+
+    def add(self, timestamp, scan):
+        # Scans taken before a blank have NaN absorbances
+        self._check_wavelengths(scan)
+        if self.count == len(self._times):
+            self._grow()
+        row = self.count
+        self._times[row] = timestamp
+        self._voltages[row] = scan.voltage
+        self._darks[row] = scan.dark
+        self._blanks[row] = np.nan if self.blank is None else self.blank.voltage
+        self._blank_darks[row] = np.nan if self.blank is None else self.blank.dark
+        self.count += 1
+        return row
+
+    @property
+    def times(self):
+        return self._times[:self.count] if self.count else np.empty(0)
+
+    @property
+    def voltages(self):
+        return self._voltages[:self.count]
+
+    @property
+    def darks(self):
+        return self._darks[:self.count]
+
+    @property
+    def initial_voltages(self):
+        return self._blanks[:self.count]
+
+    @property
+    def initial_darks(self):
+        return self._blank_darks[:self.count]
+
+    def absorbances(self, rows=slice(None)):
+        # (scans x channels) absorbances of the selected scans in one operation.
+        # The blank is corrected by the dark read with it, the sample by its
+        # own. Spectra use the same formula, 0.5 offset included, as single
+        # readings, so a scan channel agrees with a READ at its wavelength.
+        voltages = self.voltages[rows]
+        blanks = self.initial_voltages[rows]
+        values = absorbance_batch(voltages, blanks, self.darks[rows], ratio_offset=RATIO_OFFSET,
+                                  initial_dark_voltage=self.initial_darks[rows])
+        return np.where(np.isnan(blanks), np.nan, values)
+
+    def transmittances(self, rows=slice(None)):
+        return transmittance_batch(self.absorbances(rows))
+
+    def to_arrays(self):
+        return {'version': FILE_VERSION, 'wavelengths': self.wavelengths, 'times': self.times,
+                'voltages': self.voltages, 'darks': self.darks, 'initial_voltages': self.initial_voltages,
+                'initial_darks': self.initial_darks}
+
+
+def find_peaks(absorbances, wavelengths):
+    # Peak wavelength and absorbance of every row, refined by a parabola
+    # through the largest channel and its neighbours; NaN for empty rows
+    absorbances = np.atleast_2d(np.asarray(absorbances, dtype=np.float64))
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    rows = np.arange(len(absorbances))
+    valid = np.isfinite(absorbances).any(axis=1)
+    index = np.argmax(np.where(np.isfinite(absorbances), absorbances, -np.inf), axis=1)
+    peak_wavelengths = wavelengths[index]
+    peak_values = absorbances[rows, index]
+    interior = valid & (index > 0) & (index < len(wavelengths) - 1)
+    if interior.any():
+        rows_in, k = rows[interior], index[interior]
+        x0, x1, x2 = wavelengths[k - 1], wavelengths[k], wavelengths[k + 1]
+        y0, y1, y2 = absorbances[rows_in, k - 1], absorbances[rows_in, k], absorbances[rows_in, k + 1]
+        # y = a x^2 + b x + c through the three points. Repeated wavelengths
+        # make the denominator zero; those keep the sampled maximum.
+        denominator = (x0 - x1) * (x0 - x2) * (x1 - x2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = (x2 * (y1 - y0) + x1 * (y0 - y2) + x0 * (y2 - y1)) / denominator
+            b = (x2 ** 2 * (y0 - y1) + x1 ** 2 * (y2 - y0) + x0 ** 2 * (y1 - y2)) / denominator
+            c = (x1 * x2 * (x1 - x2) * y0 + x2 * x0 * (x2 - x0) * y1 + x0 * x1 * (x0 - x1) * y2) / denominator
+            vertex = np.clip(-b / (2 * a), x0, x2)
+            top = c - b * b / (4 * a)
+        curved = ((denominator != 0) & np.isfinite(y0) & np.isfinite(y2) & (a < 0)
+                  & np.isfinite(vertex) & np.isfinite(top))
+        peak_wavelengths[rows_in] = np.where(curved, vertex, x1)
+        peak_values[rows_in] = np.where(curved, top, y1)
+    peak_wavelengths[~valid] = np.nan
+    peak_values[~valid] = np.nan
+    return peak_wavelengths, peak_values
+
+
+def absorbance_at(absorbances, wavelengths, wavelength):
+    # Absorbance of every row at one wavelength, linearly interpolated
+    # between channels; NaN outside the scanned range
+    absorbances = np.atleast_2d(np.asarray(absorbances, dtype=np.float64))
+    wavelengths = np.asarray(wavelengths, dtype=np.float64)
+    if not wavelengths[0] <= wavelength <= wavelengths[-1]:
+        return np.full(len(absorbances), np.nan)
+    high = min(int(np.searchsorted(wavelengths, wavelength)), len(wavelengths) - 1)
+    low = max(high - 1, 0)
+    if wavelengths[high] == wavelengths[low]:
+        return absorbances[:, high].copy()
+    fraction = (wavelength - wavelengths[low]) / (wavelengths[high] - wavelengths[low])
+    return absorbances[:, low] * (1 - fraction) + absorbances[:, high] * fraction
+
+
+def save_spectra(spectra, path):
+    np.savez_compressed(path, **spectra.to_arrays())
+
+
+def load_spectra(path):
+    with np.load(path) as data:
+        version = int(data['version'])
+        if version not in (1, FILE_VERSION):
+            raise ValueError(f"{path} uses an unsupported spectra format")
+        spectra = SpectrumSet(capacity=max(1, len(data['times'])))
+        spectra.wavelengths = data['wavelengths']
+        spectra._allocate(spectra.initial_capacity)
+        spectra.count = len(data['times'])
+        spectra._times[:spectra.count] = data['times']
+        spectra._voltages[:spectra.count] = data['voltages']
+        spectra._darks[:spectra.count] = data['darks']
+        spectra._blanks[:spectra.count] = data['initial_voltages']
+        # Version 1 files were computed with the scan's dark for both
+        spectra._blank_darks[:spectra.count] = data['initial_darks'] if version > 1 else data['darks']
+    return spectra
+
+
+def export_spectra_csv(spectra, path):
+    # One row per scan: time, then the absorbance at every wavelength
+    header = ['timestamp'] + [f"A_{wavelength:g}nm" for wavelength in spectra.wavelengths]
+    values = np.column_stack([spectra.times, spectra.absorbances()])
+    np.savetxt(path, values, fmt=['%.6f'] + ['%.4f'] * len(spectra.wavelengths), delimiter=',',
+               header=','.join(header), comments='')
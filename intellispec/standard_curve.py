@@ -0,0 +1,215 @@
+"""Standard curves: concentration from absorbance.
+
+Standards of known concentration are measured like any other sample and
+fitted as A = b0 + b1*c (+ b2*c^2 ...) by weighted least squares. The curve
+keeps only the normal equations (X'WX, X'Wy and the sums R^2 needs), so
+adding or removing a standard is a small rank-one update and the fit is a
+(degree + 1)-square solve, whatever the number of standards.
+
+`concentration()` inverts the curve for a whole array of absorbances at
+once: directly for a straight line, by interpolating a dense table of the
+curve and polishing with a Newton step for polynomials. Polynomial curves
+are only inverted within the range of the standards and give NaN outside
+it; a straight line extrapolates.
+"""
+
+import json
+from collections import namedtuple
+
+import numpy as np
+from numpy.polynomial import polynomial
+
+MAX_DEGREE = 3
+INVERSION_TABLE_SIZE = 4097   # curve points tabulated for inverting polynomials
+NEWTON_STEPS = 2
+RANGE_TOLERANCE = 1e-6        # of the standards' absorbance span, at either end
+# Smallest absorbance uncertainty used for weighting, about a tenth of an ADC
+# step; a standard whose raw readings were all equal still gets a finite weight
+MIN_UNCERTAINTY = 1e-4
+FILE_VERSION = 1
+
+Standard = namedtuple('Standard', 'concentration absorbance weight')
+
+
+class StandardCurve:
+
+    def __init__(self, degree=1, through_origin=False):
+        if not 1 <= degree <= MAX_DEGREE:
+            raise ValueError(f"degree must be between 1 and {MAX_DEGREE}")
+        self.degree = degree
+        # Beer-Lambert proper: A = epsilon * l * c, no intercept
+        self.through_origin = through_origin
+        self.standards = []
+        self._powers = np.arange(1 if through_origin else 0, degree + 1)
+        self.clear()
+
+    def __len__(self):
+        return len(self.standards)
+
+    def clear(self):
+        size = len(self._powers)
+        self.standards = []
+        self._xtwx = np.zeros((size, size))
+        self._xtwy = np.zeros(size)
+        self._sw = 0.0      # sum of weights
+        self._swy = 0.0     # sum of w * A
+        self._swyy = 0.0    # sum of w * A^2
+        self._solution = None
+        self._table = None
+
+    def add(self, concentration, absorbance, weight=1.0):
+        standard = Standard(float(concentration), float(absorbance), float(weight))
+        self.standards.append(standard)
+        self._update(standard, 1.0)
+        return standard
+
+    def remove(self, index):
+        standard = self.standards.pop(index)
+        if self.standards:
+            self._update(standard, -1.0)
+        else:
+            self.clear()   # start again from exact zeros
+        return standard
+
+    def _update(self, standard, sign):
+        x = standard.concentration ** self._powers
+        w = sign * standard.weight
+        y = standard.absorbance
+        self._xtwx += w * np.outer(x, x)
+        self._xtwy += w * y * x
+        self._sw += w
+        self._swy += w * y
+        self._swyy += w * y * y
+        self._solution = None
+        self._table = None
+
+    @property
+    def ready(self):
+        # The standards determine every coefficient
+        return self._solve() is not None
+
+    def _determined(self):
+        # Enough distinct concentrations for the model. A blank (c = 0) says
+        # nothing about a curve through the origin, and a standard of zero
+        # weight says nothing at all.
+        concentrations = {standard.concentration for standard in self.standards if standard.weight > 0}
+        if self.through_origin:
+            concentrations.discard(0.0)
+        return len(concentrations) >= len(self._powers)
+
+    def _solve(self):
+        if self._solution is None and self._determined():
+            try:
+                self._solution = np.linalg.solve(self._xtwx, self._xtwy)
+            except np.linalg.LinAlgError:
+                # Numerically singular, e.g. concentrations spanning many decades
+                return None
+        return self._solution
+
+    @property
+    def coefficients(self):
+        # b0, b1, ... lowest power first; None until the curve is ready
+        solution = self._solve()
+        if solution is None:
+            return None
+        coefficients = np.zeros(self.degree + 1)
+        coefficients[self._powers] = solution
+        return coefficients
+
+    @property
+    def r_squared(self):
+        solution = self._solve()
+        if solution is None or self._sw <= 0:
+            return float('nan')
+        residual = self._swyy - 2 * solution @ self._xtwy + solution @ self._xtwx @ solution
+        total = self._swyy - self._swy ** 2 / self._sw
+        return 1.0 - residual / total if total > 0 else float('nan')
+
+    def equation(self, digits=4):
+        coefficients = self.coefficients
+        if coefficients is None:
+            return ''
+        terms = []
+        for power in range(self.degree, -1, -1):
+            if power not in self._powers:
+                continue
+            value = coefficients[power]
+            term = f"{abs(value):.{digits}g}" + ('' if power == 0 else ' c' if power == 1 else f' c^{power}')
+            if not terms:
+                terms.append(('-' if value < 0 else '') + term)
+            else:
+                terms.append(('- ' if value < 0 else '+ ') + term)
+        return 'A = ' + ' '.join(terms)
+
+    def absorbance(self, concentrations):
+        return polynomial.polyval(np.asarray(concentrations, dtype=np.float64), self.coefficients)
+
+    def concentration(self, absorbances):
+        # Concentrations for an array of absorbances (NaN where there is none)
+        coefficients = self.coefficients
+        if coefficients is None:
+            raise ValueError("the standard curve needs more standards")
+        absorbances = np.asarray(absorbances, dtype=np.float64)
+        if self.degree == 1:
+            if coefficients[1] == 0:
+                raise ValueError("the standard curve is flat")
+            return (absorbances - coefficients[0]) / coefficients[1]
+        grid, values = self._inversion_table()
+        # Allow for absorbances stored as float32 (store.RECORD_DTYPE)
+        margin = RANGE_TOLERANCE * (values[-1] - values[0])
+        inside = (absorbances >= values[0] - margin) & (absorbances <= values[-1] + margin)
+        concentrations = np.interp(absorbances, values, grid)
+        slope = polynomial.polyder(coefficients)
+        for _ in range(NEWTON_STEPS):
+            concentrations -= (polynomial.polyval(concentrations, coefficients) - absorbances) / \
+                polynomial.polyval(concentrations, slope)
+        concentrations[~inside] = np.nan
+        return concentrations
+
+    def _inversion_table(self):
+        # The curve tabulated over the standards, ascending in absorbance
+        if self._table is None:
+            low = min(standard.concentration for standard in self.standards)
+            high = max(standard.concentration for standard in self.standards)
+            grid = np.linspace(low, high, INVERSION_TABLE_SIZE)
+            values = polynomial.polyval(grid, self.coefficients)
+            steps = np.diff(values)
+            if np.all(steps < 0):
+                grid, values = grid[::-1], values[::-1]
+            elif not np.all(steps > 0):
+                raise ValueError("the standard curve is not monotonic between the standards")
+            self._table = grid, values
+        return self._table
+
+    def to_dict(self):
+        return {'version': FILE_VERSION, 'degree': self.degree, 'through_origin': self.through_origin,
+                'standards': [standard._asdict() for standard in self.standards]}
+
+    @classmethod
+    def from_dict(cls, data, degree=None, through_origin=None):
+        # degree/through_origin override the saved model, e.g. to refit the
+        # same standards with another one
+        if data.get('version') != FILE_VERSION:
+            raise ValueError("unsupported standard curve file")
+        curve = cls(data['degree'] if degree is None else degree,
+                    data['through_origin'] if through_origin is None else through_origin)
+        for standard in data['standards']:
+            curve.add(standard['concentration'], standard['absorbance'], standard['weight'])
+        return curve
+
+
+def save_curve(curve, path, **extra):
+    # extra: additional JSON fields kept alongside the curve, e.g. units
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({**curve.to_dict(), **extra}, f, indent=1)
+
+
+def load_curve(path):
+    with open(path, encoding='utf-8') as f:
+        return StandardCurve.from_dict(json.load(f))
+
+
+def quantify_history(records, curve):
+    # Concentrations for every record of a session (store.open_history),
+    # NaN where a record has no absorbance
+    return curve.concentration(records['absorbance'])
@@ -0,0 +1,109 @@
+"""Streaming statistics for oversampled readings.
+
+`Welford` keeps a running mean and variance in constant memory and merges
+whole NumPy blocks at once (Chan et al.'s parallel update). It can show a
+live estimate while raw samples are still arriving.
+
+`Oversample` collects the K raw samples of one measurement into a
+preallocated array. When the burst ends it rejects outliers by median/MAD
+and reduces the remaining samples to a mean with its standard error.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from .framing import ADC_MAX, ADC_REFERENCE
+
+DEFAULT_OUTLIER_THRESHOLD = 3.5   # modified z-score (Iglewicz & Hoaglin)
+MAD_TO_SIGMA = 1.4826             # MAD of a normal distribution -> standard deviation
+
+# mean, std and sem are in the units of the samples; sem is the standard
+# error of the mean; count is the samples kept after rejection
+OversampleResult = namedtuple('OversampleResult', 'mean std sem count rejected median mad')
+
+
+def counts_to_voltage(counts):
+    return np.asarray(counts, dtype=np.float64) * (ADC_REFERENCE / ADC_MAX)
+
+
+class Welford:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def add_array(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if not n:
+            return
+        block_mean = float(values.mean())
+        block_m2 = float(((values - block_mean) ** 2).sum())
+        total = self.count + n
+        delta = block_mean - self.mean
+        self.mean += delta * n / total
+        self._m2 += block_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    @property
+    def variance(self):
+        # Sample variance; NaN until there are two samples
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count > 1 else math.nan
+
+    @property
+    def sem(self):
+        return self.std / math.sqrt(self.count) if self.count > 1 else math.nan
+
+
+class Oversample:
+
+    def __init__(self, expected, threshold=DEFAULT_OUTLIER_THRESHOLD):
+        self.threshold = threshold
+        self.running = Welford()   # every sample so far, for a live readout
+        self._values = np.empty(max(1, expected))
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add_array(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if self._count + len(values) > len(self._values):
+            # More samples than announced; grow rather than lose them
+            grown = np.empty(max(2 * len(self._values), self._count + len(values)))
+            grown[:self._count] = self._values[:self._count]
+            self._values = grown
+        self._values[self._count:self._count + len(values)] = values
+        self._count += len(values)
+        self.running.add_array(values)
+
+    def result(self):
+        values = self._values[:self._count]
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return OversampleResult(math.nan, math.nan, math.nan, 0, self._count, math.nan, math.nan)
+        median = float(np.median(values))
+        mad = float(np.median(np.abs(values - median)))
+        # With quantised ADC counts most samples can share one value and
+        # the MAD is 0; then nothing can be called an outlier
+        if mad > 0:
+            kept = values[np.abs(values - median) <= self.threshold * MAD_TO_SIGMA * mad]
+        else:
+            kept = values
+        stats = Welford()
+        stats.add_array(kept)
+        return OversampleResult(stats.mean, stats.std, stats.sem, stats.count,
+                                self._count - stats.count, median, mad)
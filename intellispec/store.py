@@ -0,0 +1,177 @@
+"""Append-only binary measurement store.
+
+A session file is a 64-byte header followed by fixed-width records
+(RECORD_DTYPE). Records are only ever appended, and the file is fsynced at
+most every `fsync_interval` seconds, so a crash loses at most that much
+data. History is read back through a NumPy memmap: opening and slicing a
+session with millions of samples doesn't load it into RAM.
+"""
+
+import os
+import struct
+import time
+
+import numpy as np
+
+from .paths import default_data_dir
+
+MAGIC = b'ISPECREC'
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+HEADER = struct.Struct('<8sII')  # magic, version, record size
+FILE_SUFFIX = '.isrec'
+
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),        # Unix time, seconds
+    ('voltage', '<f4'),          # V
+    ('initial_voltage', '<f4'),  # V0, NaN before calibration
+    ('dark_voltage', '<f4'),     # Vd
+    ('absorbance', '<f4'),
+    ('transmittance', '<f4'),
+    ('sample_id', '<i4'),        # run entry (1-based), 0 for manual/stream readings
+])
+
+NO_SAMPLE_ID = 0
+DEFAULT_FSYNC_INTERVAL = 1.0
+EXPORT_CHUNK = 1 << 20
+
+
+def new_session_path(directory=None, tag=None):
+    # tag tells apart the files of devices recorded at the same time
+    directory = directory or default_data_dir()
+    name = time.strftime('session-%Y%m%d-%H%M%S')
+    if tag:
+        name += '-' + ''.join(c if c.isalnum() or c in '-_' else '_' for c in tag)
+    return os.path.join(directory, name + FILE_SUFFIX)
+
+
+def _header_bytes():
+    return HEADER.pack(MAGIC, FORMAT_VERSION, RECORD_DTYPE.itemsize).ljust(HEADER_SIZE, b'\0')
+
+
+def _check_header(data, path):
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is not an IntelliSpec measurement file")
+    magic, version, record_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an IntelliSpec measurement file")
+    if version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+        raise ValueError(f"{path} uses unsupported format version {version}")
+
+
+class MeasurementStore:
+
+    def __init__(self, path, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            with open(path, 'rb') as f:
+                _check_header(f.read(HEADER_SIZE), path)
+            self._drop_partial_record()
+            self._file = open(path, 'ab')
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(_header_bytes())
+        self._last_sync = time.monotonic()
+        self._dirty = False
+
+    def _drop_partial_record(self):
+        # A crash mid-write can leave a torn record at the end of the file
+        extra = (os.path.getsize(self.path) - HEADER_SIZE) % RECORD_DTYPE.itemsize
+        if extra:
+            os.truncate(self.path, os.path.getsize(self.path) - extra)
+
+    def append(self, timestamps, voltages, initial_voltage, dark_voltage,
+               absorbances, transmittances, sample_id=NO_SAMPLE_ID):
+        # Every argument is a scalar or an array broadcastable to voltages
+        voltages = np.atleast_1d(voltages)
+        block = np.empty(len(voltages), dtype=RECORD_DTYPE)
+        block['timestamp'] = timestamps
+        block['voltage'] = voltages
+        block['initial_voltage'] = np.nan if initial_voltage is None else initial_voltage
+        block['dark_voltage'] = dark_voltage
+        block['absorbance'] = absorbances
+        block['transmittance'] = transmittances
+        block['sample_id'] = sample_id
+        self.write_records(block)
+
+    def write_records(self, records):
+        self._file.write(memoryview(np.ascontiguousarray(records, dtype=RECORD_DTYPE)).cast('B'))
+        self._dirty = True
+        self.sync_if_due()
+
+    def sync_if_due(self):
+        # Called after every write and periodically by the owner, so the last
+        # records of a burst don't wait for the next append to reach disk
+        if self._dirty and time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+        self._dirty = False
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+def open_history(path):
+    # Read-only memmap over all complete records in a session file
+    with open(path, 'rb') as f:
+        _check_header(f.read(HEADER_SIZE), path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def allocate_session(path, count):
+    # A session file of `count` zeroed records, for writers that fill in
+    # ranges of it through their own memmap (see reprocess.py)
+    with open(path, 'wb') as f:
+        f.write(_header_bytes())
+        f.truncate(HEADER_SIZE + count * RECORD_DTYPE.itemsize)
+
+
+def open_records(path, start, stop, mode='r'):
+    # Memmap of records [start, stop) only; mode 'r+' to write them in place
+    return np.memmap(path, dtype=RECORD_DTYPE, mode=mode,
+                     offset=HEADER_SIZE + start * RECORD_DTYPE.itemsize, shape=(stop - start,))
+
+
+def export_csv(records, out_path, chunk_size=EXPORT_CHUNK, extra_columns=()):
+    # extra_columns: (name, array, format) triples appended to every record,
+    # e.g. concentrations computed from the absorbances
+    names = RECORD_DTYPE.names
+    formats = ['%.6f', '%.4f', '%.4f', '%.4f', '%.4f', '%.2f', '%d'] + [fmt for _, _, fmt in extra_columns]
+    with open(out_path, 'w', newline='') as f:
+        f.write(','.join(list(names) + [name for name, _, _ in extra_columns]) + '\n')
+        for start in range(0, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            columns = [chunk[name].astype(np.float64) for name in names]
+            columns += [np.asarray(values[start:start + chunk_size], dtype=np.float64)
+                        for _, values, _ in extra_columns]
+            np.savetxt(f, np.column_stack(columns), fmt=formats, delimiter=',')
+
+
+def export_parquet(records, out_path, chunk_size=EXPORT_CHUNK, extra_columns=()):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires the 'pyarrow' package") from None
+    schema = pa.schema([(name, pa.from_numpy_dtype(RECORD_DTYPE[name])) for name in RECORD_DTYPE.names] +
+                       [(name, pa.float64()) for name, _, _ in extra_columns])
+    with pq.ParquetWriter(out_path, schema) as writer:
+        for start in range(0, max(len(records), 1), chunk_size):
+            chunk = records[start:start + chunk_size]
+            columns = {name: np.asarray(chunk[name]) for name in RECORD_DTYPE.names}
+            for name, values, _ in extra_columns:
+                columns[name] = np.asarray(values[start:start + chunk_size], dtype=np.float64)
+            writer.write_table(pa.table(columns, schema=schema))
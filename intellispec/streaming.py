@@ -0,0 +1,166 @@
+"""Storage and display decimation for continuous (stream mode) acquisition.
+
+Recent samples are kept in a fixed-size `SampleRing`, and the plot draws
+them through `minmax_decimate`. The labels in the UI are refreshed from a
+`DisplayDecimator` on a display timer. Both update at screen rate, no matter
+how fast samples arrive or how many have been taken.
+"""
+
+import numpy as np
+
+from .framing import CRC, HEADER, MAX_FRAME_SAMPLES, MAX_PAYLOAD
+
+DEFAULT_STREAM_RATE = 40        # Hz requested from the device, fits the default 9600 baud link
+MAX_STREAM_RATE = 1000          # Hz, the sketch clamps to the same value
+MAX_BINARY_STREAM_RATE = 4000   # Hz with binary stream frames, same clamp as the sketch
+SERIAL_BITS_PER_BYTE = 10       # 8N1: start bit, 8 data bits, stop bit
+ASCII_SAMPLE_BYTES = 18         # "S:<millis>,<voltage>\r\n" with an 8-digit millis()
+# A full binary frame (sync, header, payload, CRC) per MAX_FRAME_SAMPLES samples
+BINARY_SAMPLE_BYTES = (HEADER.size + MAX_PAYLOAD + CRC.size) / MAX_FRAME_SAMPLES
+LINK_HEADROOM = 0.8             # share of the link a stream may fill; replies and jitter need the rest
+DISPLAY_REFRESH_HZ = 30
+DEFAULT_RING_CAPACITY = 1 << 19  # samples kept in memory, 16 MB (~9 min at 1 kHz)
+
+DISPLAY_LATEST = 'latest'
+DISPLAY_MEAN = 'mean'
+
+
+def max_stream_rate(baudrate, binary=False):
+    # Highest rate whose samples the link carries with some headroom. Above
+    # it the sketch blocks in Serial.write and its sample timing slips.
+    sample_bytes = BINARY_SAMPLE_BYTES if binary else ASCII_SAMPLE_BYTES
+    rate = int(baudrate / SERIAL_BITS_PER_BYTE * LINK_HEADROOM / sample_bytes)
+    return max(1, min(MAX_BINARY_STREAM_RATE if binary else MAX_STREAM_RATE, rate))
+
+
+class SampleRing:
+    # Fixed-capacity ring of (time, voltage, absorbance, transmittance) rows
+    # in one preallocated array. Once full, each append overwrites the
+    # oldest rows, so memory stays the same however long a stream runs;
+    # older samples are still in the session file. Rows are kept in time
+    # order: a time before the newest row (the device clock of a stream
+    # drifting against the host's, or the host clock stepping back) is
+    # moved up to it.
+
+    COLUMNS = ('time', 'voltage', 'absorbance', 'transmittance')
+
+    def __init__(self, capacity=DEFAULT_RING_CAPACITY):
+        self.capacity = capacity
+        self._data = np.empty((capacity, len(self.COLUMNS)))
+        self._start = 0   # row index of the oldest sample
+        self._count = 0
+        self.total = 0    # samples appended since the last clear, including overwritten ones
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+        self.total = 0
+
+    def append(self, times, voltages, absorbances, transmittances):
+        times = np.asarray(times, dtype=np.float64)
+        if self._count:
+            times = np.maximum(times, self.newest_time)
+        times = np.maximum.accumulate(times)
+        block = np.column_stack((times, voltages, absorbances, transmittances))
+        self.total += len(block)
+        if len(block) >= self.capacity:
+            self._data[:] = block[-self.capacity:]
+            self._start = 0
+            self._count = self.capacity
+            return
+        end = (self._start + self._count) % self.capacity
+        first = min(len(block), self.capacity - end)
+        self._data[end:end + first] = block[:first]
+        self._data[:len(block) - first] = block[first:]
+        overflow = self._count + len(block) - self.capacity
+        if overflow > 0:
+            self._start = (self._start + overflow) % self.capacity
+        self._count = min(self.capacity, self._count + len(block))
+
+    def _segments(self):
+        # The stored rows in time order, as at most two views
+        end = self._start + self._count
+        if end <= self.capacity:
+            return [self._data[self._start:end]]
+        return [self._data[self._start:], self._data[:end - self.capacity]]
+
+    @property
+    def oldest_time(self):
+        return self._data[self._start, 0] if self._count else None
+
+    @property
+    def newest_time(self):
+        return self._data[(self._start + self._count - 1) % self.capacity, 0] if self._count else None
+
+    def window(self, start_time, end_time, column='absorbance'):
+        # (times, values) for start_time <= t <= end_time, copied out
+        index = self.COLUMNS.index(column)
+        parts = []
+        for segment in self._segments():
+            times = segment[:, 0]
+            lo = np.searchsorted(times, start_time, 'left')
+            hi = np.searchsorted(times, end_time, 'right')
+            if hi > lo:
+                parts.append(segment[lo:hi][:, [0, index]])
+        if not parts:
+            return np.empty(0), np.empty(0)
+        rows = np.concatenate(parts)
+        return rows[:, 0], rows[:, 1]
+
+    def to_array(self):
+        return np.concatenate(self._segments()) if self._count else np.empty((0, len(self.COLUMNS)))
+
+
+def minmax_decimate(times, values, start_time, end_time, bins):
+    # Reduces a series to at most 2 points per bin: each of `bins` equal
+    # time slices of [start_time, end_time] becomes its minimum and maximum,
+    # placed at the slice centre. With one bin per pixel column the drawn
+    # envelope matches the full data and the cost of drawing it depends
+    # only on the width. NaNs are ignored unless a slice is all NaN.
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(times) <= 2 * bins or end_time <= start_time:
+        return times, values
+    edges = np.searchsorted(times, np.linspace(start_time, end_time, bins + 1)[:-1], 'left')
+    occupied = np.flatnonzero(np.diff(np.append(edges, len(times))) > 0)
+    starts = edges[occupied]
+    with np.errstate(invalid='ignore'):
+        lows = np.fmin.reduceat(values, starts)
+        highs = np.fmax.reduceat(values, starts)
+    centres = start_time + (occupied + 0.5) * (end_time - start_time) / bins
+    return np.repeat(centres, 2), np.column_stack((lows, highs)).ravel()
+
+
+class DisplayDecimator:
+    # Collects values between display refreshes. `take()` returns either the
+    # most recent value or the mean over everything since the previous take,
+    # or None when nothing new arrived.
+
+    def __init__(self, mode=DISPLAY_LATEST):
+        self.mode = mode
+        self._latest = None
+        self._sum = None
+        self._count = 0
+
+    def add(self, *columns):
+        columns = [np.asarray(column, dtype=np.float64) for column in columns]
+        if not len(columns[0]):
+            return
+        self._latest = tuple(column[-1] for column in columns)
+        sums = tuple(np.nansum(column) for column in columns)
+        self._sum = sums if self._sum is None else tuple(a + b for a, b in zip(self._sum, sums))
+        self._count += len(columns[0])
+
+    def take(self):
+        if not self._count:
+            return None
+        if self.mode == DISPLAY_MEAN:
+            values = tuple(total / self._count for total in self._sum)
+        else:
+            values = self._latest
+        self._sum = None
+        self._count = 0
+        return values
@@ -1,46 +1,126 @@
 #Packages and Imports
 
 import sys
+import argparse
 import serial
-import serial.tools.list_ports
-import time
-import google.generativeai as genai
 from PySide6.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, 
                             QHBoxLayout, QWidget, QLabel, QComboBox, QFrame,
-                            QTextEdit, QLineEdit, QSplitter, QMessageBox)
-from PySide6.QtCore import Qt, QTimer, Signal, QThread
-from PySide6.QtGui import QPalette, QColor, QFont
-import qdarktheme
-import markdown
-from dotenv import load_dotenv
+                            QTextEdit, QLineEdit, QSplitter, QMessageBox, QSpinBox,
+                            QTableWidget, QTableWidgetItem, QHeaderView, QFileDialog,
+                            QTabWidget, QDoubleSpinBox, QCheckBox)
+from PySide6.QtCore import Qt, QTimer, Signal, QThread, QObject, Slot, QPointF
+from PySide6.QtGui import QPalette, QColor, QFont, QTextCursor, QPainter, QPen, QPolygonF
 import os
+import time
 import math
+import threading
+import json
+from collections import deque
+import numpy as np
+from intellispec.acquisition import (CALIBRATE, DEFAULT_BAUDRATE, IDLE, MAX_OVERSAMPLE, MEASURING,
+                                     RUNNING, STREAMING, AcquisitionStateMachine)
+from intellispec.beer_lambert import DEFAULT_DARK_VOLTAGE, absorbance_batch
+from intellispec.calibration import DRIFTED, EXPIRED, CalibrationStore, device_key
+from intellispec.chat_cache import ResponseCache
+from intellispec.chat_context import ContextBuilder, SessionSummary
+from intellispec.chat_history import ChatHistory
+from intellispec.chat_stub import STUB_MODEL_NAME, StubModel
+from intellispec.devices import DeviceManager
+from intellispec.engine import READY_BANNER, READY_TIMEOUT, compute_samples
+from intellispec.framing import FrameDecoder
+from intellispec.metrics import REQUEST_BUCKETS, RateMeter, Timer, registry as metrics_registry
+from intellispec.ports import Backoff, PortWatcher
+from intellispec.profiler import SamplingProfiler
+from intellispec.protocol import (BaudRate, BinaryMode, BlankVoltage, DarkVoltage, InvalidLine,
+                                  Message, RawDone, RawSample, SampleVoltage, ScanBlankPoint, ScanDone,
+                                  ScanPoint, StreamBlock, StreamSample, parse_lines)
+from intellispec.scheduler import RunScheduler, build_run
+from intellispec.spectra import (ScanCollector, SpectrumSet, absorbance_at, export_spectra_csv,
+                                 find_peaks, save_spectra)
+from intellispec.serial_reader import BatchReader, DEFAULT_MAX_LATENCY
+from intellispec.standard_curve import MIN_UNCERTAINTY, StandardCurve, quantify_history, save_curve
+from intellispec.stats import Oversample, counts_to_voltage
+from intellispec.store import (MeasurementStore, export_csv, export_parquet, new_session_path,
+                               open_history)
+from intellispec.streaming import (DEFAULT_STREAM_RATE, DISPLAY_LATEST, DISPLAY_MEAN,
+                                   DISPLAY_REFRESH_HZ, DisplayDecimator,
+                                   SampleRing, max_stream_rate, minmax_decimate)
+
+# The chat SDK, markdown, theme and .env loading are imported where they are
+# first used, so importing this module (or the intellispec engine) stays fast.
+
+CHAT_MODEL = 'gemini-pro'
+STREAM_RENDER_INTERVAL = 50  # ms between re-renders of a streaming reply
+CHAT_CONTEXT_TURNS = 6       # earlier chat messages sent along with a question
+DEVICE_REFRESH_HZ = 20       # device panel table refreshes per second
+DEFAULT_PLOT_SPAN = 30.0     # seconds shown by the kinetics plot
+MIN_PLOT_SPAN = 1.0
+MAX_PLOT_SPAN = 7 * 24 * 3600.0
+PLOT_ZOOM_STEP = 1.25
+HISTORY_POINTS_PER_PIXEL = 64  # records read from disk per plot column
+DEFAULT_SPECTRA_OVERLAY = 10   # latest scans drawn on the spectrum plot
+MAX_SPECTRA_OVERLAY = 200
+# Every received line used to be printed; now it's opt-in for debugging
+TRACE_LINES = os.getenv('INTELLISPEC_TRACE_LINES') == '1'
 
-# Load environment variables
-load_dotenv()
+STREAM_SAMPLES = metrics_registry.counter('intellispec_stream_samples_total', "Streamed samples recorded")
+GUI_BATCH_TIME = metrics_registry.histogram('intellispec_gui_batch_seconds',
+                                            "GUI thread time spent handling one serial batch")
+CHAT_FIRST_CHUNK = metrics_registry.histogram('intellispec_chat_first_chunk_seconds',
+                                              "Chat request to the first streamed chunk", REQUEST_BUCKETS)
+CHAT_REQUEST_TIME = metrics_registry.histogram('intellispec_chat_request_seconds',
+                                               "Chat request to the complete reply", REQUEST_BUCKETS)
+CHAT_CACHE_HITS = metrics_registry.counter('intellispec_chat_cache_hits_total',
+                                           "Chat requests answered from the response cache")
+# Link settings offered by the main window: (label, (baud rate, binary stream frames))
+LINK_MODES = (
+    ('ASCII, 9600 baud', (DEFAULT_BAUDRATE, False)),
+    ('Binary, 115200 baud', (115200, True)),
+    ('Binary, 500000 baud', (500000, True)),
+)
 
 class SerialThread(QThread):
     data_received = Signal(str)
+    lines_received = Signal(list)
     error_occurred = Signal(str)
+    opened = Signal()
     
-    def __init__(self, port, baudrate=9600):
+    def __init__(self, port, baudrate=DEFAULT_BAUDRATE, batched=True, serial_factory=None):
         super().__init__()
         self.port = port
         self.baudrate = baudrate
+        self.batched = batched
+        # Anything with pyserial's Serial(port, baudrate, timeout=...) signature
+        self.serial_factory = serial_factory or serial.Serial
         self.running = True
         self.serial = None
+        self.reader = None
 
     def run(self):
         try:
-            self.serial = serial.Serial(self.port, self.baudrate, timeout=0.1)
-            while self.running:
-                if self.serial.in_waiting:
-                    line = self.serial.readline().decode('utf-8').strip()
-                    if line:
-                        self.data_received.emit(line)
-                time.sleep(0.01)  # Prevent CPU hogging
+            # Reads block for at most one batch latency, so stop() is noticed promptly
+            self.serial = self.serial_factory(self.port, self.baudrate, timeout=DEFAULT_MAX_LATENCY)
+            self.opened.emit()
+            if self.batched:
+                self.reader = BatchReader(self.serial, self.lines_received.emit)
+            else:
+                self.reader = BatchReader(self.serial, self.emit_lines, max_batch=1, max_latency=0)
+            self.reader.run(lambda: self.running)
         except Exception as e:
             self.error_occurred.emit(str(e))
+        finally:
+            if self.serial:
+                self.serial.close()
+
+    def emit_lines(self, lines):
+        # Line-at-a-time mode for consumers that still expect data_received
+        for line in lines:
+            self.data_received.emit(line)
+        self.reader.ack()
+
+    def batch_consumed(self):
+        if self.reader:
+            self.reader.ack()
 
     def write(self, data):
         if self.serial and self.serial.is_open:
@@ -49,18 +129,173 @@ class SerialThread(QThread):
             except Exception as e:
                 self.error_occurred.emit(str(e))
 
+    def set_baudrate(self, rate):
+        # Called once the device has confirmed the new speed
+        self.baudrate = rate
+        if self.serial and self.serial.is_open:
+            try:
+                self.serial.baudrate = rate
+            except Exception as e:
+                self.error_occurred.emit(str(e))
+
+    def set_binary(self, enabled):
+        # The reader picks the decoder up with its next read
+        if self.reader:
+            self.reader.decoder = FrameDecoder() if enabled else None
+
     def stop(self):
+        # The reader loop closes the port itself once it sees the flag
         self.running = False
-        if self.serial:
-            self.serial.close()
+
+class RunWorker(QObject):
+    # Runs a RunScheduler on its own thread. Serial batches are delivered here
+    # directly from the SerialThread, so matching replies to queue entries and
+    # sending the next read never waits on the GUI thread.
+    result_ready = Signal(object)
+    finished = Signal()
+    cancel_requested = Signal()
+
+    def __init__(self, entries, serial_thread):
+        super().__init__()
+        self.serial_thread = serial_thread
+        self.scheduler = RunScheduler(entries, serial_thread.write)
+        self.timer = None
+        self.done = False
+        self.cancel_requested.connect(self.cancel)
+
+    @Slot()
+    def start(self):
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.check_timeout)
+        self.timer.start(250)
+        self.scheduler.start()
+        self.check_done()
+
+    @Slot(list)
+    def handle_lines(self, lines):
+        if self.done:
+            # The scheduler's late replies belong to the acquisition machine now
+            return
+        for record in parse_lines(lines):
+            result = self.scheduler.handle_record(record)
+            if result is not None:
+                if math.isnan(result.voltage):
+                    print(f"Warning: Reply for {result.label} #{result.replicate} was lost")
+                self.result_ready.emit(result)
+        self.check_done()
+
+    @Slot()
+    def check_timeout(self):
+        result = self.scheduler.check_timeout()
+        if result is not None:
+            print(f"Warning: No reply for {result.label} #{result.replicate}")
+            self.result_ready.emit(result)
+        self.check_done()
+
+    @Slot()
+    def cancel(self):
+        self.scheduler.cancel()
+        self.check_done()
+
+    def check_done(self):
+        if self.scheduler.done and self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+            self.done = True
+            self.finished.emit()
+
+class ChatWorker(QObject):
+    # Runs each chat request on its own daemon thread and streams the reply
+    # back in chunks. Identical prompts are answered from the on-disk cache.
+    # A request blocked on the network can't be interrupted, so nothing waits
+    # for one: a cancelled request is dropped at its next chunk without
+    # holding up the next question, and one still running at exit is left
+    # behind with the process.
+    chunk_received = Signal(int, str)
+    finished = Signal(int, str, bool)   # request id, full text, from cache
+    failed = Signal(int, str)
+
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+        # Requests up to this id are cancelled; set from the GUI thread and
+        # checked between chunks
+        self.cancelled_through = 0
+
+    def submit(self, request_id, model, model_name, prompt):
+        threading.Thread(target=self.generate, args=(request_id, model, model_name, prompt),
+                         name=f'chat-{request_id}', daemon=True).start()
+
+    def cancel_through(self, request_id):
+        self.cancelled_through = max(self.cancelled_through, request_id)
+
+    def generate(self, request_id, model, model_name, prompt):
+        if request_id <= self.cancelled_through:
+            return
+        cached = self.cache.get(model_name, prompt)
+        if cached is not None and request_id > self.cancelled_through:
+            CHAT_CACHE_HITS.inc()
+            self.finished.emit(request_id, cached, True)
+            return
+        try:
+            start = time.perf_counter()
+            parts = []
+            for chunk in model.generate_content(prompt, stream=True):
+                if request_id <= self.cancelled_through:
+                    return
+                if not parts:
+                    CHAT_FIRST_CHUNK.observe(time.perf_counter() - start)
+                parts.append(chunk.text)
+                self.chunk_received.emit(request_id, chunk.text)
+            CHAT_REQUEST_TIME.observe(time.perf_counter() - start)
+            text = ''.join(parts)
+            self.cache.put(model_name, prompt, text)
+            self.finished.emit(request_id, text, False)
+        except Exception as e:
+            self.failed.emit(request_id, str(e))
 
 class ChatWidget(QWidget):
-    def __init__(self, parent=None):
+
+    def __init__(self, context_builder=None, parent=None):
         super().__init__(parent)
+        # Adds the measurement session and recent conversation to questions
+        self.context_builder = context_builder
+        # Load environment variables
+        from dotenv import load_dotenv
+        load_dotenv()
         self.api_key = os.getenv('GEMINI_API_KEY')
         self.model = None
+        self.model_name = CHAT_MODEL
+        self.request_id = 0
+        self.active_request = None
+        self.stream_text = ''
+
+        # Only the newest messages live in the QTextEdit document; older ones
+        # are paged back in from the history when scrolling up.
+        # rendered_lengths holds each rendered message's size in document
+        # characters, oldest first, starting at message first_rendered.
+        self.history = ChatHistory()
+        self.first_rendered = 0
+        self.rendered_lengths = deque()
+        self.loading_older = False
         self.init_ui()
-        if self.api_key:
+
+        # Streamed chunks are coalesced into one re-render of the trailing
+        # message per interval
+        self.render_timer = QTimer()
+        self.render_timer.setSingleShot(True)
+        self.render_timer.timeout.connect(self.render_streaming_message)
+
+        # Requests run on worker threads so the window (and serial
+        # handling) keeps going while Gemini answers
+        self.worker = ChatWorker(ResponseCache())
+        self.worker.chunk_received.connect(self.handle_chunk)
+        self.worker.finished.connect(self.handle_finished)
+        self.worker.failed.connect(self.handle_failed)
+
+        if os.getenv('INTELLISPEC_CHAT_STUB'):
+            self.use_model(StubModel(), STUB_MODEL_NAME)
+        elif self.api_key:
             self.set_api_key(self.api_key)
 
     def init_ui(self):
@@ -69,6 +304,7 @@ class ChatWidget(QWidget):
         # Chat display
         self.chat_display = QTextEdit()
         self.chat_display.setReadOnly(True)
+        self.chat_display.verticalScrollBar().valueChanged.connect(self.handle_scroll)
         self.chat_display.setStyleSheet("""
             QTextEdit {
                 background-color: #1a1a1a;
@@ -111,17 +347,43 @@ class ChatWidget(QWidget):
         layout.addWidget(self.chat_display)
         layout.addWidget(self.input_field)
 
+        # Stop button, shown while a reply is streaming
+        self.stop_btn = QPushButton('Stop')
+        self.stop_btn.clicked.connect(self.cancel_request)
+        self.stop_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #2d2d2d;
+                border-radius: 15px;
+                padding: 5px;
+                color: #ffffff;
+            }
+            QPushButton:hover {
+                background-color: #3d3d3d;
+            }
+        """)
+        self.stop_btn.hide()
+        layout.addWidget(self.stop_btn)
+
     def set_api_key(self, key):
         if key.strip():
             self.api_key = key.strip()
+            import google.generativeai as genai
             genai.configure(api_key=self.api_key)
             try:
-                self.model = genai.GenerativeModel('gemini-pro')
-                self.append_formatted_message("System", "API Key set successfully! Chat is ready.")
+                self.use_model(genai.GenerativeModel(CHAT_MODEL), CHAT_MODEL)
             except Exception as e:
                 self.append_formatted_message("Error", str(e))
 
-    def append_formatted_message(self, sender, message):
+    def use_model(self, model, model_name):
+        self.model = model
+        self.model_name = model_name
+        if model_name == STUB_MODEL_NAME:
+            self.append_formatted_message("System", "Using the offline assistant. Chat is ready.")
+        else:
+            self.append_formatted_message("System", "API Key set successfully! Chat is ready.")
+
+    def format_message(self, sender, message):
+        import markdown
         html_content = markdown.markdown(message)
         
         if sender == "You":
@@ -133,40 +395,1135 @@ class ChatWidget(QWidget):
         else:
             color = "#F44336"  # Red for errors
             
-        formatted_html = f'<div style="margin-bottom: 10px;"><span style="color: {color}; font-weight: bold;">{sender}:</span> {html_content}</div>'
-        self.chat_display.append(formatted_html)
+        return f'<div style="margin-bottom: 10px;"><span style="color: {color}; font-weight: bold;">{sender}:</span> {html_content}</div>'
+
+    def append_formatted_message(self, sender, message, streaming=False):
+        index = self.history.add(sender, message, streaming)
+        self.append_rendered(self.history.render(index, self.format_message))
+        self.trim_rendered()
+
+    def append_rendered(self, html):
+        document = self.chat_display.document()
+        before = document.characterCount()
+        self.chat_display.append(html)
+        self.rendered_lengths.append(document.characterCount() - before)
+
+    def trim_rendered(self):
+        # Drop the oldest messages from the document; they stay in history
+        while len(self.rendered_lengths) > self.history.max_rendered:
+            length = self.rendered_lengths.popleft()
+            cursor = QTextCursor(self.chat_display.document())
+            if self.rendered_lengths:
+                # Also take the next message's leading block separator
+                length += 1
+                self.rendered_lengths[0] -= 1
+            cursor.setPosition(length, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+            self.first_rendered += 1
+
+    def handle_scroll(self, value):
+        if value == self.chat_display.verticalScrollBar().minimum() and self.first_rendered > 0 \
+                and not self.loading_older:
+            self.load_older_messages()
+
+    def load_older_messages(self):
+        # Re-render the document with one more page of older messages, using
+        # the cached HTML, and keep the view where it was
+        self.loading_older = True
+        scrollbar = self.chat_display.verticalScrollBar()
+        from_bottom = scrollbar.maximum() - scrollbar.value()
+        self.first_rendered = max(0, self.first_rendered - self.history.page_size)
+        htmls = self.history.render_range(self.first_rendered, len(self.history), self.format_message)
+        self.chat_display.clear()
+        self.rendered_lengths.clear()
+        for html in htmls:
+            self.append_rendered(html)
+        scrollbar.setValue(scrollbar.maximum() - from_bottom)
+        self.loading_older = False
+
+    def begin_streaming_message(self, sender):
+        self.stream_text = ''
+        self.append_formatted_message(sender, '…', streaming=True)
+
+    def update_streaming_message(self, text):
+        self.stream_text = text
+        if not self.render_timer.isActive():
+            self.render_timer.start(STREAM_RENDER_INTERVAL)
+
+    def render_streaming_message(self):
+        # Replace only the trailing message in the document
+        if self.history.streaming_index is None:
+            return
+        self.render_timer.stop()
+        self.history.set_text(self.stream_text or '…')
+        document = self.chat_display.document()
+        start = document.characterCount() - 1 - self.rendered_lengths.pop()
+        cursor = QTextCursor(document)
+        cursor.setPosition(start)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self.append_rendered(self.history.render(self.history.streaming_index, self.format_message))
+        scrollbar = self.chat_display.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+
+    def finish_streaming_message(self, text):
+        self.stream_text = text
+        self.render_streaming_message()
+        self.history.finish()
 
     def send_message(self):
-        if not self.api_key or not self.model:
+        if not self.model:
             self.append_formatted_message("Error", "Please set your Gemini API key first.")
             return
             
         message = self.input_field.text().strip()
         if message:
+            if self.active_request is not None:
+                self.cancel_request()
+            prompt = self.build_prompt(message)
             self.append_formatted_message("You", message)
             self.input_field.clear()
             
+            self.request_id += 1
+            self.active_request = self.request_id
+            self.begin_streaming_message("Assistant")
+            self.stop_btn.show()
+            self.worker.submit(self.request_id, self.model, self.model_name, prompt)
+
+    def build_prompt(self, message):
+        if self.context_builder is None:
+            return message
+        # Only the last few exchanges are read back from the history archive
+        count = len(self.history)
+        turns = [(sender, text) for sender, text in
+                 self.history.messages(max(0, count - 2 * CHAT_CONTEXT_TURNS), count)
+                 if sender in ("You", "Assistant")]
+        return self.context_builder.build(message, turns[-CHAT_CONTEXT_TURNS:])
+
+    def cancel_request(self):
+        if self.active_request is None:
+            return
+        self.worker.cancel_through(self.active_request)
+        self.finish_streaming_message(self.stream_text + '\n\n_(cancelled)_')
+        self.end_request()
+
+    def end_request(self):
+        self.active_request = None
+        self.stop_btn.hide()
+
+    def handle_chunk(self, request_id, text):
+        if request_id == self.active_request:
+            self.update_streaming_message(self.stream_text + text)
+
+    def handle_finished(self, request_id, text, from_cache):
+        if request_id == self.active_request:
+            self.finish_streaming_message(text)
+            self.end_request()
+
+    def handle_failed(self, request_id, error):
+        if request_id == self.active_request:
+            self.finish_streaming_message(self.stream_text)
+            self.append_formatted_message("Error", error)
+            self.end_request()
+
+    def shutdown(self):
+        # A request still blocked on the network is abandoned, not waited for
+        self.worker.cancel_through(self.request_id)
+        self.history.close()
+
+class DevicePanel(QWidget):
+    # Drives any number of additional devices at once. Each device runs on
+    # its own DeviceChannel thread; this widget only drains the merged
+    # results a few times a second and updates one table row per device.
+    results_ready = Signal(object)  # RESULT_DTYPE array, merged across devices
+    ports_changed = Signal()        # a device was added or removed
+
+    COLUMNS = ['Device', 'Port', 'State', 'Blank (V)', 'Voltage (V)', 'Absorbance (A)', 'Readings']
+
+    def __init__(self, list_ports, serial_factory=None, calibrations=None, parent=None):
+        super().__init__(parent)
+        # list_ports() -> ports that may be added here
+        self.list_ports = list_ports
+        self.manager = DeviceManager(serial_factory=serial_factory, calibrations=calibrations)
+        self.rows = {}      # device id -> table row
+        self.counts = {}    # device id -> readings received
+        self.init_ui()
+
+        self.drain_timer = QTimer()
+        self.drain_timer.timeout.connect(self.drain_results)
+        self.drain_timer.start(1000 // DEVICE_REFRESH_HZ)
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        button_style = """
+            QPushButton {
+                background-color: #2d2d2d;
+                border-radius: 5px;
+                padding: 5px 15px;
+                min-height: 30px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #3d3d3d;
+            }
+            QPushButton:checked {
+                background-color: #F44336;
+            }
+        """
+
+        add_layout = QHBoxLayout()
+        self.port_combo = QComboBox()
+        self.port_combo.setMinimumWidth(150)
+        self.port_combo.setEditable(True)
+        self.add_btn = QPushButton('Add Device')
+        self.add_btn.clicked.connect(self.add_device)
+        self.remove_btn = QPushButton('Remove')
+        self.remove_btn.clicked.connect(self.remove_device)
+        add_layout.addWidget(QLabel('Port:'))
+        add_layout.addWidget(self.port_combo, 1)
+        add_layout.addWidget(self.add_btn)
+        add_layout.addWidget(self.remove_btn)
+        layout.addLayout(add_layout)
+
+        command_layout = QHBoxLayout()
+        self.calibrate_all_btn = QPushButton('Calibrate All')
+        self.calibrate_all_btn.clicked.connect(self.manager.calibrate_all)
+        self.measure_all_btn = QPushButton('Measure All')
+        self.measure_all_btn.clicked.connect(self.manager.read_all)
+        self.stream_all_btn = QPushButton('Stream All')
+        self.stream_all_btn.setCheckable(True)
+        self.stream_all_btn.clicked.connect(self.toggle_stream)
+        self.rate_spin = QSpinBox()
+        self.rate_spin.setRange(1, max_stream_rate(DEFAULT_BAUDRATE))
+        self.rate_spin.setValue(DEFAULT_STREAM_RATE)
+        self.rate_spin.setSuffix(' Hz')
+        command_layout.addWidget(self.calibrate_all_btn)
+        command_layout.addWidget(self.measure_all_btn)
+        command_layout.addWidget(self.stream_all_btn)
+        command_layout.addWidget(self.rate_spin)
+        command_layout.addStretch()
+        layout.addLayout(command_layout)
+
+        for button in (self.add_btn, self.remove_btn, self.calibrate_all_btn,
+                       self.measure_all_btn, self.stream_all_btn):
+            button.setStyleSheet(button_style)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.setStyleSheet("""
+            QTableWidget {
+                background-color: #2d2d2d;
+                border-radius: 10px;
+            }
+        """)
+        layout.addWidget(self.table)
+        self.refresh_ports()
+        self.update_buttons()
+
+    def refresh_ports(self):
+        in_use = {channel.port for channel in self.manager.channels.values()}
+        self.port_combo.clear()
+        self.port_combo.addItems([port for port in self.list_ports() if port not in in_use])
+
+    def update_buttons(self):
+        has_devices = len(self.manager) > 0
+        self.remove_btn.setEnabled(has_devices)
+        self.calibrate_all_btn.setEnabled(has_devices)
+        self.measure_all_btn.setEnabled(has_devices)
+        self.stream_all_btn.setEnabled(has_devices)
+
+    def add_device(self):
+        port = self.port_combo.currentText().strip()
+        if not port:
+            return
+        try:
+            channel = self.manager.add(port)
+        except ValueError as e:
+            QMessageBox.warning(self, "Add Device", str(e))
+            return
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.rows[channel.device_id] = row
+        self.counts[channel.device_id] = 0
+        for column, text in enumerate([str(channel.device_id), port, 'connecting', '—', '—', '—', '0']):
+            self.table.setItem(row, column, QTableWidgetItem(text))
+        self.refresh_ports()
+        self.update_buttons()
+        self.ports_changed.emit()
+
+    def remove_device(self):
+        row = self.table.currentRow()
+        device_id = next((device for device, r in self.rows.items() if r == row), None)
+        if device_id is None:
+            return
+        self.manager.remove(device_id)
+        self.table.removeRow(row)
+        del self.rows[device_id]
+        del self.counts[device_id]
+        for device, r in self.rows.items():
+            if r > row:
+                self.rows[device] = r - 1
+        self.refresh_ports()
+        self.update_buttons()
+        self.ports_changed.emit()
+
+    def toggle_stream(self, checked):
+        if checked:
+            self.manager.start_stream_all(self.rate_spin.value())
+        else:
+            self.manager.stop_stream_all()
+        self.rate_spin.setEnabled(not checked)
+
+    def drain_results(self):
+        results = self.manager.drain()
+        if len(results):
+            # Latest reading of every device in this batch, without a
+            # per-result Python loop
+            reversed_devices = results['device'][::-1]
+            devices, last = np.unique(reversed_devices, return_index=True)
+            counts = np.bincount(results['device'])
+            for device, index in zip(devices, len(results) - 1 - last):
+                row = self.rows.get(int(device))
+                if row is None:
+                    continue  # removed while its last results were queued
+                self.counts[int(device)] += int(counts[device])
+                result = results[index]
+                self.table.item(row, 4).setText(f"{result['voltage']:.3f}")
+                absorbance = result['absorbance']
+                self.table.item(row, 5).setText('—' if np.isnan(absorbance) else f"{absorbance:.3f}")
+                self.table.item(row, 6).setText(str(self.counts[int(device)]))
+            self.results_ready.emit(results)
+        for device_id, row in self.rows.items():
+            channel = self.manager.channels[device_id]
+            if channel.error:
+                state = f"error: {channel.error}"
+            elif not channel.running:
+                state = 'disconnected'
+            elif not channel.connected:
+                state = 'connecting'
+            else:
+                state = channel.state + (f" (+{channel.queued})" if channel.queued else '')
+            self.table.item(row, 2).setText(state)
+            self.table.item(row, 3).setText('—' if channel.initial_voltage is None
+                                            else f"{channel.initial_voltage:.3f}")
+
+    def shutdown(self):
+        self.drain_timer.stop()
+        self.manager.close()
+
+class StandardCurvePanel(QWidget):
+    # Standards of known concentration and the curve fitted through them.
+    # The main window passes in every finished reading with set_latest();
+    # "Add Standard" files the latest one under the entered concentration.
+    # The curve is updated in place as standards are added or removed and
+    # only refitted from the list when the model changes.
+    curve_changed = Signal()
+
+    COLUMNS = ['Concentration', 'Absorbance (A)', '± (A)', 'Fitted (A)', 'Residual (A)']
+    MODELS = [
+        ('Linear', (1, False)),
+        ('Linear through origin', (1, True)),
+        ('Quadratic', (2, False)),
+        ('Cubic', (3, False)),
+    ]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.curve = StandardCurve()
+        self.uncertainties = []   # σ of each standard's absorbance, None if unknown
+        self.latest = None        # (absorbance, σ or None) of the last reading
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        button_style = """
+            QPushButton {
+                background-color: #2d2d2d;
+                border-radius: 5px;
+                padding: 5px 15px;
+                min-height: 30px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #3d3d3d;
+            }
+        """
+
+        add_layout = QHBoxLayout()
+        self.concentration_spin = QDoubleSpinBox()
+        self.concentration_spin.setRange(0.0, 1e6)
+        self.concentration_spin.setDecimals(4)
+        self.units_edit = QLineEdit('mg/L')
+        self.units_edit.setMaximumWidth(80)
+        self.units_edit.textChanged.connect(self.update_fit)
+        self.add_btn = QPushButton('Add Standard')
+        self.add_btn.setToolTip("Use the latest reading as a standard of this concentration")
+        self.add_btn.setEnabled(False)
+        self.add_btn.clicked.connect(self.add_standard)
+        self.remove_btn = QPushButton('Remove')
+        self.remove_btn.clicked.connect(self.remove_standard)
+        add_layout.addWidget(QLabel('Concentration:'))
+        add_layout.addWidget(self.concentration_spin)
+        add_layout.addWidget(self.units_edit)
+        add_layout.addWidget(self.add_btn)
+        add_layout.addWidget(self.remove_btn)
+        add_layout.addStretch()
+        layout.addLayout(add_layout)
+
+        model_layout = QHBoxLayout()
+        self.model_combo = QComboBox()
+        for text, model in self.MODELS:
+            self.model_combo.addItem(text, model)
+        self.model_combo.currentIndexChanged.connect(self.refit)
+        self.weighted_check = QCheckBox('Weighted (1/σ²)')
+        self.weighted_check.setToolTip("Weight standards by the uncertainty of averaged readings")
+        self.weighted_check.toggled.connect(self.refit)
+        self.save_btn = QPushButton('Save...')
+        self.save_btn.clicked.connect(self.save)
+        self.load_btn = QPushButton('Load...')
+        self.load_btn.clicked.connect(self.load)
+        self.quantify_btn = QPushButton('Quantify Session...')
+        self.quantify_btn.setToolTip("Export this session with every absorbance converted to concentration")
+        model_layout.addWidget(QLabel('Model:'))
+        model_layout.addWidget(self.model_combo)
+        model_layout.addWidget(self.weighted_check)
+        model_layout.addStretch()
+        model_layout.addWidget(self.save_btn)
+        model_layout.addWidget(self.load_btn)
+        model_layout.addWidget(self.quantify_btn)
+        layout.addLayout(model_layout)
+
+        for button in (self.add_btn, self.remove_btn, self.save_btn, self.load_btn, self.quantify_btn):
+            button.setStyleSheet(button_style)
+
+        self.fit_label = QLabel('Add at least two standards')
+        self.fit_label.setStyleSheet("font-size: 14px;")
+        layout.addWidget(self.fit_label)
+
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.table.setStyleSheet("""
+            QTableWidget {
+                background-color: #2d2d2d;
+                border-radius: 10px;
+            }
+        """)
+        layout.addWidget(self.table)
+
+    @property
+    def units(self):
+        return self.units_edit.text().strip()
+
+    def set_latest(self, absorbance, uncertainty=None):
+        if absorbance is None or math.isnan(absorbance):
+            return
+        self.latest = (absorbance, uncertainty)
+        self.add_btn.setEnabled(True)
+
+    def weight(self, uncertainty):
+        # Inverse variance; a zero spread is floored, not treated as unknown
+        if self.weighted_check.isChecked() and uncertainty is not None and not math.isnan(uncertainty):
+            return 1.0 / max(uncertainty, MIN_UNCERTAINTY) ** 2
+        return 1.0
+
+    def add_standard(self):
+        if self.latest is None:
+            return
+        absorbance, uncertainty = self.latest
+        self.curve.add(self.concentration_spin.value(), absorbance, self.weight(uncertainty))
+        self.uncertainties.append(uncertainty)
+        self.update_fit()
+
+    def remove_standard(self):
+        rows = sorted({index.row() for index in self.table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            self.curve.remove(row)
+            del self.uncertainties[row]
+        if rows:
+            self.update_fit()
+
+    def refit(self):
+        # A different model needs its own normal equations
+        degree, through_origin = self.model_combo.currentData()
+        curve = StandardCurve(degree, through_origin)
+        for standard, uncertainty in zip(self.curve.standards, self.uncertainties):
+            curve.add(standard.concentration, standard.absorbance, self.weight(uncertainty))
+        self.curve = curve
+        self.update_fit()
+
+    def update_fit(self):
+        standards = self.curve.standards
+        fitted = self.curve.absorbance([s.concentration for s in standards]) if self.curve.ready else None
+        self.table.setRowCount(len(standards))
+        for row, (standard, uncertainty) in enumerate(zip(standards, self.uncertainties)):
+            values = [f"{standard.concentration:g} {self.units}", f"{standard.absorbance:.4f}",
+                      f"{uncertainty:.4f}" if uncertainty else '—',
+                      f"{fitted[row]:.4f}" if fitted is not None else '—',
+                      f"{standard.absorbance - fitted[row]:+.4f}" if fitted is not None else '—']
+            for column, text in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        if self.curve.ready:
+            self.fit_label.setText(f"{self.curve.equation()}    R² = {self.curve.r_squared:.5f}"
+                                   f"    ({len(standards)} standards, c in {self.units or 'units'})")
+        else:
+            self.fit_label.setText(f"{len(standards)} standards; the model needs more to fit a curve")
+        self.curve_changed.emit()
+
+    def concentration(self, absorbances):
+        # Concentrations for an array of absorbances, or None without a usable curve
+        if not self.curve.ready:
+            return None
+        try:
+            return self.curve.concentration(absorbances)
+        except ValueError as e:
+            self.fit_label.setText(f"{self.curve.equation()}    ({e})")
+            return None
+
+    def save(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save Standard Curve", "", "Standard curve (*.json)")
+        if not path:
+            return
+        try:
+            save_curve(self.curve, path, units=self.units, uncertainties=self.uncertainties)
+        except OSError as e:
+            QMessageBox.warning(self, "Save Error", str(e))
+
+    def load(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Load Standard Curve", "", "Standard curve (*.json)")
+        if not path:
+            return
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            curve = StandardCurve.from_dict(data)
+        except (OSError, ValueError, KeyError) as e:
+            QMessageBox.warning(self, "Load Error", str(e))
+            return
+        self.curve = curve
+        self.uncertainties = list(data.get('uncertainties') or [None] * len(curve))
+        self.units_edit.setText(data.get('units', ''))
+        self.weighted_check.blockSignals(True)
+        self.weighted_check.setChecked(any(s.weight != 1.0 for s in curve.standards))
+        self.weighted_check.blockSignals(False)
+        self.model_combo.blockSignals(True)
+        for index in range(self.model_combo.count()):
+            if self.model_combo.itemData(index) == (curve.degree, curve.through_origin):
+                self.model_combo.setCurrentIndex(index)
+        self.model_combo.blockSignals(False)
+        self.update_fit()
+
+class KineticsPlot(QWidget):
+    # Live plot of one column of the sample ring against wall-clock time.
+    # Data is drawn through min/max decimation to the plot width, so a
+    # repaint costs the same however many samples are in view. Follows the
+    # newest data until the view is zoomed (wheel) or panned (drag);
+    # double-click returns to following. Views reaching back past the ring
+    # read the older part from the session file on disk.
+
+    MARGIN_LEFT = 60
+    MARGIN_RIGHT = 15
+    MARGIN_TOP = 10
+    MARGIN_BOTTOM = 30
+    UNITS = {'voltage': 'V', 'absorbance': 'A', 'transmittance': '%'}
+
+    def __init__(self, ring, history_path=None, parent=None):
+        super().__init__(parent)
+        self.ring = ring
+        # history_path() -> the session file backing the ring, or None
+        self.history_path = history_path
+        self.column = 'absorbance'
+        self.span = DEFAULT_PLOT_SPAN
+        self.view_end = None      # None = follow the newest sample
+        self.drag_x = None
+        self.drag_end = None
+        self.history = None
+        self.history_key = None
+        # Whether the session file is in time order, as far as checked; if
+        # not, a time order of its records kept up to date as it grows
+        self.history_ordered = True
+        self.history_checked = 0
+        self.history_order = np.empty(0, dtype=np.int64)
+        self.history_stamps = np.empty(0)
+        self.last_total = -1
+        self.setMinimumHeight(200)
+        self.setStyleSheet("background-color: #1a1a1a; border-radius: 10px;")
+
+        # Repaint at display rate, and only when something changed
+        self.refresh_timer = QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(1000 // DISPLAY_REFRESH_HZ)
+
+    def set_column(self, column):
+        self.column = column
+        self.update()
+
+    def refresh(self):
+        if self.ring.total != self.last_total:
+            self.last_total = self.ring.total
+            self.update()
+
+    def plot_rect(self):
+        return self.rect().adjusted(self.MARGIN_LEFT, self.MARGIN_TOP,
+                                    -self.MARGIN_RIGHT, -self.MARGIN_BOTTOM)
+
+    def time_range(self):
+        end = self.view_end
+        if end is None:
+            end = self.ring.newest_time if len(self.ring) else time.time()
+        return end - self.span, end
+
+    def visible_data(self, start, end, width):
+        # Samples older than the ring come from the session file
+        oldest = self.ring.oldest_time
+        times, values = self.ring.window(start, end, self.column)
+        if oldest is not None and start >= oldest:
+            return times, values
+        records = self.open_history()
+        if records is None or not len(records):
+            return times, values
+        stop_time = end if oldest is None else min(end, oldest)
+        stamps = records['timestamp']
+        # Wide views take a stride through the file rather than reading every
+        # record, so the disk part also costs a fixed amount per pixel
+        if self.history_ordered:
+            lo = np.searchsorted(stamps, start, 'left')
+            hi = np.searchsorted(stamps, stop_time, 'left')
+            step = max(1, (hi - lo) // (width * HISTORY_POINTS_PER_PIXEL))
+            older = records[lo:hi:step]
+        else:
+            # Out of order: search the kept sort order instead
+            lo = np.searchsorted(self.history_stamps, start, 'left')
+            hi = np.searchsorted(self.history_stamps, stop_time, 'left')
+            step = max(1, (hi - lo) // (width * HISTORY_POINTS_PER_PIXEL))
+            older = records[self.history_order[lo:hi:step]]
+        return (np.concatenate((older['timestamp'], times)),
+                np.concatenate((older[self.column].astype(np.float64), values)))
+
+    def open_history(self):
+        path = self.history_path() if self.history_path else None
+        if path is None:
+            return None
+        try:
+            key = (path, os.path.getsize(path))
+            if key != self.history_key:
+                records = open_history(path)
+                if (self.history_key is None or self.history_key[0] != path
+                        or len(records) < self.history_checked):
+                    self.history_ordered = True
+                    self.history_checked = 0
+                    self.history_order = np.empty(0, dtype=np.int64)
+                    self.history_stamps = np.empty(0)
+                # Stream samples are stamped by the device clock and other
+                # readings by the host's, so the file needn't be in time
+                # order. Only the records added since the last check are read.
+                if self.history_ordered:
+                    stamps = records['timestamp'][max(0, self.history_checked - 1):]
+                    self.history_ordered = bool(np.all(stamps[1:] >= stamps[:-1]))
+                self.history_checked = len(records)
+                if not self.history_ordered:
+                    self.sort_history(records)
+                self.history = records
+                self.history_key = key
+        except (OSError, ValueError):
+            return None
+        return self.history
+
+    def sort_history(self, records):
+        # Merges the records added since the last call into the sort order,
+        # so a growing file isn't sorted again from scratch
+        done = len(self.history_order)
+        tail = records['timestamp'][done:].astype(np.float64)
+        order = np.argsort(tail, kind='stable')
+        tail = tail[order]
+        at = np.searchsorted(self.history_stamps, tail, 'right')
+        self.history_order = np.insert(self.history_order, at, order + done)
+        self.history_stamps = np.insert(self.history_stamps, at, tail)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = self.plot_rect()
+        painter.setPen(QPen(QColor('#555555')))
+        painter.drawRect(rect)
+        if rect.width() <= 0 or rect.height() <= 0:
+            return
+        start, end = self.time_range()
+        times, values = self.visible_data(start, end, rect.width())
+        times, values = minmax_decimate(times, values, start, end, rect.width())
+        finite = np.isfinite(values)
+        unit = self.UNITS[self.column]
+        painter.setPen(QPen(QColor('#aaaaaa')))
+        painter.drawText(rect.left(), rect.bottom() + 20,
+                         time.strftime('%H:%M:%S', time.localtime(start)))
+        painter.drawText(rect.right() - 60, rect.bottom() + 20,
+                         time.strftime('%H:%M:%S', time.localtime(end)))
+        if not finite.any():
+            painter.drawText(rect, Qt.AlignCenter, 'No data')
+            return
+        low, high = float(values[finite].min()), float(values[finite].max())
+        pad = (high - low) * 0.05 or 0.05
+        low, high = low - pad, high + pad
+        painter.drawText(5, rect.top() + 10, f"{high:.3f} {unit}")
+        painter.drawText(5, rect.bottom(), f"{low:.3f} {unit}")
+
+        xs = rect.left() + (times[finite] - start) * (rect.width() / self.span)
+        ys = rect.bottom() - (values[finite] - low) * (rect.height() / (high - low))
+        painter.setClipRect(rect)
+        painter.setPen(QPen(QColor('#2196F3'), 1.5))
+        painter.drawPolyline(QPolygonF([QPointF(x, y) for x, y in zip(xs.tolist(), ys.tolist())]))
+
+    def wheelEvent(self, event):
+        # Zoom the time axis around the cursor
+        rect = self.plot_rect()
+        start, end = self.time_range()
+        fraction = min(1.0, max(0.0, (event.position().x() - rect.left()) / max(1, rect.width())))
+        anchor = start + fraction * self.span
+        factor = PLOT_ZOOM_STEP if event.angleDelta().y() < 0 else 1 / PLOT_ZOOM_STEP
+        self.span = min(MAX_PLOT_SPAN, max(MIN_PLOT_SPAN, self.span * factor))
+        self.set_view_end(anchor + (1 - fraction) * self.span)
+
+    def mousePressEvent(self, event):
+        self.drag_x = event.position().x()
+        self.drag_end = self.time_range()[1]
+
+    def mouseMoveEvent(self, event):
+        if self.drag_x is None:
+            return
+        seconds_per_pixel = self.span / max(1, self.plot_rect().width())
+        self.set_view_end(self.drag_end - (event.position().x() - self.drag_x) * seconds_per_pixel)
+
+    def mouseReleaseEvent(self, event):
+        self.drag_x = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.span = DEFAULT_PLOT_SPAN
+        self.view_end = None
+        self.update()
+
+    def set_view_end(self, end):
+        # Scrolling to (or past) the newest sample resumes following
+        newest = self.ring.newest_time
+        self.view_end = None if newest is None or end >= newest else end
+        self.update()
+
+class SpectrumPlot(QWidget):
+    # Overlay of the latest absorbance spectra, older scans fainter, with
+    # the newest scan's peak marked. Only the scans on screen are
+    # converted, together, on each repaint.
+
+    MARGIN_LEFT = 60
+    MARGIN_RIGHT = 15
+    MARGIN_TOP = 10
+    MARGIN_BOTTOM = 30
+
+    def __init__(self, spectra, parent=None):
+        super().__init__(parent)
+        self.spectra = spectra
+        self.overlay = DEFAULT_SPECTRA_OVERLAY
+        self.setMinimumHeight(200)
+        self.setStyleSheet("background-color: #1a1a1a; border-radius: 10px;")
+
+    def set_overlay(self, count):
+        self.overlay = count
+        self.update()
+
+    def plot_rect(self):
+        return self.rect().adjusted(self.MARGIN_LEFT, self.MARGIN_TOP,
+                                    -self.MARGIN_RIGHT, -self.MARGIN_BOTTOM)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        rect = self.plot_rect()
+        painter.setPen(QPen(QColor('#555555')))
+        painter.drawRect(rect)
+        if rect.width() <= 0 or rect.height() <= 0:
+            return
+        count = len(self.spectra)
+        absorbances = self.spectra.absorbances(slice(max(0, count - self.overlay), count)) \
+            if count else np.empty((0, 0))
+        finite = np.isfinite(absorbances)
+        painter.setPen(QPen(QColor('#aaaaaa')))
+        if not finite.any():
+            painter.drawText(rect, Qt.AlignCenter, 'Scan a blank, then a sample' if count == 0 or
+                             self.spectra.blank is None else 'No absorbance data')
+            return
+        wavelengths = self.spectra.wavelengths
+        left, right = float(wavelengths[0]), float(wavelengths[-1])
+        if right - left < 1:
+            left, right = left - 10, right + 10   # a single channel
+        low, high = float(absorbances[finite].min()), float(absorbances[finite].max())
+        pad = (high - low) * 0.05 or 0.05
+        low, high = low - pad, high + pad
+        painter.drawText(rect.left(), rect.bottom() + 20, f"{left:g} nm")
+        painter.drawText(rect.right() - 60, rect.bottom() + 20, f"{right:g} nm")
+        painter.drawText(5, rect.top() + 10, f"{high:.3f} A")
+        painter.drawText(5, rect.bottom(), f"{low:.3f} A")
+
+        xs = rect.left() + (wavelengths - left) * (rect.width() / (right - left))
+        ys = rect.bottom() - (absorbances - low) * (rect.height() / (high - low))
+        painter.setClipRect(rect)
+        rows = len(absorbances)
+        for row in range(rows):
+            newest = row == rows - 1
+            color = QColor('#2196F3')
+            color.setAlpha(255 if newest else 40 + 160 * (row + 1) // rows)
+            painter.setPen(QPen(color, 2.0 if newest else 1.0))
+            points = [QPointF(x, y) for x, y, ok in zip(xs.tolist(), ys[row].tolist(), finite[row].tolist()) if ok]
+            painter.drawPolyline(QPolygonF(points))
+            if newest:
+                for point in points:
+                    painter.drawEllipse(point, 3, 3)
+        peak_wavelengths, peak_values = find_peaks(absorbances[-1], wavelengths)
+        if np.isfinite(peak_values[0]):
+            x = rect.left() + (peak_wavelengths[0] - left) * (rect.width() / (right - left))
+            y = rect.bottom() - (peak_values[0] - low) * (rect.height() / (high - low))
+            painter.setPen(QPen(QColor('#FFC107'), 1.0, Qt.DashLine))
+            painter.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+            painter.drawText(QPointF(min(x + 5, rect.right() - 120), max(y - 5, rect.top() + 12)),
+                             f"{peak_wavelengths[0]:.0f} nm, {peak_values[0]:.3f} A")
+
+class SpectraPanel(QWidget):
+    # Spectral scans of multi-LED builds: a blank scan, then sample scans,
+    # one at a time or back to back with Repeat, overlaid on one plot.
+    # The main window passes in each finished scan; the scans themselves
+    # live in a SpectrumSet.
+    blank_requested = Signal()
+    scan_requested = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.spectra = SpectrumSet()
+        self.init_ui()
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        button_style = """
+            QPushButton {
+                background-color: #2d2d2d;
+                border-radius: 5px;
+                padding: 5px 15px;
+                min-height: 30px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #3d3d3d;
+            }
+            QPushButton:checked {
+                background-color: #2196F3;
+            }
+        """
+        controls = QHBoxLayout()
+        self.blank_btn = QPushButton('Blank Scan')
+        self.blank_btn.setToolTip("Scan the blank on every LED (per-channel V0 and dark)")
+        self.blank_btn.clicked.connect(self.blank_requested.emit)
+        self.scan_btn = QPushButton('Scan')
+        self.scan_btn.clicked.connect(self.scan_requested.emit)
+        self.repeat_btn = QPushButton('Repeat')
+        self.repeat_btn.setCheckable(True)
+        self.repeat_btn.setToolTip("Scan again as soon as each scan is done")
+        self.repeat_btn.toggled.connect(self.toggle_repeat)
+        self.overlay_spin = QSpinBox()
+        self.overlay_spin.setRange(1, MAX_SPECTRA_OVERLAY)
+        self.overlay_spin.setValue(DEFAULT_SPECTRA_OVERLAY)
+        self.overlay_spin.setToolTip("Number of latest scans overlaid")
+        self.export_btn = QPushButton('Export...')
+        self.export_btn.clicked.connect(self.export)
+        for button in (self.blank_btn, self.scan_btn, self.repeat_btn, self.export_btn):
+            button.setStyleSheet(button_style)
+        controls.addWidget(self.blank_btn)
+        controls.addWidget(self.scan_btn)
+        controls.addWidget(self.repeat_btn)
+        controls.addWidget(QLabel('Overlay:'))
+        controls.addWidget(self.overlay_spin)
+        controls.addStretch()
+        controls.addWidget(self.export_btn)
+        layout.addLayout(controls)
+
+        info = QHBoxLayout()
+        self.info_label = QLabel('No blank scan yet')
+        self.info_label.setStyleSheet("font-size: 14px;")
+        self.lookup_spin = QDoubleSpinBox()
+        self.lookup_spin.setRange(200.0, 1100.0)
+        self.lookup_spin.setDecimals(0)
+        self.lookup_spin.setSuffix(' nm')
+        self.lookup_spin.setValue(525.0)
+        self.lookup_spin.valueChanged.connect(self.update_info)
+        self.lookup_label = QLabel('')
+        self.lookup_label.setStyleSheet("font-size: 14px;")
+        info.addWidget(self.info_label)
+        info.addStretch()
+        info.addWidget(QLabel('Absorbance at'))
+        info.addWidget(self.lookup_spin)
+        info.addWidget(self.lookup_label)
+        layout.addLayout(info)
+
+        self.plot = SpectrumPlot(self.spectra)
+        self.overlay_spin.valueChanged.connect(self.plot.set_overlay)
+        layout.addWidget(self.plot)
+
+    @property
+    def repeating(self):
+        return self.repeat_btn.isChecked()
+
+    def toggle_repeat(self, checked):
+        self.blank_btn.setEnabled(not checked and self.scan_btn.isEnabled())
+        if checked:
+            self.scan_requested.emit()
+
+    def update_buttons(self, connected, idle):
+        self.blank_btn.setEnabled(connected and idle and not self.repeating)
+        self.scan_btn.setEnabled(connected and idle and not self.repeating)
+        self.repeat_btn.setEnabled(connected)
+        if not connected:
+            self.repeat_btn.setChecked(False)
+
+    def set_blank(self, scan):
+        try:
+            self.spectra.set_blank(scan)
+        except ValueError:
+            # Another build (or firmware) with different LEDs: start over
+            print(f"Scan channels changed; discarding {len(self.spectra)} earlier scans")
+            self.spectra.clear()
+            self.spectra.set_blank(scan)
+        wavelengths = self.spectra.wavelengths
+        self.info_label.setText(f"Blank: {len(wavelengths)} channels, {wavelengths[0]:g}-{wavelengths[-1]:g} nm")
+        self.plot.update()
+
+    def add_scan(self, timestamp, scan):
+        try:
+            self.spectra.add(timestamp, scan)
+        except ValueError as e:
+            print(f"Ignoring scan: {e}; take a new blank scan")
+            self.repeat_btn.setChecked(False)
+            return
+        self.update_info()
+        self.plot.update()
+
+    def update_info(self):
+        count = len(self.spectra)
+        if not count:
+            return
+        latest = self.spectra.absorbances(slice(count - 1, count))
+        peak_wavelengths, peak_values = find_peaks(latest, self.spectra.wavelengths)
+        if np.isnan(peak_values[0]):
+            self.info_label.setText(f"Scan {count}: no blank yet")
+            self.lookup_label.setText('')
+            return
+        self.info_label.setText(f"Scan {count}: peak {peak_wavelengths[0]:.0f} nm, {peak_values[0]:.3f} A")
+        value = absorbance_at(latest, self.spectra.wavelengths, self.lookup_spin.value())[0]
+        self.lookup_label.setText('outside the scan' if np.isnan(value) else f"{value:.3f} A")
+
+    def export(self):
+        if not len(self.spectra):
+            QMessageBox.information(self, "Export Spectra", "No scans recorded yet.")
+            return
+        path, selected = QFileDialog.getSaveFileName(self, "Export Spectra", "spectra.npz",
+                                                     "NumPy arrays (*.npz);;CSV, absorbance per wavelength (*.csv)")
+        if not path:
+            return
+        try:
+            if path.endswith('.csv') or selected.startswith('CSV'):
+                export_spectra_csv(self.spectra, path)
+            else:
+                save_spectra(self.spectra, path)
+        except OSError as e:
+            QMessageBox.warning(self, "Export Error", str(e))
+
+class MetricsPanel(QWidget):
+    # Collapsible diagnostics: every metric of intellispec.metrics.registry
+    # with its rate, refreshed once a second while expanded. Snapshots can
+    # be exported, and the sampling profiler started and saved from here.
+    COLUMNS = ['Metric', 'Value', 'Rate / p50 / p95']
+
+    def __init__(self, profiler=None, parent=None):
+        super().__init__(parent)
+        self.profiler = profiler or SamplingProfiler()
+        self.rates = RateMeter(metrics_registry)
+        self.init_ui()
+        self.refresh_timer = QTimer()
+        self.refresh_timer.timeout.connect(self.refresh)
+
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.toggle_btn = QPushButton('▸ Diagnostics')
+        self.toggle_btn.setCheckable(True)
+        self.toggle_btn.setStyleSheet("text-align: left; padding: 5px; font-size: 14px;")
+        self.toggle_btn.toggled.connect(self.set_expanded)
+        layout.addWidget(self.toggle_btn)
+
+        self.body = QWidget()
+        body_layout = QVBoxLayout(self.body)
+        body_layout.setContentsMargins(0, 0, 0, 0)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setMinimumHeight(200)
+        body_layout.addWidget(self.table)
+        button_layout = QHBoxLayout()
+        self.export_btn = QPushButton('Export Snapshot...')
+        self.export_btn.clicked.connect(self.export_snapshot)
+        self.profile_btn = QPushButton('Start Profiler')
+        self.profile_btn.setCheckable(True)
+        self.profile_btn.setToolTip("Sample every thread's stack to find stalls")
+        self.profile_btn.toggled.connect(self.toggle_profiler)
+        button_layout.addWidget(self.export_btn)
+        button_layout.addWidget(self.profile_btn)
+        button_layout.addStretch()
+        body_layout.addLayout(button_layout)
+        self.body.setVisible(False)
+        layout.addWidget(self.body)
+
+    def set_expanded(self, expanded):
+        self.body.setVisible(expanded)
+        self.toggle_btn.setText(('▾' if expanded else '▸') + ' Diagnostics')
+        if expanded:
+            self.refresh()
+            self.refresh_timer.start(1000)
+        else:
+            self.refresh_timer.stop()
+
+    def refresh(self):
+        rates = self.rates.update()
+        metrics = list(metrics_registry)
+        self.table.setRowCount(len(metrics))
+        for row, metric in enumerate(metrics):
+            if metric.kind == 'histogram':
+                value = f"{metric.count}"
+                detail = f"{metric.quantile(0.5) * 1000:.1f} / {metric.quantile(0.95) * 1000:.1f} ms" \
+                    if metric.count else '—'
+            else:
+                value = f"{metric.value:g}"
+                detail = f"{rates[metric.name]:.1f}/s" if metric.name in rates else ''
+            name = metric.name.removeprefix('intellispec_')
+            for column, text in enumerate([name, value, detail]):
+                item = QTableWidgetItem(text)
+                if column == 0:
+                    item.setToolTip(metric.help)
+                self.table.setItem(row, column, item)
+
+    def export_snapshot(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Metrics", "metrics.json",
+                                              "JSON (*.json);;Prometheus text (*.prom)")
+        if not path:
+            return
+        try:
+            metrics_registry.write_snapshot(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Export Error", str(e))
+
+    def toggle_profiler(self, checked):
+        if checked:
+            self.profiler.clear()
+            self.profiler.start()
+            self.profile_btn.setText('Stop Profiler...')
+            return
+        self.profiler.stop()
+        self.profile_btn.setText('Start Profiler')
+        print(self.profiler.report())
+        path, _ = QFileDialog.getSaveFileName(self, "Save Profile", "profile.folded",
+                                              "Collapsed stacks (*.folded *.txt)")
+        if path:
             try:
-                response = self.model.generate_content(message)
-                self.append_formatted_message("Assistant", response.text)
-            except Exception as e:
-                self.append_formatted_message("Error", str(e))
+                self.profiler.write_collapsed(path)
+            except OSError as e:
+                QMessageBox.warning(self, "Save Error", str(e))
+
+    def shutdown(self):
+        self.refresh_timer.stop()
+        self.profiler.stop()
 
 class SpectrophotometerUI(QMainWindow):
-    def __init__(self):
+    # Emitted from the port watcher's thread: (ports, added, removed)
+    ports_changed = Signal(object, object, object)
+
+    def __init__(self, extra_ports=(), serial_factory=None):
         super().__init__()
         self.serial_thread = None
+        # Ports comports() can't see, such as a simulator's pty
+        self.extra_ports = list(extra_ports)
+        self.serial_factory = serial_factory
+
+        # Ports are enumerated on a background thread; the GUI only handles
+        # change events. The port the user picked is reconnected whenever
+        # the connection is lost, with growing delays between attempts.
+        self.wanted_port = None
+        self.reconnect_backoff = Backoff()
+        self.reconnect_timer = QTimer()
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.reconnect)
+        self.port_watcher = PortWatcher(self.ports_changed.emit)
+        self.ports_changed.connect(self.handle_ports_changed)
+        
+        # Commands are sent and completed by the acquisition state machine;
+        # the timer is only a fallback for replies that never arrive.
+        self.acquisition = AcquisitionStateMachine(self.send_command,
+                                                   on_state_changed=self.on_acquisition_state,
+                                                   on_timeout=self.on_command_timeout)
+        self.command_timer = QTimer()
+        self.command_timer.setSingleShot(True)
+        self.command_timer.timeout.connect(self.check_command_timeout)
+        
+        # Recent readings for the kinetics plot; older ones are read back
+        # from the session file
+        self.samples = SampleRing()
+        # Running statistics of the session for the chat assistant
+        self.session_summary = SessionSummary()
+        # Created by init_ui, after the port list is first filled
+        self.device_panel = None
+        # Calibrations are remembered per device and restored on reconnect;
+        # a restored one is confirmed with a quick dark reading first. The
+        # device panel shares the store.
+        self.calibrations = CalibrationStore()
+        
         self.init_ui()
         
         # Variables for calculations
-        self.dark_voltage = 0.110
+        self.dark_voltage = DEFAULT_DARK_VOLTAGE   # until the device measures one
         self.initial_voltage = None
-        self.calibrating = False
+
+        self.device_key = None
+        self.restored_calibration = None
+        self.checking_dark = False
+        self.oversample = None   # raw samples of the 'oversample' burst in progress
+        self.scan_collector = ScanCollector()   # channels of the spectral scan in progress
+        self.latest_absorbance = None
+        self.streaming = False
+        self.run_worker = None
+        self.run_thread = None
+        self.run_results = []
+        
+        # Every reading is appended to this session's measurement file
+        self.store = None
+        self.stream_clock_offset = None
+
+        # Link settings the device has confirmed; it starts in ASCII at the
+        # default rate after every reset
+        self.link_baudrate = DEFAULT_BAUDRATE
+        self.link_binary = False
+        
+        # Stream mode records every sample but refreshes the labels at display rate
+        self.stream_count = 0
+        self.stream_display = DisplayDecimator()
+        self.display_timer = QTimer()
+        self.display_timer.timeout.connect(self.refresh_stream_display)
         
         # Status update timer for connection monitoring
         self.status_timer = QTimer()
-        self.status_timer.timeout.connect(self.update_connection_status)
+        self.status_timer.timeout.connect(self.sync_store)
         self.status_timer.start(1000)
+        self.port_watcher.start()
 
     def init_ui(self):
         self.setWindowTitle('IntellispecUI')
@@ -311,6 +1668,20 @@ class SpectrophotometerUI(QMainWindow):
         measurements_layout.addWidget(self.absorbance_frame)
         measurements_layout.addWidget(self.transmittance_frame)
         layout.addLayout(measurements_layout)
+
+        # Spread of an averaged reading
+        self.uncertainty_label = QLabel('')
+        self.uncertainty_label.setAlignment(Qt.AlignCenter)
+        self.uncertainty_label.setStyleSheet("font-size: 14px; color: #aaaaaa;")
+        layout.addWidget(self.uncertainty_label)
+        self.concentration_label = QLabel('')
+        self.concentration_label.setAlignment(Qt.AlignCenter)
+        self.concentration_label.setStyleSheet("font-size: 18px;")
+        layout.addWidget(self.concentration_label)
+        self.calibration_label = QLabel('Not calibrated')
+        self.calibration_label.setAlignment(Qt.AlignCenter)
+        self.calibration_label.setStyleSheet("font-size: 14px; color: #aaaaaa;")
+        layout.addWidget(self.calibration_label)
         
         # Buttons
         button_layout = QHBoxLayout()
@@ -357,15 +1728,191 @@ class SpectrophotometerUI(QMainWindow):
             }
         """)
 
+        # Stream Button
+        self.stream_btn = QPushButton('Stream')
+        self.stream_btn.setCheckable(True)
+        self.stream_btn.clicked.connect(self.toggle_stream)
+        self.stream_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #9C27B0;
+                color: white;
+                border-radius: 50px;
+                padding: 20px;
+                font-size: 18px;
+                min-width: 150px;
+                min-height: 150px;
+            }
+            QPushButton:hover {
+                background-color: #7B1FA2;
+            }
+            QPushButton:checked {
+                background-color: #F44336;
+            }
+            QPushButton:disabled {
+                background-color: #666666;
+            }
+        """)
+
         button_layout.addWidget(self.calibrate_btn)
         button_layout.addWidget(self.measure_btn)
+        button_layout.addWidget(self.stream_btn)
         layout.addLayout(button_layout)
+
+        # Stream settings
+        stream_layout = QHBoxLayout()
+        rate_label = QLabel('Stream Rate:')
+        rate_label.setStyleSheet("font-size: 14px;")
+        self.rate_spin = QSpinBox()
+        self.rate_spin.setRange(1, max_stream_rate(DEFAULT_BAUDRATE))
+        self.rate_spin.setValue(DEFAULT_STREAM_RATE)
+        self.rate_spin.setSuffix(' Hz')
+        display_label = QLabel('Display:')
+        display_label.setStyleSheet("font-size: 14px;")
+        self.display_combo = QComboBox()
+        self.display_combo.addItem('Latest value', DISPLAY_LATEST)
+        self.display_combo.addItem('Window mean', DISPLAY_MEAN)
+        stream_layout.addWidget(rate_label)
+        stream_layout.addWidget(self.rate_spin)
+        stream_layout.addSpacing(20)
+        stream_layout.addWidget(display_label)
+        stream_layout.addWidget(self.display_combo)
+        stream_layout.addSpacing(20)
+        average_label = QLabel('Average:')
+        average_label.setStyleSheet("font-size: 14px;")
+        self.average_spin = QSpinBox()
+        self.average_spin.setRange(1, MAX_OVERSAMPLE)
+        self.average_spin.setSuffix(' samples')
+        self.average_spin.setToolTip("Raw samples averaged per measurement (1 = single reading)")
+        stream_layout.addWidget(average_label)
+        stream_layout.addWidget(self.average_spin)
+        stream_layout.addSpacing(20)
+        link_label = QLabel('Link:')
+        link_label.setStyleSheet("font-size: 14px;")
+        self.link_combo = QComboBox()
+        for text, mode in LINK_MODES:
+            self.link_combo.addItem(text, mode)
+        self.link_combo.setToolTip("Binary stream frames allow faster stream rates")
+        self.link_combo.currentIndexChanged.connect(self.configure_link)
+        stream_layout.addWidget(link_label)
+        stream_layout.addWidget(self.link_combo)
+        stream_layout.addStretch()
+        layout.addLayout(stream_layout)
+
+        # Queued runs
+        run_layout = QHBoxLayout()
+        samples_label = QLabel('Samples:')
+        samples_label.setStyleSheet("font-size: 14px;")
+        self.samples_field = QLineEdit()
+        self.samples_field.setPlaceholderText("Comma-separated labels, e.g. Std 1, Std 2, Unknown")
+        replicates_label = QLabel('Replicates:')
+        replicates_label.setStyleSheet("font-size: 14px;")
+        self.replicates_spin = QSpinBox()
+        self.replicates_spin.setRange(1, 100)
+        self.run_btn = QPushButton('Run Queue')
+        self.run_btn.setCheckable(True)
+        self.run_btn.clicked.connect(self.toggle_run)
+        self.run_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #2d2d2d;
+                border-radius: 5px;
+                padding: 5px 15px;
+                min-height: 30px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #3d3d3d;
+            }
+            QPushButton:checked {
+                background-color: #F44336;
+            }
+        """)
+        self.run_status = QLabel('')
+        run_layout.addWidget(samples_label)
+        run_layout.addWidget(self.samples_field, 1)
+        run_layout.addWidget(replicates_label)
+        run_layout.addWidget(self.replicates_spin)
+        run_layout.addWidget(self.run_btn)
+        run_layout.addWidget(self.run_status)
+        self.export_btn = QPushButton('Export History')
+        self.export_btn.clicked.connect(self.export_history)
+        self.export_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #2d2d2d;
+                border-radius: 5px;
+                padding: 5px 15px;
+                min-height: 30px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #3d3d3d;
+            }
+        """)
+        run_layout.addWidget(self.export_btn)
+        layout.addLayout(run_layout)
+
+        self.results_table = QTableWidget(0, 6)
+        self.results_table.setHorizontalHeaderLabels(['Time', 'Sample', 'Rep', 'Voltage (V)', 'Absorbance (A)',
+                                                      'Concentration'])
+        self.results_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.results_table.verticalHeader().setVisible(False)
+        self.results_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.results_table.setStyleSheet("""
+            QTableWidget {
+                background-color: #2d2d2d;
+                border-radius: 10px;
+            }
+        """)
+
+        # Other devices driven alongside the main one
+        self.device_panel = DevicePanel(self.available_ports, self.serial_factory, self.calibrations)
+        self.device_panel.ports_changed.connect(self.update_port_combo)
+
+        # Absorbance (or voltage/transmittance) against time
+        plot_widget = QWidget()
+        plot_layout = QVBoxLayout(plot_widget)
+        plot_layout.setContentsMargins(0, 5, 0, 0)
+        self.plot = KineticsPlot(self.samples, self.history_path)
+        self.plot_combo = QComboBox()
+        self.plot_combo.addItem('Absorbance', 'absorbance')
+        self.plot_combo.addItem('Voltage', 'voltage')
+        self.plot_combo.addItem('Transmittance', 'transmittance')
+        self.plot_combo.currentIndexChanged.connect(
+            lambda index: self.plot.set_column(self.plot_combo.itemData(index)))
+        plot_hint = QLabel('Wheel to zoom, drag to pan, double-click to follow live data')
+        plot_hint.setStyleSheet("color: #888888;")
+        plot_controls = QHBoxLayout()
+        plot_controls.addWidget(self.plot_combo)
+        plot_controls.addWidget(plot_hint)
+        plot_controls.addStretch()
+        plot_layout.addLayout(plot_controls)
+        plot_layout.addWidget(self.plot)
+
+        tabs = QTabWidget()
+        tabs.addTab(plot_widget, 'Kinetics')
+        tabs.addTab(self.results_table, 'Run Results')
+        tabs.addTab(self.device_panel, 'Devices')
+        self.curve_panel = StandardCurvePanel()
+        self.curve_panel.quantify_btn.clicked.connect(self.quantify_session)
+        self.curve_panel.curve_changed.connect(self.show_concentration)
+        self.curve_panel.curve_changed.connect(
+            lambda: self.session_summary.set_curve(self.curve_panel.curve, self.curve_panel.units))
+        tabs.addTab(self.curve_panel, 'Standard Curve')
+        self.spectra_panel = SpectraPanel()
+        self.spectra_panel.blank_requested.connect(self.acquisition.scan_blank)
+        self.spectra_panel.scan_requested.connect(self.scan_spectrum)
+        tabs.addTab(self.spectra_panel, 'Spectra')
+        tabs.currentChanged.connect(lambda index: self.device_panel.refresh_ports())
+        layout.addWidget(tabs)
+
+        # Pipeline metrics and the profiler, collapsed by default
+        self.metrics_panel = MetricsPanel()
+        layout.addWidget(self.metrics_panel)
         
         # Add left widget to splitter
         splitter.addWidget(left_widget)
         
         # Right side (chat widget)
-        self.chat_widget = ChatWidget()
+        self.chat_widget = ChatWidget(ContextBuilder(self.session_summary))
         splitter.addWidget(self.chat_widget)
         
         # Set initial splitter sizes (70% main content, 30% chat)
@@ -376,195 +1923,778 @@ class SpectrophotometerUI(QMainWindow):
         # Disable buttons initially
         self.calibrate_btn.setEnabled(False)
         self.measure_btn.setEnabled(False)
+        self.stream_btn.setEnabled(False)
+        self.run_btn.setEnabled(False)
 
     def refresh_ports(self):
+        # The list is updated when the watcher reports back
+        self.port_watcher.rescan()
+        self.update_port_combo()
+
+    def known_ports(self):
+        # Cached; never enumerates on the GUI thread
+        return self.port_watcher.ports + [port for port in self.extra_ports
+                                          if port not in self.port_watcher.ports]
+
+    def panel_ports(self):
+        # Ports held by the device panel; pyserial doesn't open ports
+        # exclusively, so a second reader would split their bytes
+        if self.device_panel is None:
+            return set()
+        return {channel.port for channel in self.device_panel.manager.channels.values()}
+
+    def update_port_combo(self):
         current_port = self.port_combo.currentText()
+        in_use = self.panel_ports()
+        ports = [port for port in self.known_ports() if port not in in_use]
+        # Keep showing the chosen port while it is unplugged
+        if self.wanted_port and self.wanted_port not in ports:
+            ports.append(self.wanted_port)
+        # Repopulating must not look like a new selection to connect_to_port
+        self.port_combo.blockSignals(True)
         self.port_combo.clear()
-        ports = [port.device for port in serial.tools.list_ports.comports()]
         self.port_combo.addItems(ports)
         
         # Try to reselect the previous port
         if current_port in ports:
             self.port_combo.setCurrentText(current_port)
+        self.port_combo.blockSignals(False)
+
+    def available_ports(self):
+        # Ports the device panel may open: everything except the main connection
+        current = self.serial_thread.port if self.serial_thread else None
+        return [port for port in self.known_ports() if port != current]
+
+    def handle_ports_changed(self, ports, added, removed):
+        self.update_port_combo()
+        if added or removed:
+            print(f"Ports changed: added {added or 'none'}, removed {removed or 'none'}")
+        if not self.wanted_port:
+            return
+        if self.serial_thread is not None and self.serial_thread.isRunning() and \
+                self.serial_thread.port in removed:
+            # Unplugged; don't wait for the reader to trip over it
+            self.connection_lost('Device unplugged')
+        if self.serial_thread is None or not self.serial_thread.isRunning():
+            port = self.find_wanted_device(added)
+            if port:
+                print(f"Device is back on {port}, reconnecting")
+                self.reconnect_backoff.reset()
+                self.reconnect_timer.stop()
+                self.open_port(port)
+
+    def find_wanted_device(self, ports):
+        # The chosen port, or the same USB device under another name, unless
+        # the device panel has it
+        ports = [port for port in ports if port not in self.panel_ports()]
+        if self.wanted_port in ports:
+            return self.wanted_port
+        if self.device_key:
+            for port in ports:
+                if device_key(self.port_watcher.info(port)) == self.device_key:
+                    return port
+        return None
 
     def connect_to_port(self, port):
+        # The user picked a port (or none)
+        self.wanted_port = port or None
+        self.reconnect_backoff.reset()
+        self.reconnect_timer.stop()
+        self.open_port(port)
+
+    def reconnect(self):
+        if not self.wanted_port:
+            return
+        port = self.find_wanted_device(self.known_ports())
+        if port is None:
+            # Not plugged in; the watcher reconnects as soon as it appears
+            self.set_status('Waiting for device...')
+            self.schedule_reconnect()
+            return
+        print(f"Reconnecting to {port} (attempt {self.reconnect_backoff.attempts})")
+        self.open_port(port)
+
+    def schedule_reconnect(self):
+        if not self.wanted_port or self.reconnect_timer.isActive():
+            return
+        delay = self.reconnect_backoff.next_delay()
+        self.reconnect_timer.start(int(delay * 1000))
+
+    def connection_lost(self, reason):
+        print(f"Connection to {self.wanted_port} lost: {reason}")
+        if self.serial_thread:
+            self.serial_thread.stop()
+            self.serial_thread.wait()
+        self.acquisition.reset()
+        self.update_buttons()
+        self.set_status(f'{reason} - reconnecting...')
+        self.schedule_reconnect()
+
+    def set_status(self, text, connected=False):
+        self.status_label.setText(text)
+        color, background = ('#4CAF50', 'rgba(76, 175, 80, 0.1)') if connected \
+            else ('#F44336', 'rgba(244, 67, 54, 0.1)')
+        self.status_label.setStyleSheet(f"""
+            QLabel {{
+                color: {color};
+                font-size: 14px;
+                font-weight: bold;
+                padding: 5px 10px;
+                border-radius: 10px;
+                background-color: {background};
+            }}
+        """)
+
+    def handle_port_opened(self):
+        if self.sender() is not self.serial_thread:
+            return
+        self.reconnect_backoff.reset()
+        self.set_status('Connected', connected=True)
+
+    def open_port(self, port):
         # Stop existing thread if any
         if self.serial_thread:
             self.serial_thread.stop()
             self.serial_thread.wait()
+        self.acquisition.reset()
+        self.oversample = None
+        # Opening the port resets the board to its default link settings
+        self.set_link(DEFAULT_BAUDRATE, False)
         
         if port:
             try:
-                self.serial_thread = SerialThread(port)
-                self.serial_thread.data_received.connect(self.handle_serial_data)
+                self.serial_thread = SerialThread(port, serial_factory=self.serial_factory)
+                self.serial_thread.lines_received.connect(self.handle_serial_batch)
                 self.serial_thread.error_occurred.connect(self.handle_serial_error)
+                self.serial_thread.opened.connect(self.handle_port_opened)
                 self.serial_thread.start()
                 
                 # Enable buttons
-                self.calibrate_btn.setEnabled(True)
-                self.measure_btn.setEnabled(True)
+                self.update_buttons()
                 
-                self.status_label.setText('Connected')
-                self.status_label.setStyleSheet("color: #4CAF50;")  # Green
+                self.set_status('Connecting...')
+                self.restore_calibration(port)
             except Exception as e:
                 self.handle_serial_error(str(e))
 
-    def update_connection_status(self):
-        if not self.serial_thread or not self.serial_thread.isRunning():
-            self.status_label.setText('Not Connected')
-            self.status_label.setStyleSheet("""
-                QLabel {
-                    color: #F44336;
-                    font-size: 14px;
-                    font-weight: bold;
-                    padding: 5px 10px;
-                    border-radius: 10px;
-                    background-color: rgba(244, 67, 54, 0.1);
-                }
-            """)
-            self.calibrate_btn.setEnabled(False)
-            self.measure_btn.setEnabled(False)
+    def restore_calibration(self, port):
+        # Reuse this device's stored calibration unless it has expired
+        self.initial_voltage = None
+        self.dark_voltage = DEFAULT_DARK_VOLTAGE
+        self.restored_calibration = None
+        self.checking_dark = False
+        self.session_summary.set_calibration(None)
+        self.device_key = device_key(self.port_watcher.info(port))
+        calibration = self.calibrations.get(self.device_key)
+        if calibration is None:
+            self.calibration_label.setText('Not calibrated')
+            return
+        if self.calibrations.status(calibration) == EXPIRED:
+            print(f"Stored calibration for {self.device_key} has expired")
+            self.calibration_label.setText(
+                f"Calibration from {self.format_calibration_time(calibration)} has expired - please recalibrate")
+            return
+        self.initial_voltage = calibration.initial_voltage
+        self.dark_voltage = calibration.dark_voltage
+        self.session_summary.set_calibration(*calibration[:3])
+        self.voltage_value.setText(f"{calibration.initial_voltage:.3f} V")
+        self.restored_calibration = calibration
+        self.calibration_label.setText(
+            f"Using calibration from {self.format_calibration_time(calibration)} (checking dark signal...)")
+        # Opening the port resets most boards; the check goes out when the
+        # banner arrives, or after READY_TIMEOUT for boards that don't reset
+        QTimer.singleShot(int(READY_TIMEOUT * 1000), self.check_calibration)
+
+    def check_calibration(self):
+        if self.restored_calibration is None or self.checking_dark or not self.serial_thread:
+            return
+        self.checking_dark = True
+        self.acquisition.measure_dark()
+
+    def finish_calibration_check(self, dark_voltage):
+        calibration, self.restored_calibration = self.restored_calibration, None
+        self.checking_dark = False
+        if calibration is None:
+            return
+        when = self.format_calibration_time(calibration)
+        if dark_voltage is not None and self.calibrations.status(calibration, dark_voltage) == DRIFTED:
+            print(f"Dark voltage drifted from {calibration.dark_voltage:.3f} V to {dark_voltage:.3f} V")
+            self.initial_voltage = None
+            self.dark_voltage = dark_voltage
+            self.session_summary.set_calibration(None)
+            self.calibration_label.setText(f"Calibration from {when} has drifted - please recalibrate")
+        elif dark_voltage is None:
+            # Firmware without the 'dark' command; trust the stored values
+            self.calibration_label.setText(f"Using calibration from {when} (not verified)")
+        else:
+            self.calibration_label.setText(f"Using calibration from {when}")
+
+    def format_calibration_time(self, calibration):
+        return time.strftime('%b %d %H:%M', time.localtime(calibration.timestamp))
+
+    def update_buttons(self):
+        connected = self.serial_thread is not None and self.serial_thread.isRunning()
+        state = self.acquisition.state
+        self.calibrate_btn.setEnabled(connected and state == IDLE)
+        # Reads can be queued while another read is running
+        self.measure_btn.setEnabled(connected and state in (IDLE, MEASURING))
+        self.stream_btn.setEnabled(connected and state in (IDLE, STREAMING))
+        self.run_btn.setEnabled(connected and state in (IDLE, RUNNING))
+        self.link_combo.setEnabled(connected and state == IDLE)
+        # Repeated scans pass through IDLE between scans
+        self.spectra_panel.update_buttons(connected, state == IDLE or
+                                          (self.spectra_panel.repeating and state == MEASURING))
+        queued = len(self.acquisition.queue)
+        self.measure_btn.setText(f'Measure\n({queued} queued)' if queued else 'Measure')
+
+    def handle_serial_batch(self, lines):
+        # Lines arrive from the serial thread in batches; acknowledge each one
+        # so the reader knows the GUI is keeping up.
+        try:
+            with Timer(GUI_BATCH_TIME):
+                if TRACE_LINES:
+                    for line in lines:
+                        # Decoded binary frames aside
+                        if isinstance(line, str):
+                            print(f"Received raw data: '{line}'")
+                self.handle_records(parse_lines(lines))
+        finally:
+            thread = self.sender()
+            if thread is not None:
+                thread.batch_consumed()
 
     def handle_serial_data(self, line):
-        
-        #Process incoming data from the serial port.
-        #Updates voltage, absorbance, and transmittance displays.
-        # Print raw data for debugging
-        print(f"Received raw data: '{line}'")
-        
-        # Skip empty lines or pure whitespace
-        if not line or line.isspace():
+        # Single-line entry point for the line-at-a-time data_received signal
+        if TRACE_LINES:
+            print(f"Received raw data: '{line}'")
+        self.handle_records(parse_lines([line]))
+
+    def handle_records(self, records):
+        # Process parsed records from the serial port.
+        # Consecutive sample readings are computed together in one batch; any
+        # other record ends the run, so a new blank only applies to the
+        # samples that follow it.
+        samples = []
+        stream = []
+        raw = []
+        for record in records:
+            if isinstance(record, BaudRate):
+                # Switch before the reply releases the next queued command,
+                # which the device already expects at the new speed
+                self.set_link(int(record.rate), self.link_binary)
+            elif isinstance(record, BinaryMode):
+                self.set_link(self.link_baudrate, bool(record.enabled))
+            if not self.acquisition.handle_record(record):
+                print(f"Ignoring late reply to a timed-out or cancelled command: {record}")
+                if isinstance(record, RawDone):
+                    # The raw samples so far belonged to the timed-out command
+                    raw = []
+                    self.oversample = None
+                elif isinstance(record, ScanDone):
+                    self.scan_collector.clear()
+                continue
+            if isinstance(record, SampleVoltage):
+                samples.append(record.voltage)
+                continue
+            if isinstance(record, (StreamSample, StreamBlock)):
+                stream.append(record)
+                continue
+            if isinstance(record, RawSample):
+                raw.append(record.counts)
+                continue
+            if isinstance(record, (ScanPoint, ScanBlankPoint)):
+                self.scan_collector.add(record)
+                continue
+            if samples:
+                self.show_samples(samples)
+                samples = []
+            if stream:
+                self.record_stream(stream)
+                stream = []
+            if raw:
+                self.add_raw_samples(raw)
+                raw = []
+
+            if isinstance(record, RawDone):
+                self.finish_oversample()
+            elif isinstance(record, ScanDone):
+                self.finish_scan()
+            elif isinstance(record, BlankVoltage):
+                self.initial_voltage = record.voltage  # This is V0
+                self.session_summary.set_calibration(record.voltage, self.dark_voltage)
+                self.voltage_value.setText(f"{record.voltage:.3f} V")
+                # Since this is calibration, set all values to baseline
+                self.absorbance_value.setText("0.000 A")
+                self.transmittance_value.setText("100.0 %")
+                calibration = self.calibrations.put(self.device_key, record.voltage, self.dark_voltage,
+                                                    self.serial_thread.port if self.serial_thread else None)
+                when = time.strftime('%b %d %H:%M')
+                self.calibration_label.setText(f"Calibrated {when}" if calibration is None
+                                               else f"Calibrated {when} (saved for this device)")
+            elif isinstance(record, DarkVoltage):
+                print(f"Device reported dark voltage: {record.voltage:.3f} V")
+                if self.checking_dark:
+                    self.finish_calibration_check(record.voltage)
+                else:
+                    # Measured by the sketch with the LED off during 'calibrate'
+                    self.dark_voltage = record.voltage
+            elif isinstance(record, Message) and record.text.startswith(READY_BANNER):
+                self.check_calibration()
+            elif isinstance(record, InvalidLine):
+                print(f"Invalid data received: {record.text}")
+        if samples:
+            self.show_samples(samples)
+        if stream:
+            self.record_stream(stream)
+        if raw:
+            self.add_raw_samples(raw)
+
+    def add_raw_samples(self, counts):
+        # Raw ADC counts of an 'oversample' burst; only the running mean is
+        # shown until the burst is complete
+        if self.oversample is None:
+            self.oversample = Oversample(self.average_spin.value())
+        self.oversample.add_array(counts_to_voltage(counts))
+        self.voltage_value.setText(f"{self.oversample.running.mean:.3f} V")
+        self.uncertainty_label.setText(f"Averaging... {len(self.oversample)} samples")
+
+    def finish_oversample(self):
+        oversample, self.oversample = self.oversample, None
+        if oversample is None:
+            return
+        result = oversample.result()
+        if not result.count:
+            print("Warning: No valid raw samples in the averaged reading")
+            self.uncertainty_label.setText('')
+            return
+        self.show_samples([result.mean])
+        # Standard error of the mean, carried through the absorbance formula
+        text = f"± {result.sem:.4f} V"
+        if self.initial_voltage is not None and result.count > 1:
+            low, high = absorbance_batch([result.mean - result.sem, result.mean + result.sem],
+                                         self.initial_voltage, self.dark_voltage)
+            text += f"   ± {abs(high - low) / 2:.4f} A"
+        text += f"   (mean of {result.count}"
+        if result.rejected:
+            text += f", {result.rejected} outliers rejected"
+        self.uncertainty_label.setText(text + ")")
+        if self.initial_voltage is not None and result.count > 1:
+            self.curve_panel.set_latest(self.latest_absorbance, abs(high - low) / 2)
+
+    def scan_spectrum(self):
+        if self.serial_thread:
+            self.acquisition.scan()
+
+    def finish_scan(self):
+        blank = self.scan_collector.blank
+        scan = self.scan_collector.finish()
+        if scan is None:
+            return
+        if blank:
+            self.spectra_panel.set_blank(scan)
+        else:
+            self.spectra_panel.add_scan(time.time(), scan)
+        # Back-to-back scans; anything else the user queued goes first
+        if self.spectra_panel.repeating and self.serial_thread and not self.acquisition.busy:
+            self.acquisition.scan()
+
+    def show_samples(self, voltages):
+        # Updates voltage, absorbance, and transmittance displays with the
+        # latest of a run of sample voltages (V).
+        self.uncertainty_label.setText('')
+        self.voltage_value.setText(f"{voltages[-1]:.3f} V")
+        absorbances, transmittances = self.compute_samples(voltages)
+        self.samples.append(np.full(len(voltages), time.time()), voltages, absorbances, transmittances)
+        # Readings that belong to a queued run are stored by handle_run_result
+        if self.acquisition.state != RUNNING:
+            self.session_summary.add(time.time(), voltages, absorbances)
+            self.measurement_store().append(time.time(), voltages, self.initial_voltage,
+                                            self.dark_voltage, absorbances, transmittances)
+        if self.initial_voltage is None:
+            return
+        self.absorbance_value.setText(f"{absorbances[-1]:.3f} A")
+        self.transmittance_value.setText(f"{transmittances[-1]:.1f} %")
+        self.latest_absorbance = float(absorbances[-1])
+        self.curve_panel.set_latest(self.latest_absorbance)
+        self.show_concentration()
+
+    def show_concentration(self):
+        # Latest absorbance through the standard curve, if there is one
+        concentrations = None
+        if self.latest_absorbance is not None:
+            concentrations = self.curve_panel.concentration([self.latest_absorbance])
+        if concentrations is None:
+            self.concentration_label.setText('')
+        elif math.isnan(concentrations[0]):
+            self.concentration_label.setText('Concentration: outside the standards')
+        else:
+            self.concentration_label.setText(f"Concentration: {concentrations[0]:.4g} {self.curve_panel.units}")
+
+    def quantify_session(self):
+        # Converts every stored absorbance of this session in one call and
+        # exports the records with their concentrations
+        if self.store is None:
+            QMessageBox.information(self, "Quantify Session", "No measurements recorded yet.")
+            return
+        if not self.curve_panel.curve.ready:
+            QMessageBox.information(self, "Quantify Session", "Fit a standard curve first.")
+            return
+        path, selected = QFileDialog.getSaveFileName(self, "Quantify Session", "",
+                                                     "CSV (*.csv);;Parquet (*.parquet)")
+        if not path:
             return
-            
         try:
-            # Handle initial voltage (calibration)
-            if "Initial Voltage (Blank):" in line:
-                voltage_str = line.split(":")[-1].strip()
-                try:
-                    voltage = float(voltage_str)
-                    self.initial_voltage = voltage  # This is V0
-                    self.voltage_value.setText(f"{voltage:.3f} V")
-                    # Since this is calibration, set all values to baseline
-                    self.absorbance_value.setText("0.000 A")
-                    self.transmittance_value.setText("100.0 %")
-                except ValueError as e:
-                    print(f"Error parsing initial voltage: {e}")
-                return
-                
-            # Handle regular voltage reading
-            elif "Voltage:" in line:
-                voltage_str = line.split(":")[-1].strip()
-                try:
-                    voltage = float(voltage_str)  # This is V
-                    self.voltage_value.setText(f"{voltage:.3f} V")
-                    
-                    if self.initial_voltage is not None:
-                        # Common values used in calculations
-                        V0 = self.initial_voltage
-                        V = voltage
-                        Vd = 0.110  # dark signal
-                        
-                        try:
-                            numerator = V0 - Vd
-                            denominator = V - Vd
-                            
-                            if denominator <= 0 or numerator <= 0:
-                                absorbance = 2.00
-                            else:
-                                # Calculate absorbance: A = log_10((V0-Vd)/(V-Vd))
-                                ratio = numerator / denominator - 0.5
-                                if ratio > 100:  # Safety check for very high ratios
-                                    absorbance = 2.00
-
-                                else:
-                                    absorbance = math.log10(ratio)
-                                    if math.isnan(absorbance) or math.isinf(absorbance):
-                                        absorbance = 2.00
-                        except (ValueError, ZeroDivisionError):
-                            absorbance = 2.0
-                                    
-                        self.absorbance_value.setText(f"{absorbance:.3f} A")
-                        
-                        # Calculate transmittance
-                        if absorbance >= 2.00:
-                            transmittance = 0.0
-                        else:
-                            transmittance = 100 * (10 ** -absorbance)
-                        
-                        self.transmittance_value.setText(f"{transmittance:.1f} %")
-                        
-                except ValueError as e:
-                    print(f"Error parsing voltage: {e}")
-                    
+            self.store.sync()
+            records = open_history(self.store.path)
+            start = time.perf_counter()
+            concentrations = quantify_history(records, self.curve_panel.curve)
+            print(f"Quantified {len(records)} records in {(time.perf_counter() - start) * 1000:.1f} ms")
+            units = self.curve_panel.units
+            extra = [(f"concentration_{units}" if units else 'concentration', concentrations, '%.6g')]
+            if path.endswith('.parquet') or selected.startswith('Parquet'):
+                export_parquet(records, path, extra_columns=extra)
+            else:
+                export_csv(records, path, extra_columns=extra)
         except Exception as e:
-            print(f"Error processing data: {e}")
-            print(f"Invalid data received: {line}")
+            QMessageBox.warning(self, "Quantify Error", str(e))
+
+    def compute_samples(self, voltages):
+        # Absorbance and transmittance for a block of voltages, NaN before calibration
+        return compute_samples(voltages, self.initial_voltage, self.dark_voltage)
+
+    def record_stream(self, samples):
+        # Store every streamed sample; the labels are refreshed separately by
+        # refresh_stream_display at display rate.
+        if isinstance(samples[0], StreamBlock):
+            # Binary frames arrive already decoded into arrays
+            times = np.concatenate([sample.t_ms for sample in samples]) / 1000.0
+            voltages = np.concatenate([sample.voltage for sample in samples])
+        else:
+            block = np.array(samples, dtype=np.float64)
+            times = block[:, 0] / 1000.0  # device millis -> seconds
+            voltages = block[:, 1]
+        absorbances, transmittances = self.compute_samples(voltages)
+        # Anchor the device clock to wall time on the first batch of a stream
+        if self.stream_clock_offset is None:
+            self.stream_clock_offset = time.time() - times[-1]
+        times = times + self.stream_clock_offset
+        self.stream_count += len(voltages)
+        STREAM_SAMPLES.inc(len(voltages))
+        self.samples.append(times, voltages, absorbances, transmittances)
+        self.session_summary.add(times, voltages, absorbances)
+        self.stream_display.add(voltages, absorbances, transmittances)
+        self.measurement_store().append(times, voltages, self.initial_voltage, self.dark_voltage,
+                                        absorbances, transmittances)
+
+    def refresh_stream_display(self):
+        values = self.stream_display.take()
+        if values is None:
+            return
+        voltage, absorbance, transmittance = values
+        self.voltage_value.setText(f"{voltage:.3f} V")
+        if self.initial_voltage is not None:
+            self.absorbance_value.setText(f"{absorbance:.3f} A")
+            self.transmittance_value.setText(f"{transmittance:.1f} %")
 
     def handle_serial_error(self, error_msg):
-        self.status_label.setText('Error')
-        self.status_label.setStyleSheet("""
-            QLabel {
-                color: #F44336;
-                font-size: 14px;
-                font-weight: bold;
-                padding: 5px 10px;
-                border-radius: 10px;
-                background-color: rgba(244, 67, 54, 0.1);
-            }
-        """)
-        QMessageBox.warning(self, "Serial Error", str(error_msg))
-        self.calibrate_btn.setEnabled(False)
-        self.measure_btn.setEnabled(False)
+        thread = self.sender()
+        if isinstance(thread, SerialThread) and (thread is not self.serial_thread or not thread.running):
+            return  # from a connection that was already closed or replaced
+        if self.wanted_port and self.reconnect_backoff.attempts == 0 and \
+                not (thread is not None and thread.serial is not None):
+            # The port the user just picked can't be opened
+            QMessageBox.warning(self, "Serial Error", str(error_msg))
+        self.connection_lost(f'Error: {error_msg}')
+
+    def send_command(self, payload):
+        if self.serial_thread:
+            self.serial_thread.write(payload)
+
+    def on_acquisition_state(self, state):
+        if state == STREAMING:
+            self.begin_stream()
+        elif self.streaming:
+            self.end_stream()
+        if state != RUNNING and self.run_worker is not None:
+            self.teardown_run()
+        remaining = self.acquisition.time_remaining()
+        if remaining is None:
+            self.command_timer.stop()
+        else:
+            self.command_timer.start(int(remaining * 1000) + 1)
+        self.update_buttons()
+
+    def check_command_timeout(self):
+        if not self.acquisition.check_timeout() and self.acquisition.time_remaining() is not None:
+            self.command_timer.start(int(self.acquisition.time_remaining() * 1000) + 1)
+
+    def on_command_timeout(self, command):
+        if command is CALIBRATE:
+            print("Warning: No initial voltage was set during calibration")
+        else:
+            print(f"Warning: No reply to '{command.name}' within {command.timeout:.0f} s")
+        if command.name == 'dark' and self.checking_dark:
+            self.finish_calibration_check(None)
+        if command.name in ('scan', 'scan blank'):
+            # Firmware without scan mode, or a scan cut short
+            self.scan_collector.clear()
+            self.spectra_panel.repeat_btn.setChecked(False)
+        if command.name in ('baud', 'binary'):
+            # Older firmware: the link keeps its current settings
+            self.set_link(self.link_baudrate, self.link_binary)
+
+    def configure_link(self, index):
+        baudrate, binary = self.link_combo.itemData(index)
+        if (baudrate, binary) == (self.link_baudrate, self.link_binary):
+            return
+        if self.serial_thread:
+            print(f"Switching link to {self.link_combo.itemText(index)}...")
+            self.acquisition.configure_link(baudrate, binary)
+
+    def set_link(self, baudrate, binary):
+        if baudrate != self.link_baudrate and self.serial_thread:
+            self.serial_thread.set_baudrate(baudrate)
+        if binary != self.link_binary and self.serial_thread:
+            self.serial_thread.set_binary(binary)
+        self.link_baudrate = baudrate
+        self.link_binary = binary
+        # As fast as the link carries; a faster rate would stall the sketch on TX
+        self.rate_spin.setMaximum(max_stream_rate(baudrate, binary))
+        # Show what the device actually uses
+        for index in range(self.link_combo.count()):
+            if self.link_combo.itemData(index) == (baudrate, binary):
+                self.link_combo.blockSignals(True)
+                self.link_combo.setCurrentIndex(index)
+                self.link_combo.blockSignals(False)
+                break
 
     def calibrate(self):
         if self.serial_thread:
-            self.calibrating = True
-            self.calibrate_btn.setEnabled(False)
-            self.measure_btn.setEnabled(False)
-            
             # Reset values
             self.initial_voltage = None
+            self.restored_calibration = None
+            self.session_summary.set_calibration(None)
             self.voltage_value.setText("0.000 V")
             self.absorbance_value.setText("0.000 A")
             self.transmittance_value.setText("100.0 %")
             
             # Send calibrate command
             print("Starting calibration...")
-            self.serial_thread.write(b'calibrate\n')
-            QTimer.singleShot(12000, self.finish_calibration)
-
-    def finish_calibration(self):
-        self.calibrating = False
-        if self.serial_thread and self.serial_thread.isRunning():
-            self.calibrate_btn.setEnabled(True)
-            self.measure_btn.setEnabled(True)
-            if self.initial_voltage is None:
-                print("Warning: No initial voltage was set during calibration")
+            self.acquisition.calibrate()
 
     def measure(self):
         if self.serial_thread:
-            self.calibrate_btn.setEnabled(False)
-            self.measure_btn.setEnabled(False)
-            self.serial_thread.write(b'read\n')
-            QTimer.singleShot(7000, self.enable_buttons)
+            count = self.average_spin.value()
+            if count > 1:
+                self.acquisition.oversample(count)
+            else:
+                self.acquisition.read()
+            self.update_buttons()
 
-    def enable_buttons(self):
-        if self.serial_thread and self.serial_thread.isRunning():
-            self.calibrate_btn.setEnabled(True)
-            self.measure_btn.setEnabled(True)
+    def toggle_stream(self, checked):
+        if not self.serial_thread:
+            self.stream_btn.setChecked(False)
+            return
+        if checked:
+            rate = self.rate_spin.value()
+            print(f"Starting stream at {rate} Hz...")
+            self.acquisition.start_stream(rate)
+        else:
+            self.acquisition.stop_stream()
+
+    def begin_stream(self):
+        self.streaming = True
+        self.stream_count = 0
+        self.stream_clock_offset = None
+        self.stream_display = DisplayDecimator(self.display_combo.currentData())
+        self.stream_btn.setChecked(True)
+        self.stream_btn.setText('Stop')
+        self.rate_spin.setEnabled(False)
+        self.display_combo.setEnabled(False)
+        self.display_timer.start(1000 // DISPLAY_REFRESH_HZ)
+
+    def end_stream(self):
+        if not self.streaming:
+            return
+        self.streaming = False
+        self.display_timer.stop()
+        self.refresh_stream_display()
+        self.stream_btn.setChecked(False)
+        self.stream_btn.setText('Stream')
+        self.rate_spin.setEnabled(True)
+        self.display_combo.setEnabled(True)
+        print(f"Stream stopped after {self.stream_count} samples")
+
+    def toggle_run(self, checked):
+        if not self.serial_thread:
+            self.run_btn.setChecked(False)
+            return
+        if checked:
+            self.start_run()
+        elif self.run_worker is not None:
+            self.run_status.setText('Cancelling...')
+            self.run_worker.cancel_requested.emit()
+
+    def start_run(self):
+        labels = [label.strip() for label in self.samples_field.text().split(',') if label.strip()]
+        entries = build_run(labels or ['Sample'], self.replicates_spin.value())
+        self.run_results = []
+        self.results_table.setRowCount(0)
+
+        self.run_thread = QThread()
+        self.run_worker = RunWorker(entries, self.serial_thread)
+        self.run_worker.moveToThread(self.run_thread)
+        self.run_thread.started.connect(self.run_worker.start)
+        self.serial_thread.lines_received.connect(self.run_worker.handle_lines)
+        self.run_worker.result_ready.connect(self.handle_run_result)
+        self.run_worker.finished.connect(self.finish_run)
+
+        self.samples_field.setEnabled(False)
+        self.replicates_spin.setEnabled(False)
+        self.run_btn.setText('Cancel Run')
+        self.run_status.setText(f'0/{len(entries)}')
+        print(f"Starting run of {len(entries)} samples...")
+        self.acquisition.begin_run(self.run_worker.scheduler.late)
+        self.run_thread.start()
+
+    def finish_run(self):
+        # Back to idle; on_acquisition_state tears the worker thread down.
+        # The worker ignores lines once finished, so its late replies can move.
+        if self.run_worker is not None:
+            self.acquisition.end_run(self.run_worker.scheduler.late)
+
+    def handle_run_result(self, result):
+        self.run_results.append(result)
+        concentration = '—'
+        if math.isnan(result.voltage):
+            voltage, value = 'timeout', '—'
+        else:
+            absorbances, transmittances = self.compute_samples([result.voltage])
+            self.measurement_store().append(result.timestamp, result.voltage, self.initial_voltage,
+                                            self.dark_voltage, absorbances, transmittances,
+                                            sample_id=result.index + 1)
+            self.session_summary.add(result.timestamp, [result.voltage], absorbances)
+            self.session_summary.add_result(result.label, float(absorbances[0]))
+            voltage = f"{result.voltage:.3f}"
+            value = '—' if self.initial_voltage is None else f"{absorbances[0]:.3f}"
+            if self.initial_voltage is not None:
+                self.latest_absorbance = float(absorbances[0])
+                self.curve_panel.set_latest(self.latest_absorbance)
+                concentrations = self.curve_panel.concentration(absorbances)
+                if concentrations is not None and not math.isnan(concentrations[0]):
+                    concentration = f"{concentrations[0]:.4g} {self.curve_panel.units}"
+        row = self.results_table.rowCount()
+        self.results_table.insertRow(row)
+        cells = [time.strftime('%H:%M:%S', time.localtime(result.timestamp)), result.label,
+                 str(result.replicate), voltage, value, concentration]
+        for column, text in enumerate(cells):
+            self.results_table.setItem(row, column, QTableWidgetItem(text))
+        self.results_table.scrollToBottom()
+        if self.run_worker is not None:
+            self.run_status.setText(f'{len(self.run_results)}/{self.run_worker.scheduler.total}')
+
+    def teardown_run(self):
+        worker, thread = self.run_worker, self.run_thread
+        self.run_worker = None
+        self.run_thread = None
+        if self.serial_thread:
+            try:
+                self.serial_thread.lines_received.disconnect(worker.handle_lines)
+            except (RuntimeError, TypeError):
+                pass
+        thread.quit()
+        thread.wait()
+        self.samples_field.setEnabled(True)
+        self.replicates_spin.setEnabled(True)
+        self.run_btn.setChecked(False)
+        self.run_btn.setText('Run Queue')
+        self.run_status.setText(f'{len(self.run_results)} done')
+        print(f"Run finished with {len(self.run_results)} results")
+
+    def measurement_store(self):
+        # The session file is created on the first reading, not at startup
+        if self.store is None:
+            self.store = MeasurementStore(new_session_path())
+            print(f"Recording measurements to {self.store.path}")
+        return self.store
+
+    def history_path(self):
+        return self.store.path if self.store is not None else None
+
+    def sync_store(self):
+        if self.store is not None:
+            self.store.sync_if_due()
+
+    def export_history(self):
+        if self.store is None:
+            QMessageBox.information(self, "Export History", "No measurements recorded yet.")
+            return
+        path, selected = QFileDialog.getSaveFileName(self, "Export History", "",
+                                                     "CSV (*.csv);;Parquet (*.parquet)")
+        if not path:
+            return
+        try:
+            self.store.sync()
+            records = open_history(self.store.path)
+            if path.endswith('.parquet') or selected.startswith('Parquet'):
+                export_parquet(records, path)
+            else:
+                export_csv(records, path)
+        except Exception as e:
+            QMessageBox.warning(self, "Export Error", str(e))
 
     def closeEvent(self, event):
+        self.metrics_panel.shutdown()
+        self.reconnect_timer.stop()
+        self.port_watcher.stop()
+        self.acquisition.stop_stream()
+        if self.run_worker is not None:
+            self.teardown_run()
         if self.serial_thread:
             self.serial_thread.stop()
             self.serial_thread.wait()
+        if self.store is not None:
+            self.store.close()
+        self.device_panel.shutdown()
+        self.chat_widget.shutdown()
         event.accept()
 
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="IntelliSpec spectrophotometer UI")
+    parser.add_argument('--simulate', action='store_true',
+                        help="start a virtual device on a pseudo-terminal and list it as a port")
+    parser.add_argument('--sim-time-scale', type=float, default=1.0,
+                        help="speed up the virtual device's delays (e.g. 0.1)")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="sample stacks for the whole session and write them here (collapsed format)")
+    args, qt_args = parser.parse_known_args()
+
+    profiler = None
+    if args.profile:
+        profiler = SamplingProfiler()
+        profiler.start()
+
+    simulator = None
+    extra_ports = []
+    if args.simulate:
+        from intellispec.simulator import VirtualSpectrophotometer
+        simulator = VirtualSpectrophotometer(time_scale=args.sim_time_scale)
+        extra_ports.append(simulator.start())
+        print(f"Virtual spectrophotometer on {extra_ports[0]}")
+
+    app = QApplication(sys.argv[:1] + qt_args)
+    import qdarktheme
     qdarktheme.setup_theme("dark")
-    window = SpectrophotometerUI()
+    window = SpectrophotometerUI(extra_ports)
     window.show()
-    sys.exit(app.exec())
+    status = app.exec()
+    if simulator is not None:
+        simulator.stop()
+    if profiler is not None:
+        profiler.stop()
+        profiler.write_collapsed(args.profile)
+        print(profiler.report())
+    sys.exit(status)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
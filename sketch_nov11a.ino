@@ -1,19 +1,62 @@
 const int ledPin = 13;      // Pin connected to the LED
 const int sensorPin = A0;   // Sensor (photodiode) connected to analog pin A0
 float iVoltage = 0;     // Voltage reading with the blank (no sample)
-float darkVoltage = 0.02;      // Voltage reading in complete darkness
+float darkVoltage = 0.02;      // Voltage reading in complete darkness, measured by 'calibrate' and 'dark'
+const int darkReadings = 16;      // readings averaged for the dark voltage
+const int darkSettleTime = 200;   // ms for the LED and photodiode to settle
 float voltage = 0;    // Voltage reading with the sample
 float absorbance = 0;       // Calculated absorbance
 float enters = 0;
 float passes = 0;
+bool streaming = false;           // Continuous sampling mode ('stream <hz>')
+unsigned long streamInterval = 0; // Microseconds between streamed samples
+unsigned long lastSample = 0;
+const long maxStreamRate = 1000;  // Hz
+const long maxOversample = 1000;  // raw samples per 'oversample <k>'
+
+// Binary stream frames ('binary 1'):
+//   A5 5A | type | seq | length | payload | CRC-16 (little-endian)
+// CRC-CCITT (0x1021, init 0xFFFF) over type, seq, length and payload.
+// Stream payload: micros() of the first and last sample, then raw ADC counts.
+const long maxBinaryStreamRate = 4000;  // Hz
+const byte frameStream = 0x01;
+const byte maxFrameSamples = 16;
+const unsigned long maxFrameAge = 20000;  // us before a partial frame is sent
+bool binaryMode = false;
+byte frameSeq = 0;
+uint16_t frameCounts[maxFrameSamples];
+byte frameFill = 0;
+unsigned long frameFirst = 0;
+unsigned long frameLast = 0;
+long baudRate = 9600;
+const long baudRates[] = {9600, 19200, 38400, 57600, 115200, 230400, 250000, 500000, 1000000};
+
+// Spectral scan ('scan blank', 'scan'): one LED per wavelength channel.
+// Multi-LED builds list every LED's pin and peak wavelength in nm, e.g.
+// {13, 12, 11, 10} and {470, 525, 590, 630}; the single-LED build scans
+// just the LED on pin 13 (wavelength 0 = not specified).
+const int scanPins[] = {ledPin};
+const int scanWavelengths[] = {0};
+const int scanChannels = sizeof(scanPins) / sizeof(scanPins[0]);
+const int scanReadings = 8;       // readings averaged per channel
+const int scanSettleTime = 20;    // ms after switching an LED
 
 void setup() {
+  for (int i = 0; i < scanChannels; i++) {
+    pinMode(scanPins[i], OUTPUT);
+    digitalWrite(scanPins[i], LOW);
+  }
   pinMode(ledPin, OUTPUT);    // Set the LED pin as output
   digitalWrite(ledPin, HIGH); // Turn the LED on
 
-  Serial.begin(9600);         // Start serial communication
+  Serial.begin(baudRate);     // Start serial communication
   Serial.println("Spectrophotometer Ready");
   Serial.println("Type 'calibrate' to calibrate with a blank or 'read' to measure a sample.");
+  Serial.println("Type 'stream <hz>' to sample continuously and 'stop' to end streaming.");
+  Serial.println("Type 'oversample <k>' to take k raw readings of a sample.");
+  Serial.println("Type 'dark' to measure the dark signal with the LED off.");
+  Serial.println("Type 'baud <rate>' to change the link speed and 'binary 1' for binary stream frames.");
+  Serial.println("Type 'scan blank' and then 'scan' for a spectrum over every LED.");
 }
 
 void loop() {
@@ -25,16 +68,88 @@ void loop() {
       calibrate();
     } else if (command == "read") {
       readSample();
+    } else if (command == "dark") {
+      measureDark();
+    } else if (command == "scan blank") {
+      scan(true);
+    } else if (command == "scan") {
+      scan(false);
+    } else if (command.startsWith("oversample")) {
+      readRawSamples(command.substring(10).toInt());
+    } else if (command.startsWith("stream")) {
+      startStream(command.substring(6).toInt());
+    } else if (command == "stop") {
+      streaming = false;
+      sendStreamFrame();
+      Serial.println("Stream stopped.");
+    } else if (command.startsWith("baud")) {
+      setBaudRate(command.substring(4).toInt());
+    } else if (command.startsWith("binary")) {
+      sendStreamFrame();
+      binaryMode = command.substring(6).toInt() != 0;
+      Serial.print("Binary: ");
+      Serial.println(binaryMode ? 1 : 0);
     } else {
       Serial.println("Invalid command. Type 'calibrate' to calibrate or 'read' to measure a sample.");
     }
   }
+
+  if (streaming) {
+    unsigned long now = micros();
+    if (now - lastSample >= streamInterval) {
+      lastSample += streamInterval;
+      // Don't burst to catch up when the serial link can't keep up with the rate
+      if (now - lastSample >= streamInterval) {
+        lastSample = now;
+      }
+      streamSample();
+    }
+    // Don't hold samples back for long at low rates
+    if (frameFill > 0 && micros() - frameFirst >= maxFrameAge) {
+      sendStreamFrame();
+    }
+  }
+}
+
+void startStream(long rate) {
+  long maxRate = binaryMode ? maxBinaryStreamRate : maxStreamRate;
+  if (rate <= 0) {
+    rate = 100;
+  } else if (rate > maxRate) {
+    rate = maxRate;
+  }
+  streamInterval = 1000000UL / rate;
+  Serial.print("Streaming at ");
+  Serial.print(rate);
+  Serial.println(" Hz. Type 'stop' to end.");
+  lastSample = micros();
+  streaming = true;
+}
+
+void streamSample() {
+  if (binaryMode) {
+    unsigned long now = micros();
+    if (frameFill == 0) {
+      frameFirst = now;
+    }
+    frameLast = now;
+    frameCounts[frameFill++] = analogRead(sensorPin);
+    if (frameFill == maxFrameSamples) {
+      sendStreamFrame();
+    }
+    return;
+  }
+  // Compact line: "S:<millis>,<voltage>" so the host can timestamp each sample
+  voltage = analogRead(sensorPin) * 5.0 / 1023.0;
+  Serial.print("S:");
+  Serial.print(millis());
+  Serial.print(',');
+  Serial.println(voltage, 3);
 }
 
 void calibrate() {
   Serial.println("Calibrating dark signal...");
-  Serial.print("Dark Voltage: ");
-  Serial.println(darkVoltage);
+  measureDark();
 
   Serial.println("Please calibrate with blank. Waiting for 10 seconds...");
   delay(10000); // Wait for user to place the blank
@@ -46,6 +161,51 @@ void calibrate() {
   Serial.println("Calibration complete. You can now type 'read' to measure samples.");
 }
 
+void measureDark() {
+  // Photodiode output with the LED switched off, averaged over a few readings
+  digitalWrite(ledPin, LOW);
+  delay(darkSettleTime);
+  darkVoltage = averageReading(darkReadings);
+  digitalWrite(ledPin, HIGH);
+  delay(darkSettleTime);
+  Serial.print("Dark Voltage: ");
+  Serial.println(darkVoltage, 3);
+}
+
+float averageReading(int count) {
+  long sum = 0;
+  for (int i = 0; i < count; i++) {
+    sum += analogRead(sensorPin);
+  }
+  return sum * 5.0 / 1023.0 / count;
+}
+
+void scan(bool blank) {
+  // For each channel, the dark signal with every LED off and the voltage
+  // with only that channel's LED on: "<channel>,<nm>,<dark>,<voltage>".
+  // No placement delay, so scans can follow each other back to back.
+  digitalWrite(ledPin, LOW);
+  for (int i = 0; i < scanChannels; i++) {
+    delay(scanSettleTime);
+    float dark = averageReading(scanReadings);
+    digitalWrite(scanPins[i], HIGH);
+    delay(scanSettleTime);
+    float lit = averageReading(scanReadings);
+    digitalWrite(scanPins[i], LOW);
+    Serial.print(blank ? "Scan Blank: " : "Scan: ");
+    Serial.print(i);
+    Serial.print(',');
+    Serial.print(scanWavelengths[i]);
+    Serial.print(',');
+    Serial.print(dark, 3);
+    Serial.print(',');
+    Serial.println(lit, 3);
+  }
+  digitalWrite(ledPin, HIGH);   // back to the single-wavelength LED
+  Serial.print("Scan Done: ");
+  Serial.println(scanChannels);
+}
+
 void readSample() {
   Serial.println("Place the sample. Reading in 5 seconds...");
   delay(5000); // Wait for user to place the sample
@@ -68,3 +228,79 @@ void readSample() {
   Serial.print("Absorbance: ");
   Serial.println(absorbance);
 }
+
+void readRawSamples(long count) {
+  // Prints raw ADC counts ("Raw:<0-1023>") so the host can average them
+  // and reject outliers; "Raw Done: <k>" ends the burst.
+  if (count <= 0) {
+    count = 1;
+  } else if (count > maxOversample) {
+    count = maxOversample;
+  }
+  Serial.print("Place the sample. Reading ");
+  Serial.print(count);
+  Serial.println(" raw samples in 5 seconds...");
+  delay(5000); // Wait for user to place the sample
+
+  for (long i = 0; i < count; i++) {
+    Serial.print("Raw:");
+    Serial.println(analogRead(sensorPin));
+  }
+  Serial.print("Raw Done: ");
+  Serial.println(count);
+}
+
+void setBaudRate(long rate) {
+  // Replies at the old rate, then switches; the host follows once it has
+  // read the reply. Unsupported rates leave the link as it is.
+  for (unsigned int i = 0; i < sizeof(baudRates) / sizeof(baudRates[0]); i++) {
+    if (baudRates[i] == rate) {
+      baudRate = rate;
+    }
+  }
+  Serial.print("Baud: ");
+  Serial.println(baudRate);
+  Serial.flush();
+  Serial.end();
+  Serial.begin(baudRate);
+}
+
+uint16_t crc16Update(uint16_t crc, byte value) {
+  crc ^= (uint16_t)value << 8;
+  for (byte bit = 0; bit < 8; bit++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+void writeCrc(byte value, uint16_t &crc) {
+  Serial.write(value);
+  crc = crc16Update(crc, value);
+}
+
+void writeU32(unsigned long value, uint16_t &crc) {
+  for (byte i = 0; i < 4; i++) {
+    writeCrc((value >> (8 * i)) & 0xFF, crc);
+  }
+}
+
+void sendStreamFrame() {
+  if (frameFill == 0) {
+    return;
+  }
+  uint16_t crc = 0xFFFF;
+  Serial.write(0xA5);
+  Serial.write(0x5A);
+  writeCrc(frameStream, crc);
+  writeCrc(frameSeq++, crc);
+  writeCrc(8 + 2 * frameFill, crc);
+  writeU32(frameFirst, crc);
+  writeU32(frameLast, crc);
+  for (byte i = 0; i < frameFill; i++) {
+    writeCrc(frameCounts[i] & 0xFF, crc);
+    writeCrc(frameCounts[i] >> 8, crc);
+  }
+  Serial.write(crc & 0xFF);
+  Serial.write(crc >> 8);
+  frameFill = 0;
+}
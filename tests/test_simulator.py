@@ -0,0 +1,67 @@
+"""End-to-end checks against the virtual spectrophotometer.
+
+The simulator answers on a pty like the sketch does, so these run the real
+reader, parser, state machine and engine without hardware.
+
+    python -m pytest tests
+"""
+
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+serial = pytest.importorskip('serial')
+
+from intellispec.beer_lambert import absorbance  # noqa: E402
+from intellispec.calibration import CalibrationStore  # noqa: E402
+from intellispec.engine import MeasurementEngine  # noqa: E402
+from intellispec.protocol import StreamSample, parse_lines  # noqa: E402
+from intellispec.simulator import VirtualSpectrophotometer  # noqa: E402
+
+
+@pytest.fixture
+def device():
+    simulator = VirtualSpectrophotometer(time_scale=0.01, noise=0.0, seed=1)
+    simulator.start()
+    yield simulator
+    simulator.stop()
+
+
+def test_engine_calibrates_and_measures(device, tmp_path):
+    calibrations = CalibrationStore(str(tmp_path / 'calibrations.json'))
+    with MeasurementEngine(device.port, ready_timeout=0, calibrations=calibrations) as engine:
+        blank = engine.calibrate()
+        readings = engine.measure(['a', 'b'], replicates=2)
+    # The engine uses the dark the device measured during calibration
+    assert engine.dark_voltage == engine.device_dark_voltage
+    assert engine.dark_voltage == pytest.approx(device.dark_voltage, abs=0.005)
+    assert blank == pytest.approx(device.blank_voltage, abs=0.005)
+    assert [(reading.label, reading.replicate) for reading in readings] == \
+        [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+    for reading in readings:
+        assert reading.voltage == pytest.approx(device.sample_voltage, abs=0.005)
+        assert reading.absorbance == pytest.approx(absorbance(reading.voltage, blank, engine.dark_voltage))
+        assert not math.isnan(reading.transmittance)
+
+
+def test_stream_lines_parse(device):
+    port = serial.Serial(device.port, 9600, timeout=0.05)
+    try:
+        port.write(b'stream 100\n')
+        lines = []
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and len(lines) < 50:
+            lines.append(port.readline().decode().strip())
+        port.write(b'stop\n')
+    finally:
+        port.close()
+    samples = [record for record in parse_lines(lines) if isinstance(record, StreamSample)]
+    assert len(samples) >= 20
+    millis = [sample.t_ms for sample in samples]
+    assert millis == sorted(millis)
+    assert all(sample.voltage == pytest.approx(device.sample_voltage, abs=0.005) for sample in samples)